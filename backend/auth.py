@@ -1,10 +1,15 @@
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
 from typing import Optional
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 from . import models, database
 import os
 
@@ -13,8 +18,16 @@ SECRET_KEY = os.getenv("SECRET_KEY", "your-secret-key-change-it-in-production")
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
+# How long a resolved user is trusted without going back to the database.
+# Other workers see revocations (token_version bumps) at most this late.
+PRINCIPAL_CACHE_TTL_SECONDS = float(os.getenv("AUTH_PRINCIPAL_CACHE_TTL_SECONDS", "30"))
+PRINCIPAL_CACHE_MAX_ENTRIES = int(os.getenv("AUTH_PRINCIPAL_CACHE_MAX_ENTRIES", "10000"))
+# bcrypt runs here instead of on the event loop; bounded so a login storm can't spawn unbounded threads
+PASSWORD_HASH_WORKERS = int(os.getenv("AUTH_PASSWORD_HASH_WORKERS", "4"))
+
 pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
+_hash_executor = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="bcrypt")
 
 def verify_password(plain_password, hashed_password):
     return pwd_context.verify(plain_password, hashed_password)
@@ -22,6 +35,71 @@ def verify_password(plain_password, hashed_password):
 def get_password_hash(password):
     return pwd_context.hash(password)
 
+async def verify_password_async(plain_password, hashed_password):
+    """verify_password for async handlers, run in the bounded bcrypt pool."""
+    return await asyncio.get_running_loop().run_in_executor(_hash_executor, verify_password, plain_password, hashed_password)
+
+async def get_password_hash_async(password):
+    """get_password_hash for async handlers, run in the bounded bcrypt pool."""
+    return await asyncio.get_running_loop().run_in_executor(_hash_executor, get_password_hash, password)
+
+class Principal:
+    """Snapshot of an authenticated user, safe to share between requests and sessions."""
+
+    __slots__ = ("id", "username", "full_name", "hashed_password", "is_active", "role", "token_version")
+
+    def __init__(self, user: models.User):
+        self.id = user.id
+        self.username = user.username
+        self.full_name = user.full_name
+        self.hashed_password = user.hashed_password
+        self.is_active = user.is_active
+        self.role = user.role
+        self.token_version = user.token_version or 0
+
+_principals: dict[str, tuple[float, Principal]] = {}
+_principals_lock = threading.Lock()
+
+def _cached_principal(username: str) -> Optional[Principal]:
+    with _principals_lock:
+        entry = _principals.get(username)
+        if entry is None:
+            return None
+        expires_at, principal = entry
+        if expires_at < time.monotonic():
+            del _principals[username]
+            return None
+        return principal
+
+def _cache_principal(principal: Principal):
+    now = time.monotonic()
+    with _principals_lock:
+        if len(_principals) >= PRINCIPAL_CACHE_MAX_ENTRIES:
+            for key in [k for k, (expires_at, _) in _principals.items() if expires_at < now]:
+                del _principals[key]
+            if len(_principals) >= PRINCIPAL_CACHE_MAX_ENTRIES:
+                _principals.clear()
+        _principals[principal.username] = (now + PRINCIPAL_CACHE_TTL_SECONDS, principal)
+
+def invalidate_principal(username: str):
+    """Forgets a cached user; call whenever the user row changes or is deleted."""
+    with _principals_lock:
+        _principals.pop(username, None)
+
+def revoke_tokens(user: models.User):
+    """Invalidates every token issued to the user so far.
+
+    The caller commits and then calls invalidate_principal: clearing the cache
+    before the commit lets a concurrent request cache the old version again.
+    """
+    user.token_version = (user.token_version or 0) + 1
+
+def create_user_token(user) -> str:
+    access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+    return create_access_token(
+        data={"sub": user.username, "ver": user.token_version or 0}, expires_delta=access_token_expires
+    )
+
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -32,7 +110,7 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = Depends(database.get_db)):
+async def get_current_user(token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(database.get_async_db)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
         detail="Could not validate credentials",
@@ -41,21 +119,31 @@ async def get_current_user(token: str = Depends(oauth2_scheme), db: Session = De
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         username: str = payload.get("sub")
+        token_version = payload.get("ver", 0)
         if username is None:
             raise credentials_exception
     except JWTError:
         raise credentials_exception
-    user = db.query(models.User).filter(models.User.username == username).first()
-    if user is None:
+
+    principal = _cached_principal(username)
+    if principal is None:
+        result = await db.execute(select(models.User).where(models.User.username == username))
+        user = result.scalars().first()
+        if user is None:
+            raise credentials_exception
+        principal = Principal(user)
+        _cache_principal(principal)
+    if principal.token_version != token_version:
+        # Token was issued before a password, role or status change
         raise credentials_exception
-    return user
+    return principal
 
-async def get_current_active_user(current_user: models.User = Depends(get_current_user)):
+async def get_current_active_user(current_user: Principal = Depends(get_current_user)):
     if not current_user.is_active:
         raise HTTPException(status_code=400, detail="Inactive user")
     return current_user
 
-async def get_current_admin_user(current_user: models.User = Depends(get_current_active_user)):
+async def get_current_admin_user(current_user: Principal = Depends(get_current_active_user)):
     if current_user.role != "admin":
         raise HTTPException(status_code=403, detail="Not authorized")
     return current_user
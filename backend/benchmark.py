@@ -0,0 +1,268 @@
+"""Load test for the ingestion, evaluation and reporting endpoints.
+
+Run it against a server started with the fake provider so results only
+depend on this code, e.g.
+
+    MODEL_PROVIDER=fake uvicorn backend.main:app --port 8000
+    python -m backend.benchmark --concurrency 8 --requests 40 --json bench.json
+
+Every scenario is a closed loop: `concurrency` clients issue `requests`
+requests in total, each client sending its next request when the previous
+one has answered. The report gives throughput and latency percentiles per
+scenario. With --baseline the run is compared to an earlier --json output
+and the exit status is 1 when throughput or p95 regressed past
+--max-regression.
+"""
+import argparse
+import json
+import math
+import random
+import sys
+import time
+import urllib.error
+import urllib.request
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+
+SCENARIOS = ("process-files", "evaluate", "stats")
+JOB_POLL_SECONDS = 0.2
+
+class Client:
+    def __init__(self, base_url: str, token: str | None = None, timeout: float = 600):
+        self.base_url = base_url.rstrip("/")
+        self.token = token
+        self.timeout = timeout
+
+    def request(self, method: str, path: str, body: bytes | None = None, content_type: str | None = None):
+        req = urllib.request.Request(self.base_url + path, data=body, method=method)
+        if content_type:
+            req.add_header("Content-Type", content_type)
+        if self.token:
+            req.add_header("Authorization", f"Bearer {self.token}")
+        with urllib.request.urlopen(req, timeout=self.timeout) as response:
+            payload = response.read()
+        return json.loads(payload) if payload else None
+
+    def json(self, method: str, path: str, data) -> dict:
+        return self.request(method, path, json.dumps(data).encode(), "application/json")
+
+    def form(self, path: str, fields: dict, files: list[tuple[str, str, bytes]] = ()) -> dict:
+        body, content_type = encode_multipart(fields, files)
+        return self.request("POST", path, body, content_type)
+
+def encode_multipart(fields: dict, files: list[tuple[str, str, bytes]]) -> tuple[bytes, str]:
+    boundary = uuid.uuid4().hex
+    parts = []
+    for name, value in fields.items():
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+        )
+    for name, filename, content in files:
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"; filename="{filename}"\r\n'
+            f'Content-Type: application/pdf\r\n\r\n'.encode() + content + b"\r\n"
+        )
+    parts.append(f"--{boundary}--\r\n".encode())
+    return b"".join(parts), f"multipart/form-data; boundary={boundary}"
+
+def percentile(sorted_values: list[float], p: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(p / 100 * len(sorted_values)))
+    return sorted_values[rank - 1]
+
+def summarize(name: str, latencies: list[float], errors: list[str], elapsed: float) -> dict:
+    values = sorted(latencies)
+    return {
+        "scenario": name,
+        "requests": len(values) + len(errors),
+        "errors": len(errors),
+        "elapsed_seconds": round(elapsed, 3),
+        "throughput_rps": round(len(values) / elapsed, 3) if elapsed else 0.0,
+        "mean_ms": round(sum(values) / len(values) * 1000, 1) if values else 0.0,
+        "p50_ms": round(percentile(values, 50) * 1000, 1),
+        "p95_ms": round(percentile(values, 95) * 1000, 1),
+        "p99_ms": round(percentile(values, 99) * 1000, 1),
+        "max_ms": round(values[-1] * 1000, 1) if values else 0.0,
+        "sample_errors": errors[:5],
+    }
+
+def run_closed_loop(name: str, operation, requests: int, concurrency: int) -> list[dict]:
+    """Runs `operation(i)` `requests` times over `concurrency` threads.
+
+    `operation` returns the latency to report, or a dict of named latencies
+    when one request yields several measurements (each becomes a row).
+    """
+    measurements: dict[str, list[float]] = {}
+    errors: list[str] = []
+
+    def one(i: int):
+        try:
+            result = operation(i)
+        except urllib.error.HTTPError as e:
+            errors.append(f"HTTP {e.code}: {e.read()[:200].decode(errors='replace')}")
+            return
+        except Exception as e:
+            errors.append(str(e))
+            return
+        for key, value in (result if isinstance(result, dict) else {name: result}).items():
+            measurements.setdefault(key, []).append(value)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        list(pool.map(one, range(requests)))
+    elapsed = time.perf_counter() - started
+    if not measurements:
+        return [summarize(name, [], errors, elapsed)]
+    return [summarize(key, values, errors, elapsed) for key, values in measurements.items()]
+
+class Benchmark:
+    def __init__(self, client: Client, args):
+        self.client = client
+        self.args = args
+        self.package_id = None
+        self.contractor_ids: list[int] = []
+        self.prompts = [f"Tiêu chí đánh giá số {i + 1}: năng lực và kinh nghiệm của nhà thầu" for i in range(args.criteria)]
+
+    def setup(self):
+        package = self.client.json("POST", "/bid_packages/", {
+            "name": f"benchmark-{uuid.uuid4().hex[:8]}", "description": "Created by backend.benchmark",
+        })
+        self.package_id = package["id"]
+        for i in range(self.args.contractors or self.args.concurrency):
+            contractor = self.client.json("POST", "/contractors/", {
+                "name": f"benchmark contractor {i + 1}", "bid_package_id": self.package_id,
+            })
+            self.contractor_ids.append(contractor["id"])
+
+    def teardown(self):
+        if self.package_id is not None and not self.args.keep:
+            self.client.request("DELETE", f"/bid_packages/{self.package_id}")
+
+    def _files(self, i: int) -> list[tuple[str, str, bytes]]:
+        # Unique content per request, otherwise deduplication would skip the uploads
+        size = self.args.file_size_kb * 1024
+        return [
+            ("files", f"bench-{i}-{n}.pdf", random.Random(f"{self.args.seed}:{i}:{n}").randbytes(size))
+            for n in range(self.args.files_per_request)
+        ]
+
+    def process_files(self, i: int) -> float:
+        contractor_id = self.contractor_ids[i % len(self.contractor_ids)]
+        files = self._files(i)
+        started = time.perf_counter()
+        self.client.form(f"/contractors/{contractor_id}/process-files", {}, files)
+        return time.perf_counter() - started
+
+    def ensure_ingested(self):
+        """Gives every contractor a store when the evaluate scenario runs on its own."""
+        with ThreadPoolExecutor(max_workers=self.args.concurrency) as pool:
+            list(pool.map(self.process_files, range(len(self.contractor_ids))))
+
+    def evaluate(self, i: int) -> dict:
+        contractor_id = self.contractor_ids[i % len(self.contractor_ids)]
+        # Vary the prompts per request so the evaluation cache doesn't answer everything
+        prompts = [f"{p} (lượt {i})" for p in self.prompts] if self.args.unique_prompts else self.prompts
+        started = time.perf_counter()
+        job = self.client.form("/evaluate/", {
+            "contractor_id": contractor_id,
+            "prompts": json.dumps(prompts, ensure_ascii=False),
+            "group_criteria": str(self.args.group_criteria).lower(),
+        })
+        accepted = time.perf_counter() - started
+        while True:
+            state = self.client.request("GET", f"/evaluate/jobs/{job['job_id']}")
+            if state["status"] not in ("pending", "running"):
+                break
+            time.sleep(JOB_POLL_SECONDS)
+        if state["status"] != "completed":
+            raise RuntimeError(f"Job {job['job_id']} ended {state['status']}: {state.get('error')}")
+        return {"evaluate (accept)": accepted, "evaluate (job)": time.perf_counter() - started}
+
+    def stats(self, i: int) -> float:
+        path = "/reports/stats?breakdown=true" if i % 2 else f"/reports/stats?bid_package_id={self.package_id}"
+        started = time.perf_counter()
+        self.client.request("GET", path)
+        return time.perf_counter() - started
+
+    def run(self, scenarios: list[str]) -> list[dict]:
+        rows = []
+        args = self.args
+        if "process-files" in scenarios:
+            rows += run_closed_loop("process-files", self.process_files, args.requests, args.concurrency)
+        elif "evaluate" in scenarios:
+            self.ensure_ingested()
+        if "evaluate" in scenarios:
+            rows += run_closed_loop("evaluate", self.evaluate, args.requests, args.concurrency)
+        if "stats" in scenarios:
+            rows += run_closed_loop("stats", self.stats, args.requests, args.concurrency)
+        return rows
+
+def print_report(rows: list[dict]):
+    columns = ("scenario", "requests", "errors", "throughput_rps", "p50_ms", "p95_ms", "p99_ms", "max_ms")
+    widths = [max(len(c), *(len(str(r[c])) for r in rows)) for c in columns]
+    print("  ".join(c.ljust(w) for c, w in zip(columns, widths)))
+    for row in rows:
+        print("  ".join(str(row[c]).ljust(w) for c, w in zip(columns, widths)))
+    for row in rows:
+        for error in row["sample_errors"]:
+            print(f"{row['scenario']}: {error}", file=sys.stderr)
+
+def compare(rows: list[dict], baseline: list[dict], max_regression: float) -> list[str]:
+    """Lists the scenarios that are slower than the baseline by more than max_regression."""
+    previous = {row["scenario"]: row for row in baseline}
+    regressions = []
+    for row in rows:
+        before = previous.get(row["scenario"])
+        if not before:
+            continue
+        if before["throughput_rps"] and row["throughput_rps"] < before["throughput_rps"] * (1 - max_regression):
+            regressions.append(f"{row['scenario']}: throughput {before['throughput_rps']} -> {row['throughput_rps']} rps")
+        if before["p95_ms"] and row["p95_ms"] > before["p95_ms"] * (1 + max_regression):
+            regressions.append(f"{row['scenario']}: p95 {before['p95_ms']} -> {row['p95_ms']} ms")
+    return regressions
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Load test process-files, /evaluate/ and /reports/stats.")
+    parser.add_argument("--base-url", default="http://localhost:8000")
+    parser.add_argument("--scenario", action="append", choices=SCENARIOS, help="Repeatable, default: all")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=40, help="Requests per scenario")
+    parser.add_argument("--contractors", type=int, default=0, help="Default: one per concurrent client")
+    parser.add_argument("--files-per-request", type=int, default=2)
+    parser.add_argument("--file-size-kb", type=int, default=256)
+    parser.add_argument("--criteria", type=int, default=10, help="Prompts per /evaluate/ request")
+    parser.add_argument("--group-criteria", action="store_true")
+    parser.add_argument("--unique-prompts", action="store_true", help="Defeat the evaluation cache")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--token", help="Bearer token, if the server requires one")
+    parser.add_argument("--keep", action="store_true", help="Keep the benchmark bid package")
+    parser.add_argument("--json", help="Write the report rows to this file")
+    parser.add_argument("--baseline", help="Earlier --json output to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.10)
+    args = parser.parse_args(argv)
+
+    bench = Benchmark(Client(args.base_url, args.token), args)
+    bench.setup()
+    try:
+        rows = bench.run(args.scenario or list(SCENARIOS))
+    finally:
+        bench.teardown()
+
+    print_report(rows)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "rows": rows}, f, indent=2, ensure_ascii=False)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(rows, json.load(f)["rows"], args.max_regression)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,179 @@
+import hashlib
+import os
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from sqlalchemy.dialects.postgresql import insert
+from . import models, database, services
+
+EVAL_CACHE_TTL_SECONDS = int(os.getenv("EVAL_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+EVAL_CACHE_MAX_ENTRIES = int(os.getenv("EVAL_CACHE_MAX_ENTRIES", "2000"))
+
+class LRUCache:
+    """Thread-safe in-process LRU with a per-entry TTL."""
+
+    def __init__(self, max_entries: int, ttl_seconds: int):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self._entries: OrderedDict[str, tuple[float, int, dict]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> dict | None:
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, _, value = entry
+            if expires_at < time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def put(self, key: str, contractor_id: int, value: dict, ttl_seconds: float | None = None):
+        ttl = self.ttl_seconds if ttl_seconds is None else ttl_seconds
+        with self._lock:
+            self._entries[key] = (time.monotonic() + ttl, contractor_id, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def discard_contractor(self, contractor_id: int):
+        with self._lock:
+            for key in [k for k, (_, cid, _) in self._entries.items() if cid == contractor_id]:
+                del self._entries[key]
+
+    def __len__(self):
+        return len(self._entries)
+
+_memory = LRUCache(EVAL_CACHE_MAX_ENTRIES, EVAL_CACHE_TTL_SECONDS)
+_counters = {"memory_hits": 0, "db_hits": 0, "misses": 0}
+
+def contractor_fingerprint(contractor_id: int) -> str:
+    """Fingerprints the contractor's current file set.
+
+    Uses content hashes where available so re-uploads of identical content
+    keep the same fingerprint.
+    """
+    db = database.SessionLocal()
+    try:
+        rows = db.query(models.ContractorFile.content_hash, models.ContractorFile.gemini_file_name).filter(
+            models.ContractorFile.contractor_id == contractor_id,
+            models.ContractorFile.gemini_file_name.isnot(None)
+        ).all()
+    finally:
+        db.close()
+    parts = sorted(content_hash or file_name for content_hash, file_name in rows)
+    return hashlib.sha256("\n".join(parts).encode()).hexdigest()
+
+def normalize_prompt(prompt: str) -> str:
+    return " ".join(prompt.split())
+
+def make_key(fingerprint: str, prompt: str, template: str | None = None) -> str:
+    """Builds the cache key; `template` defaults to the single-criterion prompt version."""
+    raw = "\x1f".join([
+        fingerprint,
+        normalize_prompt(prompt),
+        services.EVAL_MODEL,
+        template or str(services.EVAL_PROMPT_VERSION),
+    ])
+    return hashlib.sha256(raw.encode()).hexdigest()
+
+def get(key: str) -> dict | None:
+    """Looks a result up in memory, then in the database. Blocking."""
+    value = _memory.get(key)
+    if value is not None:
+        _counters["memory_hits"] += 1
+        return value
+
+    db = database.SessionLocal()
+    try:
+        entry = db.query(models.EvaluationCacheEntry).filter(models.EvaluationCacheEntry.cache_key == key).first()
+        if not entry:
+            _counters["misses"] += 1
+            return None
+        age = (datetime.utcnow() - entry.created_at).total_seconds()
+        if age > EVAL_CACHE_TTL_SECONDS:
+            db.delete(entry)
+            db.commit()
+            _counters["misses"] += 1
+            return None
+        value = {
+            "text": entry.response_text,
+            "comment": entry.comment,
+            "evidence": entry.evidence,
+            "input_tokens": entry.input_tokens,
+            "output_tokens": entry.output_tokens,
+        }
+        entry.hit_count = (entry.hit_count or 0) + 1
+        db.commit()
+        _memory.put(key, entry.contractor_id, value, ttl_seconds=EVAL_CACHE_TTL_SECONDS - age)
+        _counters["db_hits"] += 1
+        return value
+    finally:
+        db.close()
+
+def put(key: str, contractor_id: int, eval_result: dict):
+    """Stores a fresh model result in both tiers. Blocking."""
+    value = {
+        "text": eval_result["text"],
+        "comment": eval_result.get("comment"),
+        "evidence": eval_result.get("evidence"),
+        "input_tokens": eval_result["input_tokens"],
+        "output_tokens": eval_result["output_tokens"],
+    }
+    _memory.put(key, contractor_id, value)
+    db = database.SessionLocal()
+    try:
+        # Concurrent puts of the same key (duplicate prompts, identical file sets) keep the first row
+        db.execute(insert(models.EvaluationCacheEntry).values(
+            cache_key=key,
+            contractor_id=contractor_id,
+            response_text=value["text"],
+            comment=value["comment"],
+            evidence=value["evidence"],
+            input_tokens=value["input_tokens"],
+            output_tokens=value["output_tokens"],
+        ).on_conflict_do_nothing(index_elements=["cache_key"]))
+        db.commit()
+    finally:
+        db.close()
+
+def discard_from_memory(contractor_id: int):
+    """Drops only the in-process entries; for callers that delete the DB rows themselves."""
+    _memory.discard_contractor(contractor_id)
+
+def invalidate_contractor(contractor_id: int, db=None):
+    """Drops every cached result of a contractor, e.g. after its files changed.
+
+    When a session is passed the delete joins the caller's transaction.
+    """
+    _memory.discard_contractor(contractor_id)
+    own_session = db is None
+    if own_session:
+        db = database.SessionLocal()
+    try:
+        db.query(models.EvaluationCacheEntry).filter(
+            models.EvaluationCacheEntry.contractor_id == contractor_id
+        ).delete(synchronize_session=False)
+        if own_session:
+            db.commit()
+    finally:
+        if own_session:
+            db.close()
+
+def purge_expired():
+    """Deletes expired database entries."""
+    cutoff = datetime.utcnow() - timedelta(seconds=EVAL_CACHE_TTL_SECONDS)
+    db = database.SessionLocal()
+    try:
+        db.query(models.EvaluationCacheEntry).filter(
+            models.EvaluationCacheEntry.created_at < cutoff
+        ).delete(synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+def stats() -> dict:
+    return {**_counters, "memory_entries": len(_memory)}
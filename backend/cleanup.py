@@ -0,0 +1,119 @@
+import asyncio
+import os
+import random
+from sqlalchemy import select, delete, update
+from . import models, services, cache, retrieval
+
+CLEANUP_CONCURRENCY = int(os.getenv("CLEANUP_CONCURRENCY", "4"))
+CLEANUP_MAX_ATTEMPTS = int(os.getenv("CLEANUP_MAX_ATTEMPTS", "5"))
+CLEANUP_RETRY_BASE_SECONDS = float(os.getenv("CLEANUP_RETRY_BASE_SECONDS", "2"))
+
+KIND_STORE = "store"
+KIND_FILE = "file"
+
+class CleanupQueue:
+    """Deletes remote stores and files in the background, in parallel, with retries.
+
+    The queue lives in memory; anything lost on restart is left to the
+    reconciliation sweeper to collect.
+    """
+
+    def __init__(self, concurrency: int):
+        self.concurrency = concurrency
+        self._queue: asyncio.Queue | None = None
+        self._workers: list[asyncio.Task] = []
+        self.failed: list[dict] = [] # Deletions that exhausted their retries
+
+    def _ensure_started(self):
+        if self._queue is None:
+            self._queue = asyncio.Queue()
+            loop = asyncio.get_running_loop()
+            self._workers = [loop.create_task(self._worker()) for _ in range(self.concurrency)]
+
+    def enqueue(self, kind: str, name: str, attempt: int = 1):
+        """Queues a deletion; must be called from the event loop thread."""
+        self._ensure_started()
+        self._queue.put_nowait((kind, name, attempt))
+
+    def enqueue_stores(self, names):
+        for name in names:
+            if name:
+                self.enqueue(KIND_STORE, name)
+
+    def enqueue_files(self, names):
+        for name in names:
+            if name:
+                self.enqueue(KIND_FILE, name)
+
+    def pending(self) -> int:
+        return self._queue.qsize() if self._queue else 0
+
+    async def _worker(self):
+        while True:
+            kind, name, attempt = await self._queue.get()
+            try:
+                func = services.delete_store if kind == KIND_STORE else services.delete_file
+                await asyncio.to_thread(func, name)
+            except Exception as e:
+                if attempt >= CLEANUP_MAX_ATTEMPTS:
+                    print(f"Giving up deleting {kind} {name} after {attempt} attempts: {e}")
+                    self.failed.append({"kind": kind, "name": name, "error": str(e)})
+                else:
+                    # Jittered exponential backoff; the retry re-enters the queue later
+                    delay = CLEANUP_RETRY_BASE_SECONDS * 2 ** (attempt - 1) * random.uniform(0.5, 1.5)
+                    asyncio.get_running_loop().call_later(delay, self.enqueue, kind, name, attempt + 1)
+            finally:
+                self._queue.task_done()
+
+    async def stop(self):
+        for worker in self._workers:
+            worker.cancel()
+        await asyncio.gather(*self._workers, return_exceptions=True)
+        self._workers = []
+        self._queue = None
+
+cleanup_queue = CleanupQueue(CLEANUP_CONCURRENCY)
+
+async def delete_contractors(db, contractor_ids) -> dict:
+    """Deletes contractors and everything hanging off them with one statement per table.
+
+    `contractor_ids` is a select of contractor ids. Returns the remote store
+    and file names that are no longer referenced; the caller commits and then
+    hands them to the cleanup queue.
+    """
+    ids = list((await db.execute(contractor_ids)).scalars())
+    if not ids:
+        return {"contractor_ids": [], "stores": [], "files": []}
+
+    stores = list((await db.execute(
+        select(models.Contractor.gemini_store_name).where(
+            models.Contractor.id.in_(ids), models.Contractor.gemini_store_name.isnot(None)
+        )
+    )).scalars())
+    file_names = set((await db.execute(
+        select(models.ContractorFile.gemini_file_name).where(
+            models.ContractorFile.contractor_id.in_(ids), models.ContractorFile.gemini_file_name.isnot(None)
+        ).distinct()
+    )).scalars())
+
+    for model in (models.DocumentChunk, models.ContractorFile, models.EvaluationResult, models.EvaluationCacheEntry):
+        await db.execute(delete(model).where(model.contractor_id.in_(ids)))
+    # Usage already happened and was paid for: keep it in the reports, detached from the contractor
+    await db.execute(
+        update(models.UsageRollup).where(models.UsageRollup.contractor_id.in_(ids)).values(contractor_id=None)
+    )
+    await db.execute(delete(models.Contractor).where(models.Contractor.id.in_(ids)))
+
+    # Remote files can be shared through deduplication, only drop the ones nobody references now
+    still_used = set()
+    if file_names:
+        still_used = set((await db.execute(
+            select(models.ContractorFile.gemini_file_name).where(
+                models.ContractorFile.gemini_file_name.in_(file_names)
+            ).distinct()
+        )).scalars())
+
+    for contractor_id in ids:
+        cache.discard_from_memory(contractor_id)
+        retrieval.forget_contractor(contractor_id)
+    return {"contractor_ids": ids, "stores": stores, "files": sorted(file_names - still_used)}
@@ -0,0 +1,153 @@
+from sqlalchemy import func
+from sqlalchemy.dialects.postgresql import aggregate_order_by, array_agg
+from . import models
+
+# Contractor x criterion comparison for a bid package, see GET /bid_packages/{id}/comparison.
+#
+# Results are matched to the set's criteria by prompt text, not by criteria_id:
+# that is the prompt's position when the result was produced, and editing the
+# set can reorder, insert or remove prompts. A reworded prompt is a new
+# criterion, without scores until it is evaluated again.
+#
+# selection:
+#   latest_run  each contractor's scores come from its most recent run with the set;
+#               criteria that run didn't score (failed, cancelled) stay empty
+#   latest      the most recent score of each criterion, whatever run produced it
+# normalization:
+#   scale       score / 10
+#   minmax      per criterion, (score - min) / (max - min) over the contractors
+#               scored on it; 1.0 for everyone when they all scored the same
+
+SELECTIONS = ("latest_run", "latest")
+NORMALIZATIONS = ("scale", "minmax")
+MAX_SCORE = 10
+
+def weights_for(criteria_set: models.CriteriaSet) -> list[float]:
+    """The set's weights, or equal weights when it has none."""
+    if criteria_set.weights and len(criteria_set.weights) == len(criteria_set.prompts):
+        return [float(w) for w in criteria_set.weights]
+    return [1.0] * len(criteria_set.prompts)
+
+def fetch_scores(db, bid_package_id: int, criteria_set_id: int) -> list[tuple]:
+    """One grouped query: per (contractor, run, prompt), its latest score and when it was produced.
+
+    A criterion scored twice in the same run (a retried entry) keeps the later score.
+    """
+    result = models.EvaluationResult
+    latest_first = (result.created_at.desc(), result.id.desc())
+    return db.query(
+        result.contractor_id,
+        result.job_id,
+        result.criteria_prompt,
+        array_agg(aggregate_order_by(result.score, *latest_first))[1],
+        func.max(result.created_at),
+    ).join(models.Contractor, models.Contractor.id == result.contractor_id).filter(
+        models.Contractor.bid_package_id == bid_package_id,
+        result.criteria_set_id == criteria_set_id,
+        result.criteria_prompt.isnot(None),
+    ).group_by(result.contractor_id, result.job_id, result.criteria_prompt).all()
+
+def _select(rows: list[tuple], prompts: list[str], selection: str) -> dict[int, dict]:
+    """Reduces the grouped rows to one score per (contractor, prompt of the set)."""
+    current = set(prompts)
+    by_contractor: dict[int, dict] = {}
+    if selection == "latest_run":
+        # A run's time is when its last criterion was scored
+        run_times: dict[tuple, object] = {}
+        for contractor_id, job_id, _, _, created_at in rows:
+            key = (contractor_id, job_id)
+            if key not in run_times or created_at > run_times[key]:
+                run_times[key] = created_at
+        latest_runs: dict[int, tuple] = {}
+        for (contractor_id, job_id), created_at in run_times.items():
+            if contractor_id not in latest_runs or created_at > latest_runs[contractor_id][1]:
+                latest_runs[contractor_id] = (job_id, created_at)
+        rows = [row for row in rows if latest_runs[row[0]][0] == row[1]]
+
+    for contractor_id, job_id, prompt, score, created_at in rows:
+        if prompt not in current or score is None:
+            continue
+        entry = by_contractor.setdefault(contractor_id, {"scores": {}, "job_ids": set(), "evaluated_at": None})
+        best = entry["scores"].get(prompt)
+        if best is None or created_at > best[1]:
+            entry["scores"][prompt] = (score, created_at)
+        entry["job_ids"].add(job_id)
+        if entry["evaluated_at"] is None or created_at > entry["evaluated_at"]:
+            entry["evaluated_at"] = created_at
+    return by_contractor
+
+def _normalize_columns(matrix: list[list[int | None]], normalization: str) -> list[list[float | None]]:
+    """Normalizes every criterion column at once; empty cells stay None."""
+    if not matrix:
+        return []
+    if normalization == "scale":
+        return [[None if s is None else s / MAX_SCORE for s in row] for row in matrix]
+
+    columns = list(zip(*matrix))
+    bounds = []
+    for column in columns:
+        present = [s for s in column if s is not None]
+        bounds.append((min(present), max(present)) if present else (0, 0))
+    return [
+        [
+            None if s is None else (1.0 if high == low else (s - low) / (high - low))
+            for s, (low, high) in zip(row, bounds)
+        ]
+        for row in matrix
+    ]
+
+def _ranks(totals: list[float]) -> list[int]:
+    """Competition ranking (1, 1, 3): equal totals share a rank."""
+    order = sorted(range(len(totals)), key=lambda i: totals[i], reverse=True)
+    ranks = [0] * len(totals)
+    for position, i in enumerate(order):
+        if position and totals[i] == totals[order[position - 1]]:
+            ranks[i] = ranks[order[position - 1]]
+        else:
+            ranks[i] = position + 1
+    return ranks
+
+def build_matrix(criteria_set: models.CriteriaSet, contractors: list[tuple[int, str]], rows: list[tuple],
+                 selection: str = "latest_run", normalization: str = "scale") -> dict:
+    prompts = list(criteria_set.prompts or [])
+    weights = weights_for(criteria_set)
+    weight_sum = sum(weights) or 1.0
+    selected = _select(rows, prompts, selection)
+
+    matrix = []
+    for contractor_id, _ in contractors:
+        scores = selected.get(contractor_id, {}).get("scores", {})
+        matrix.append([scores[prompt][0] if prompt in scores else None for prompt in prompts])
+    normalized = _normalize_columns(matrix, normalization)
+
+    # Unscored criteria count as 0 in the total, coverage says how much of the weight was scored
+    totals, coverages = [], []
+    for row in normalized:
+        totals.append(round(sum(w * n for w, n in zip(weights, row) if n is not None) / weight_sum * MAX_SCORE, 4))
+        coverages.append(round(sum(w for w, n in zip(weights, row) if n is not None) / weight_sum, 4))
+    ranks = _ranks(totals)
+
+    return {
+        "criteria_set_id": criteria_set.id,
+        "selection": selection,
+        "normalization": normalization,
+        "criteria": [
+            {"index": i, "prompt": prompt, "weight": weight, "weight_share": round(weight / weight_sum, 4)}
+            for i, (prompt, weight) in enumerate(zip(prompts, weights))
+        ],
+        "contractors": [
+            {
+                "contractor_id": contractor_id,
+                "name": name,
+                "job_ids": sorted(j for j in selected.get(contractor_id, {}).get("job_ids", ()) if j),
+                "evaluated_at": selected.get(contractor_id, {}).get("evaluated_at"),
+                "scores": scores,
+                "normalized": [None if n is None else round(n, 4) for n in normalized_row],
+                "weighted_score": total,
+                "coverage": coverage,
+                "rank": rank,
+            }
+            for (contractor_id, name), scores, normalized_row, total, coverage, rank
+            in zip(contractors, matrix, normalized, totals, coverages, ranks)
+        ],
+    }
@@ -0,0 +1,123 @@
+import csv
+import io
+import os
+import tempfile
+from datetime import datetime
+from sqlalchemy import select
+from . import models, database, rollups
+
+try:
+    from openpyxl import Workbook
+    from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+except ImportError: # Optional: without it only CSV exports are available
+    Workbook = None
+
+# Evaluation export for a bid package.
+#
+# Rows come from a server-side cursor (stream_results) in batches of
+# EXPORT_BATCH_ROWS, so memory stays flat whatever the row count. The
+# generators below are synchronous; StreamingResponse iterates them in its
+# thread pool, which keeps the database reads and the encoding off the event
+# loop. CSV is sent as it is produced. XLSX is not streamed: it needs its zip
+# directory at the end, so the workbook (openpyxl write-only mode, rows go
+# straight to a temp file) is completed on disk first and only then sent in
+# EXPORT_CHUNK_BYTES. Nothing goes out while it is built, so very large
+# exports should use CSV or filters to stay within proxy timeouts.
+
+EXPORT_BATCH_ROWS = int(os.getenv("EXPORT_BATCH_ROWS", "2000"))
+EXPORT_CHUNK_BYTES = 256 * 1024
+FORMAT_CSV = "csv"
+FORMAT_XLSX = "xlsx"
+MEDIA_TYPES = {
+    FORMAT_CSV: "text/csv; charset=utf-8",
+    FORMAT_XLSX: "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+}
+COLUMNS = (
+    "result_id", "contractor_id", "contractor", "criteria_set_id", "criteria_set", "criteria_id", "job_id",
+    "created_at", "criteria_prompt", "score", "comment", "evidence", "input_tokens", "output_tokens",
+    "cached", "estimated_cost_usd",
+)
+# Excel refuses cells longer than this
+XLSX_MAX_CELL = 32767
+# Spreadsheet apps run cells starting with these as formulas
+FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+def formats() -> list[str]:
+    return [FORMAT_CSV] + ([FORMAT_XLSX] if Workbook else [])
+
+def export_query(bid_package_id: int, contractor_id: int | None = None, criteria_set_id: int | None = None,
+                 created_from: datetime | None = None, created_to: datetime | None = None):
+    result = models.EvaluationResult
+    stmt = select(
+        result.id, result.contractor_id, models.Contractor.name, result.criteria_set_id, models.CriteriaSet.name,
+        result.criteria_id, result.job_id, result.created_at, result.criteria_prompt, result.score,
+        result.comment, result.evidence, result.input_tokens, result.output_tokens, result.cached,
+    ).join(models.Contractor, models.Contractor.id == result.contractor_id).outerjoin(
+        models.CriteriaSet, models.CriteriaSet.id == result.criteria_set_id
+    ).where(models.Contractor.bid_package_id == bid_package_id)
+    if contractor_id is not None:
+        stmt = stmt.where(result.contractor_id == contractor_id)
+    if criteria_set_id is not None:
+        stmt = stmt.where(result.criteria_set_id == criteria_set_id)
+    if created_from:
+        stmt = stmt.where(result.created_at >= created_from)
+    if created_to:
+        stmt = stmt.where(result.created_at <= created_to)
+    # Follows ix_evaluation_results_contractor_id_created_at, no sort step before the first row
+    return stmt.order_by(result.contractor_id, result.created_at, result.id)
+
+def _rows(stmt):
+    """Yields export rows from a server-side cursor, one session for the whole export."""
+    db = database.SessionLocal()
+    try:
+        result = db.execute(stmt.execution_options(stream_results=True, yield_per=EXPORT_BATCH_ROWS))
+        for partition in result.partitions():
+            for row in partition:
+                input_tokens, output_tokens = row[12] or 0, row[13] or 0
+                yield (*row, round(rollups.estimate_cost(input_tokens, output_tokens, 0), 6))
+    finally:
+        db.close()
+
+def _csv_cell(value):
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, str) and value.startswith(FORMULA_PREFIXES):
+        # Model output is untrusted; a leading quote keeps it text
+        return "'" + value
+    return value
+
+def stream_csv(stmt):
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    # BOM so Excel opens the Vietnamese text as UTF-8
+    buffer.write("\ufeff")
+    writer.writerow(COLUMNS)
+    for row in _rows(stmt):
+        writer.writerow(_csv_cell(value) for value in row)
+        if buffer.tell() >= EXPORT_CHUNK_BYTES:
+            yield buffer.getvalue().encode("utf-8")
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue().encode("utf-8")
+
+def _cell(value):
+    if isinstance(value, str):
+        # openpyxl raises on control characters, midway through the export
+        return ILLEGAL_CHARACTERS_RE.sub("", value)[:XLSX_MAX_CELL]
+    return value
+
+def stream_xlsx(stmt):
+    workbook = Workbook(write_only=True)
+    sheet = workbook.create_sheet("Evaluations")
+    sheet.append(COLUMNS)
+    for row in _rows(stmt):
+        sheet.append([_cell(value) for value in row])
+
+    with tempfile.TemporaryFile() as f:
+        workbook.save(f)
+        f.seek(0)
+        while chunk := f.read(EXPORT_CHUNK_BYTES):
+            yield chunk
+
+def stream(fmt: str, stmt):
+    return stream_xlsx(stmt) if fmt == FORMAT_XLSX else stream_csv(stmt)
@@ -0,0 +1,293 @@
+import hashlib
+import json
+import math
+import os
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from types import SimpleNamespace
+from . import prompts
+from .providers import ModelProvider
+
+# Offline stand-in for the Gemini API, selected with MODEL_PROVIDER=fake.
+#
+# Distributions are written as "kind:params", latencies in milliseconds:
+#   fixed:200, uniform:100:400, normal:800:150, lognormal:<median>:<sigma>, exp:<mean>
+# FAKE_PROVIDER_LATENCY and FAKE_PROVIDER_TOKENS take comma separated op=distribution
+# pairs, FAKE_PROVIDER_FAILURE_RATE takes op=rate pairs or a single rate for every op.
+# Ops: create_store, upload, processing, import, indexing, generate, delete, list.
+# "processing" and "indexing" are how long a file stays PROCESSING and an import
+# stays not done; the other ops block the calling thread like a real request.
+
+DEFAULT_LATENCY = {
+    "create_store": "lognormal:300:0.3",
+    "upload": "lognormal:400:0.5",
+    "processing": "lognormal:1500:0.5",
+    "import": "lognormal:300:0.3",
+    "indexing": "lognormal:3000:0.5",
+    "generate": "lognormal:2500:0.4",
+    "delete": "lognormal:150:0.3",
+    "list": "lognormal:200:0.3",
+}
+DEFAULT_TOKENS = {
+    "input": "lognormal:6000:0.3",
+    "output": "normal:180:40",
+}
+RETRYABLE_CODES = (429, 500, 503)
+
+class FakeProviderError(Exception):
+    """Injected failure, shaped like the SDK's APIError (code + message)."""
+
+    def __init__(self, code: int, message: str):
+        super().__init__(f"{code} {message}")
+        self.code = code
+        self.message = message
+
+def parse_distribution(spec: str):
+    """Turns "kind:params" into a function of a random.Random."""
+    kind, *params = spec.split(":")
+    values = [float(p) for p in params]
+    if kind == "fixed":
+        return lambda rng: values[0]
+    if kind == "uniform":
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == "normal":
+        return lambda rng: max(0.0, rng.gauss(values[0], values[1]))
+    if kind == "lognormal":
+        return lambda rng: rng.lognormvariate(math.log(values[0]), values[1])
+    if kind == "exp":
+        return lambda rng: rng.expovariate(1 / values[0])
+    raise ValueError(f"Unknown distribution: {spec}")
+
+def _parse_pairs(raw: str) -> dict[str, str]:
+    pairs = {}
+    for part in raw.split(","):
+        if part.strip():
+            key, _, value = part.partition("=")
+            pairs[key.strip()] = value.strip()
+    return pairs
+
+class FakeProvider(ModelProvider):
+    """Deterministic in-process provider with configurable latency, failures and token counts.
+
+    Every random draw comes from a generator seeded with the call's identity
+    (operation, arguments, how many times that same call was made before), so
+    a run gives the same results whatever order concurrent calls happen in.
+    Scores depend only on the store and the prompt, like a stable model would.
+    """
+
+    def __init__(self, latency: dict[str, str] | None = None, failure_rate: dict[str, float] | None = None,
+                 tokens: dict[str, str] | None = None, seed: int = 0, time_scale: float = 1.0):
+        self.latency = {op: parse_distribution(spec) for op, spec in {**DEFAULT_LATENCY, **(latency or {})}.items()}
+        self.tokens = {kind: parse_distribution(spec) for kind, spec in {**DEFAULT_TOKENS, **(tokens or {})}.items()}
+        self.failure_rate = failure_rate or {}
+        self.seed = seed
+        self.time_scale = time_scale
+        self._lock = threading.Lock()
+        self._calls: dict[tuple, int] = {}
+        self._counter = 0
+        self.files: dict[str, SimpleNamespace] = {}
+        self.stores: dict[str, SimpleNamespace] = {}
+        self.operations: dict[str, dict] = {}
+
+    @classmethod
+    def from_env(cls) -> "FakeProvider":
+        raw_rate = os.getenv("FAKE_PROVIDER_FAILURE_RATE", "0")
+        if "=" in raw_rate:
+            failure_rate = {op: float(rate) for op, rate in _parse_pairs(raw_rate).items()}
+        else:
+            failure_rate = dict.fromkeys(DEFAULT_LATENCY, float(raw_rate))
+        return cls(
+            latency=_parse_pairs(os.getenv("FAKE_PROVIDER_LATENCY", "")),
+            failure_rate=failure_rate,
+            tokens=_parse_pairs(os.getenv("FAKE_PROVIDER_TOKENS", "")),
+            seed=int(os.getenv("FAKE_PROVIDER_SEED", "0")),
+            time_scale=float(os.getenv("FAKE_PROVIDER_TIME_SCALE", "1")),
+        )
+
+    def _rng(self, op: str, *key) -> random.Random:
+        with self._lock:
+            call = (op, *key)
+            n = self._calls.get(call, 0)
+            self._calls[call] = n + 1
+        return random.Random(f"{self.seed}:{op}:{key}:{n}")
+
+    def _next_id(self, prefix: str) -> str:
+        with self._lock:
+            self._counter += 1
+            return f"{prefix}/fake-{self._counter:08d}"
+
+    def _duration(self, op: str, rng: random.Random) -> float:
+        return self.latency[op](rng) / 1000 * self.time_scale
+
+    def _call(self, op: str, *key) -> random.Random:
+        """Simulates one blocking request: waits out its latency, then maybe fails."""
+        rng = self._rng(op, *key)
+        time.sleep(self._duration(op, rng))
+        if rng.random() < self.failure_rate.get(op, 0.0):
+            raise FakeProviderError(rng.choice(RETRYABLE_CODES), f"Injected {op} failure")
+        return rng
+
+    def _file_view(self, record: SimpleNamespace) -> SimpleNamespace:
+        state = record.final_state if time.monotonic() >= record.ready_at else "PROCESSING"
+        error = SimpleNamespace(message="Injected processing failure") if state == "FAILED" else None
+        return SimpleNamespace(
+            name=record.name, uri=record.uri, display_name=record.display_name, mime_type=record.mime_type,
+            size_bytes=record.size_bytes, create_time=record.create_time, state=SimpleNamespace(name=state),
+            error=error,
+        )
+
+    def create_store(self, display_name: str) -> str:
+        self._call("create_store", display_name)
+        name = self._next_id("fileSearchStores")
+        with self._lock:
+            self.stores[name] = SimpleNamespace(
+                name=name, display_name=display_name, create_time=datetime.now(timezone.utc), documents=[]
+            )
+        return name
+
+    def upload_file(self, file, mime_type: str = None, display_name: str = None):
+        if isinstance(file, str):
+            size = os.path.getsize(file)
+            digest = hashlib.sha256(file.encode()).hexdigest()
+        else:
+            # Read the body like the SDK would, it also gives a content-based call identity
+            size, sha = 0, hashlib.sha256()
+            while chunk := file.read(1024 * 1024):
+                size += len(chunk)
+                sha.update(chunk)
+            digest = sha.hexdigest()
+        rng = self._call("upload", digest)
+        name = self._next_id("files")
+        failed = rng.random() < self.failure_rate.get("processing", 0.0)
+        record = SimpleNamespace(
+            name=name, uri=f"https://fake.invalid/{name}", display_name=display_name or name,
+            mime_type=mime_type, size_bytes=size, create_time=datetime.now(timezone.utc),
+            ready_at=time.monotonic() + self._duration("processing", rng),
+            final_state="FAILED" if failed else "ACTIVE",
+        )
+        with self._lock:
+            self.files[name] = record
+        return self._file_view(record)
+
+    def get_file(self, file_name: str):
+        self._call("list", "get_file", file_name)
+        record = self.files.get(file_name)
+        if record is None:
+            raise FakeProviderError(404, f"File {file_name} not found")
+        return self._file_view(record)
+
+    def import_file(self, store_name: str, file_name: str):
+        rng = self._call("import", store_name, file_name)
+        if store_name not in self.stores:
+            raise FakeProviderError(404, f"Store {store_name} not found")
+        if file_name not in self.files:
+            raise FakeProviderError(404, f"File {file_name} not found")
+        name = self._next_id("operations")
+        failed = rng.random() < self.failure_rate.get("indexing", 0.0)
+        with self._lock:
+            self.operations[name] = {
+                "store": store_name, "file": file_name, "failed": failed,
+                "done_at": time.monotonic() + self._duration("indexing", rng), "applied": False,
+            }
+        return SimpleNamespace(name=name, done=False, error=None)
+
+    def get_operation(self, operation):
+        self._call("list", "get_operation", operation.name)
+        with self._lock:
+            state = self.operations[operation.name]
+            done = time.monotonic() >= state["done_at"]
+            if done and not state["applied"]:
+                state["applied"] = True
+                store = self.stores.get(state["store"])
+                if store is not None and not state["failed"]:
+                    file = self.files[state["file"]]
+                    store.documents.append(SimpleNamespace(
+                        name=f"{store.name}/documents/{file.name.split('/')[-1]}", display_name=file.display_name
+                    ))
+        error = {"message": "Injected indexing failure"} if done and state["failed"] else None
+        return SimpleNamespace(name=operation.name, done=done, error=error)
+
+    def _tokens(self, rng: random.Random) -> dict:
+        return {
+            "input_tokens": int(self.tokens["input"](rng)),
+            "output_tokens": int(self.tokens["output"](rng)),
+        }
+
+    def _score(self, store_name: str, prompt: str) -> int:
+        digest = hashlib.sha256(f"{self.seed}:{store_name}:{prompt}".encode()).digest()
+        return digest[0] % 11
+
+    def evaluate(self, store_name: str, prompt: str) -> dict:
+        rng = self._call("generate", store_name, prompt)
+        score = self._score(store_name, prompt)
+        text = f"SCORE: {score}\nEXPLANATION: Đánh giá mô phỏng cho tiêu chí: {prompt[:80]}"
+        return {"text": text, **self._tokens(rng)}
+
+    def evaluate_passages(self, prompt: str, passages: list[dict]) -> dict:
+        key = tuple(p.get("chunk_id") for p in passages)
+        rng = self._call("generate", prompt, key)
+        score = self._score(str(key), prompt)
+        text = f"SCORE: {score}\nEXPLANATION: Đánh giá mô phỏng từ {len(passages)} đoạn trích cho tiêu chí: {prompt[:80]}"
+        tokens = self._tokens(rng)
+        # Inline passages replace the retrieved context, the prompt is roughly their size
+        tokens["input_tokens"] = sum(len(p["text"]) for p in passages) // 4 + len(prompt) // 4
+        return {"text": text, **tokens}
+
+    def evaluate_group(self, store_name: str, criteria: list[tuple[int, str]]) -> dict:
+        rng = self._call("generate", store_name, tuple(criteria))
+        text = json.dumps([
+            {
+                "criterion_id": criterion_id,
+                "score": self._score(store_name, prompt),
+                "explanation": f"Đánh giá mô phỏng cho tiêu chí: {prompt[:80]}",
+                "evidence": "fake",
+            }
+            for criterion_id, prompt in criteria
+        ], ensure_ascii=False)
+        tokens = self._tokens(rng)
+        return {
+            "text": text,
+            "items": prompts.parse_group_response(text, {criterion_id for criterion_id, _ in criteria}),
+            "input_tokens": tokens["input_tokens"],
+            "output_tokens": tokens["output_tokens"] * len(criteria),
+        }
+
+    def get_store(self, store_name: str):
+        self._call("list", "get_store", store_name)
+        return self.stores.get(store_name)
+
+    def delete_store(self, store_name: str):
+        self._call("delete", store_name)
+        with self._lock:
+            self.stores.pop(store_name, None)
+
+    def delete_file(self, file_name: str):
+        self._call("delete", file_name)
+        with self._lock:
+            self.files.pop(file_name, None)
+
+    def _page(self, items: list, page_token: str | None, page_size: int) -> tuple[list, str | None]:
+        start = int(page_token or 0)
+        end = start + page_size
+        return items[start:end], str(end) if end < len(items) else None
+
+    def list_stores_page(self, page_token: str | None = None, page_size: int = 20) -> tuple[list, str | None]:
+        self._call("list", "stores", page_token)
+        with self._lock:
+            stores = sorted(self.stores.values(), key=lambda s: s.name)
+        return self._page(stores, page_token, page_size)
+
+    def list_files_page(self, page_token: str | None = None, page_size: int = 100) -> tuple[list, str | None]:
+        self._call("list", "files", page_token)
+        with self._lock:
+            files = sorted(self.files.values(), key=lambda f: f.name)
+        return self._page([self._file_view(f) for f in files], page_token, page_size)
+
+    def list_store_documents(self, store_name: str) -> list:
+        self._call("list", "documents", store_name)
+        store = self.stores.get(store_name)
+        if store is None:
+            raise FakeProviderError(404, f"Store {store_name} not found")
+        return list(store.documents)
@@ -0,0 +1,178 @@
+import hashlib
+import os
+from datetime import datetime, timedelta
+from fastapi import Request
+from fastapi.responses import JSONResponse, Response
+from sqlalchemy import select, delete, update
+from sqlalchemy.dialects.postgresql import insert
+from . import models, database
+
+# Idempotency-Key support for mutating requests.
+#
+# The first request with a key claims it with an INSERT ... ON CONFLICT DO
+# NOTHING, which only one worker (or node) can win. Its response is stored
+# once it has been sent in full; a retry with the same key then gets that
+# response replayed (Idempotent-Replayed: true) instead of running again.
+# A retry that arrives while the first request is still running gets 409.
+# Server errors and interrupted responses release the key so the request
+# can simply be retried. Keys are per caller (hash of the Authorization
+# header; requests without one are passed through) and must be reused with
+# the same method, path, query and body. Bodies are only part of that check
+# up to IDEMPOTENCY_MAX_FINGERPRINT_BODY and when they aren't multipart
+# uploads, which are fingerprinted by content type and length.
+
+IDEMPOTENCY_HEADER = "Idempotency-Key"
+REPLAYED_HEADER = "Idempotent-Replayed"
+IDEMPOTENCY_TTL_SECONDS = int(os.getenv("IDEMPOTENCY_TTL_SECONDS", str(24 * 3600)))
+# A claim older than this whose request never finished (worker killed) may be taken over
+IDEMPOTENCY_STALE_SECONDS = int(os.getenv("IDEMPOTENCY_STALE_SECONDS", "3600"))
+# Larger responses are sent but not kept; a retry then gets 409 instead of a replay
+IDEMPOTENCY_MAX_BODY = int(os.getenv("IDEMPOTENCY_MAX_BODY", str(4 * 1024 * 1024)))
+IDEMPOTENCY_MAX_FINGERPRINT_BODY = int(os.getenv("IDEMPOTENCY_MAX_FINGERPRINT_BODY", str(1024 * 1024)))
+MUTATING_METHODS = ("POST", "PUT", "PATCH", "DELETE")
+# Never stored: the login response is a credential
+EXCLUDED_PATHS = ("/token",)
+SKIPPED_HEADERS = ("content-length", "date", "server", "server-timing")
+
+STATUS_IN_PROGRESS = "in_progress"
+STATUS_COMPLETED = "completed"
+
+def _hash(*parts: str) -> str:
+    return hashlib.sha256("\x1f".join(parts).encode()).hexdigest()
+
+def _error(status_code: int, detail: str, **headers) -> JSONResponse:
+    return JSONResponse({"detail": detail}, status_code=status_code, headers=headers)
+
+async def _fingerprint(request: Request) -> str:
+    content_type = request.headers.get("content-type", "")
+    length = request.headers.get("content-length", "")
+    body = ""
+    if (not content_type.startswith("multipart/") and length.isdigit()
+            and int(length) <= IDEMPOTENCY_MAX_FINGERPRINT_BODY):
+        # Starlette keeps the body it read here for the route
+        body = hashlib.sha256(await request.body()).hexdigest()
+    return _hash(request.method, request.url.path, request.url.query, content_type, length, body)
+
+async def _claim(scope: str, key: str, fingerprint: str) -> models.IdempotencyKey | None:
+    """Claims the key, or returns the existing live record for it."""
+    table = models.IdempotencyKey
+    async with database.AsyncSessionLocal() as db:
+        # Twice: an expired or abandoned record is removed, then the claim is tried again
+        for _ in range(2):
+            now = datetime.utcnow()
+            claimed = (await db.execute(
+                insert(table).values(
+                    scope=scope, key=key, fingerprint=fingerprint, status=STATUS_IN_PROGRESS, created_at=now
+                ).on_conflict_do_nothing(constraint="uq_idempotency_keys_scope_key").returning(table.id)
+            )).scalar()
+            await db.commit()
+            if claimed:
+                return None
+
+            record = (await db.execute(select(table).where(table.scope == scope, table.key == key))).scalars().first()
+            if record is None:
+                continue
+            expired = record.created_at < now - timedelta(seconds=IDEMPOTENCY_TTL_SECONDS)
+            abandoned = (record.status == STATUS_IN_PROGRESS
+                         and record.created_at < now - timedelta(seconds=IDEMPOTENCY_STALE_SECONDS))
+            if not (expired or abandoned):
+                return record
+            # Matching created_at too, so a claim made meanwhile by another worker survives
+            await db.execute(delete(table).where(table.id == record.id, table.created_at == record.created_at))
+            await db.commit()
+        # Still contended after two tries, answer as if the request were in progress
+        return models.IdempotencyKey(scope=scope, key=key, fingerprint=fingerprint, status=STATUS_IN_PROGRESS)
+
+async def _release(scope: str, key: str):
+    table = models.IdempotencyKey
+    async with database.AsyncSessionLocal() as db:
+        await db.execute(delete(table).where(
+            table.scope == scope, table.key == key, table.status == STATUS_IN_PROGRESS
+        ))
+        await db.commit()
+
+async def _complete(scope: str, key: str, response: Response, body: bytes | None):
+    table = models.IdempotencyKey
+    headers = [[name, value] for name, value in response.headers.items() if name.lower() not in SKIPPED_HEADERS]
+    async with database.AsyncSessionLocal() as db:
+        await db.execute(update(table).where(table.scope == scope, table.key == key).values(
+            status=STATUS_COMPLETED,
+            response_status=response.status_code,
+            response_headers=headers,
+            response_body=body,
+            completed_at=datetime.utcnow(),
+        ))
+        await db.commit()
+
+def _replay(record: models.IdempotencyKey) -> Response:
+    if record.response_body is None:
+        return _error(409, "Yêu cầu với Idempotency-Key này đã hoàn tất nhưng phản hồi quá lớn để phát lại")
+    response = Response(content=record.response_body, status_code=record.response_status)
+    for name, value in record.response_headers or []:
+        response.headers.append(name, value)
+    response.headers[REPLAYED_HEADER] = "true"
+    return response
+
+def _record_when_sent(response: Response, scope: str, key: str) -> Response:
+    """Passes the body through unchanged and stores it once the last chunk went out."""
+    original = response.body_iterator
+
+    async def body():
+        parts, size, finished = [], 0, False
+        try:
+            async for chunk in original:
+                if parts is not None:
+                    size += len(chunk)
+                    if size <= IDEMPOTENCY_MAX_BODY:
+                        parts.append(chunk)
+                    else:
+                        parts = None
+                yield chunk
+            finished = True
+        finally:
+            if finished:
+                await _complete(scope, key, response, b"".join(parts) if parts is not None else None)
+            else:
+                # The client went away mid-response, let a retry run the request again
+                await _release(scope, key)
+
+    response.body_iterator = body()
+    return response
+
+async def handle(request: Request, call_next) -> Response:
+    """HTTP middleware: applies Idempotency-Key semantics to mutating requests that send one."""
+    key = request.headers.get(IDEMPOTENCY_HEADER)
+    authorization = request.headers.get("authorization")
+    # Anonymous callers would all share one key space, and every mutating route needs a login anyway
+    if (not key or not authorization or request.method not in MUTATING_METHODS
+            or request.url.path in EXCLUDED_PATHS):
+        return await call_next(request)
+    if len(key) > 255:
+        return _error(400, "Idempotency-Key tối đa 255 ký tự")
+
+    scope = _hash(authorization)
+    fingerprint = await _fingerprint(request)
+    record = await _claim(scope, key, fingerprint)
+    if record is not None:
+        if record.fingerprint != fingerprint:
+            return _error(422, "Idempotency-Key đã được dùng cho một yêu cầu khác")
+        if record.status == STATUS_IN_PROGRESS:
+            return _error(409, "Yêu cầu với Idempotency-Key này đang được xử lý", **{"Retry-After": "1"})
+        return _replay(record)
+
+    try:
+        response = await call_next(request)
+    except BaseException:
+        await _release(scope, key)
+        raise
+    if response.status_code >= 500:
+        await _release(scope, key)
+        return response
+    return _record_when_sent(response, scope, key)
+
+def purge_expired(db) -> int:
+    """Deletes records past IDEMPOTENCY_TTL_SECONDS; blocking, takes a sync session."""
+    cutoff = datetime.utcnow() - timedelta(seconds=IDEMPOTENCY_TTL_SECONDS)
+    return db.query(models.IdempotencyKey).filter(models.IdempotencyKey.created_at < cutoff).delete(
+        synchronize_session=False
+    )
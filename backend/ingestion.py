@@ -0,0 +1,481 @@
+import asyncio
+import contextlib
+import hashlib
+import os
+import time
+import uuid
+from datetime import datetime, timedelta
+from sqlalchemy import func, text
+from . import models, database, services, cache, rollups, metrics, retrieval
+
+# Upper bound for a file to finish PROCESSING or an import to finish indexing
+INGESTION_DEADLINE_SECONDS = float(os.getenv("INGESTION_DEADLINE_SECONDS", "900"))
+POLL_INITIAL_SECONDS = float(os.getenv("INGESTION_POLL_INITIAL_SECONDS", "0.5"))
+POLL_MAX_SECONDS = float(os.getenv("INGESTION_POLL_MAX_SECONDS", "10"))
+# How long an evaluation waits for the contractor's uploaded files to be indexed
+INDEXING_WAIT_SECONDS = float(os.getenv("EVAL_INDEXING_WAIT_SECONDS", "300"))
+# Max concurrent uploads per process-files request
+INGESTION_UPLOAD_CONCURRENCY = int(os.getenv("INGESTION_UPLOAD_CONCURRENCY", "4"))
+HASH_CHUNK_SIZE = 1024 * 1024
+# Ingestions of one contractor run one at a time across every worker and node, using a
+# Postgres advisory lock keyed (INGESTION_LOCK_NAMESPACE, contractor_id). Two-key locks
+# never conflict with single-key ones such as reconcile's.
+INGESTION_LOCK_NAMESPACE = 714_003
+INGESTION_LOCK_TIMEOUT_SECONDS = float(os.getenv("INGESTION_LOCK_TIMEOUT_SECONDS", "300"))
+LOCK_POLL_MAX_SECONDS = 2.0
+
+class IngestionBusy(Exception):
+    """Another ingestion for the contractor held the lock for longer than the timeout."""
+
+async def poll_until(fetch, is_done, initial: float = POLL_INITIAL_SECONDS, maximum: float = POLL_MAX_SECONDS,
+                     deadline: float = INGESTION_DEADLINE_SECONDS):
+    """Calls the blocking `fetch` in a thread until `is_done(result)`, backing off exponentially.
+
+    Small files usually finish within the first short interval, long ones are
+    polled less and less often until the deadline raises TimeoutError.
+    """
+    give_up_at = time.monotonic() + deadline
+    delay = initial
+    while True:
+        result = await asyncio.to_thread(fetch)
+        if is_done(result):
+            return result
+        remaining = give_up_at - time.monotonic()
+        if remaining <= 0:
+            raise TimeoutError(f"Gave up waiting after {deadline:.0f}s")
+        await asyncio.sleep(min(delay, remaining))
+        delay = min(delay * 2, maximum)
+
+async def wait_for_file_active(g_file):
+    """Waits until an uploaded file leaves the PROCESSING state."""
+    if g_file.state.name != "PROCESSING":
+        g_file_ready = g_file
+    else:
+        with metrics.ingestion_wait.time(stage="processing"):
+            g_file_ready = await poll_until(
+                lambda: services.get_file(g_file.name),
+                lambda f: f.state.name != "PROCESSING",
+            )
+    if g_file_ready.state.name == "FAILED":
+        raise ValueError(f"File upload failed: {g_file_ready.error.message}")
+    return g_file_ready
+
+def _update_files(file_ids: list[int], values: dict):
+    db = database.SessionLocal()
+    try:
+        db.query(models.ContractorFile).filter(models.ContractorFile.id.in_(file_ids)).update(
+            values, synchronize_session=False
+        )
+        db.commit()
+    finally:
+        db.close()
+
+def _mark_importing(file_id: int):
+    _update_files([file_id], {
+        models.ContractorFile.import_started_at: datetime.utcnow(),
+        models.ContractorFile.import_error: None,
+    })
+
+def _mark_indexed(file_ids: list[int]):
+    _update_files(file_ids, {
+        models.ContractorFile.is_stored_in_gemini: True,
+        models.ContractorFile.import_started_at: None,
+        models.ContractorFile.import_error: None,
+    })
+
+def _mark_import_failed(file_id: int, error: str):
+    # Not in flight any more: evaluations stop waiting for it, reconcile may import it again
+    _update_files([file_id], {
+        models.ContractorFile.import_started_at: None,
+        models.ContractorFile.import_error: error,
+    })
+
+class IngestionTracker:
+    """Follows store import operations until the files are actually indexed.
+
+    ContractorFile.is_stored_in_gemini is only set once the import operation
+    for that file completes without error. Pending imports are held per
+    contractor so evaluations can wait for them instead of sleeping blindly.
+    """
+
+    def __init__(self):
+        self._pending: dict[int, set[asyncio.Task]] = {}
+
+    def track(self, contractor_id: int, file_id: int, operation) -> asyncio.Task:
+        task = asyncio.get_running_loop().create_task(self._watch(file_id, operation))
+        tasks = self._pending.setdefault(contractor_id, set())
+        tasks.add(task)
+
+        def _done(t):
+            tasks.discard(t)
+            if not tasks and self._pending.get(contractor_id) is tasks:
+                del self._pending[contractor_id]
+
+        task.add_done_callback(_done)
+        return task
+
+    async def _watch(self, file_id: int, operation) -> bool:
+        try:
+            await asyncio.to_thread(_mark_importing, file_id)
+            if not operation.done:
+                with metrics.ingestion_wait.time(stage="indexing"):
+                    operation = await poll_until(lambda: services.get_operation(operation), lambda op: op.done)
+            if operation.error:
+                error = f"Indexing failed: {operation.error}"
+            else:
+                await asyncio.to_thread(_mark_indexed, [file_id])
+                return True
+        except Exception as e:
+            error = f"Error waiting for indexing: {e}"
+        print(f"{error} (file {file_id})")
+        try:
+            await asyncio.to_thread(_mark_import_failed, file_id, error)
+        except Exception as e:
+            # The row stays in flight until INGESTION_DEADLINE_SECONDS have passed
+            print(f"Error recording the failed import of file {file_id}: {e}")
+        return False
+
+    def pending_count(self, contractor_id: int) -> int:
+        return len(self._pending.get(contractor_id, ()))
+
+    def pending_total(self) -> int:
+        return sum(len(tasks) for tasks in self._pending.values())
+
+    async def wait_for_contractor(self, contractor_id: int):
+        """Waits for every import currently pending for the contractor."""
+        tasks = list(self._pending.get(contractor_id, ()))
+        if tasks:
+            # asyncio.wait (unlike gather) leaves the watchers running if the waiter is cancelled
+            await asyncio.wait(tasks)
+
+tracker = IngestionTracker()
+
+def _importing_count(contractor_id: int) -> int:
+    """Imports of the contractor's files in flight on any worker.
+
+    A worker that died mid-import never clears import_started_at, so starts
+    older than the import deadline no longer count.
+    """
+    db = database.SessionLocal()
+    try:
+        return db.query(func.count(models.ContractorFile.id)).filter(
+            models.ContractorFile.contractor_id == contractor_id,
+            models.ContractorFile.import_started_at.isnot(None),
+            models.ContractorFile.import_started_at > datetime.utcnow() - timedelta(seconds=INGESTION_DEADLINE_SECONDS)
+        ).scalar()
+    finally:
+        db.close()
+
+async def wait_until_indexed(contractor_id: int, deadline: float = INDEXING_WAIT_SECONDS):
+    """Waits until no import of the contractor's files is in flight.
+
+    The tracker only sees imports started by this worker, so once they are done
+    import_started_at is polled as well, which covers imports running on other
+    workers. Failed imports don't count, the evaluation runs without those
+    files. Raises TimeoutError if imports are still running after `deadline`.
+    """
+    await tracker.wait_for_contractor(contractor_id)
+    try:
+        await poll_until(lambda: _importing_count(contractor_id), lambda count: count == 0, deadline=deadline)
+    except TimeoutError:
+        count = await asyncio.to_thread(_importing_count, contractor_id)
+        if not count:
+            return
+        raise TimeoutError(f"Còn {count} tệp của nhà thầu đang được lập chỉ mục, vui lòng thử lại sau") from None
+
+def hash_file(fileobj) -> str:
+    """Streams a file-like object through SHA-256 and rewinds it for the upload."""
+    digest = hashlib.sha256()
+    fileobj.seek(0)
+    for chunk in iter(lambda: fileobj.read(HASH_CHUNK_SIZE), b""):
+        digest.update(chunk)
+    fileobj.seek(0)
+    return digest.hexdigest()
+
+def _find_by_hash(contractor_id: int, content_hash: str) -> tuple[models.ContractorFile | None, list[int], models.ContractorFile | None]:
+    """Returns (same contractor's usable copy, ids of its copies that failed to import, any other uploaded copy).
+
+    A copy is usable once indexed, or while its import may still be running.
+    One whose import failed or was abandoned doesn't count, so uploading the
+    content again imports it anew instead of being skipped as a duplicate.
+    """
+    db = database.SessionLocal()
+    try:
+        query = db.query(models.ContractorFile).filter(
+            models.ContractorFile.content_hash == content_hash,
+            models.ContractorFile.gemini_file_name.isnot(None)
+        )
+        in_flight_since = datetime.utcnow() - timedelta(seconds=INGESTION_DEADLINE_SECONDS)
+        own, failed = None, []
+        for f in query.filter(models.ContractorFile.contractor_id == contractor_id).order_by(models.ContractorFile.id):
+            started = f.import_started_at or f.created_at
+            if f.is_stored_in_gemini or (f.import_error is None and started and started > in_flight_since):
+                own = own or f
+            else:
+                failed.append(f.id)
+        # Prefer a copy known to be indexed somewhere
+        other = query.order_by(
+            models.ContractorFile.is_stored_in_gemini.is_(True).desc(), models.ContractorFile.created_at.desc()
+        ).first()
+        return own, failed, other
+    finally:
+        db.close()
+
+def _is_reusable(file_name: str) -> bool:
+    """Uploaded files expire on the provider side, so check before reusing one."""
+    try:
+        return services.get_file(file_name).state.name == "ACTIVE"
+    except Exception:
+        return False
+
+def _create_file_records(contractor_id: int, files: list[tuple[str, int]]) -> list[int]:
+    """Inserts one ContractorFile per (filename, size) in a single transaction."""
+    db = database.SessionLocal()
+    try:
+        db_files = []
+        for filename, size in files:
+            file_extension = os.path.splitext(filename)[1]
+            db_files.append(models.ContractorFile(
+                contractor_id=contractor_id,
+                filename=filename,
+                # Use a special scheme to indicate it's not on disk
+                file_path=f"memory://{uuid.uuid4()}{file_extension}",
+                file_size=size,
+                is_stored_in_gemini=False
+            ))
+        db.add_all(db_files)
+        db.commit()
+        return [f.id for f in db_files]
+    finally:
+        db.close()
+
+def _finalize_file_records(contractor_id: int, results: list[dict]):
+    """Stores Gemini names for uploaded files and drops failed, duplicate or superseded rows, in one transaction."""
+    db = database.SessionLocal()
+    try:
+        failed_ids = [r["file_id"] for r in results if not r.get("gemini_file_name") or r["status"] == "duplicate"]
+        kept = [r for r in results if r["file_id"] not in failed_ids]
+        for r in kept:
+            db.query(models.ContractorFile).filter(models.ContractorFile.id == r["file_id"]).update({
+                models.ContractorFile.gemini_file_name: r["gemini_file_name"],
+                models.ContractorFile.gemini_file_uri: r["gemini_file_uri"],
+                models.ContractorFile.content_hash: r.get("content_hash"),
+            }, synchronize_session=False)
+        rollups.record(
+            db, contractor_id,
+            files=len(kept),
+            file_bytes=sum(r["file_size"] or 0 for r in kept),
+            storage_bytes=sum(r["file_size"] or 0 for r in kept if not r.get("reused"))
+        )
+        failed_ids += [file_id for r in kept for file_id in r.get("replaces", ())]
+        if failed_ids:
+            db.query(models.DocumentChunk).filter(models.DocumentChunk.file_id.in_(failed_ids)).delete(synchronize_session=False)
+            db.query(models.ContractorFile).filter(models.ContractorFile.id.in_(failed_ids)).delete(synchronize_session=False)
+        db.commit()
+    finally:
+        db.close()
+
+def _save_store_name(contractor_id: int, store_name: str):
+    db = database.SessionLocal()
+    try:
+        db.query(models.Contractor).filter(models.Contractor.id == contractor_id).update(
+            {models.Contractor.gemini_store_name: store_name}, synchronize_session=False
+        )
+        db.commit()
+    finally:
+        db.close()
+
+def _load_store_name(contractor_id: int) -> str | None:
+    db = database.SessionLocal()
+    try:
+        return db.query(models.Contractor.gemini_store_name).filter(models.Contractor.id == contractor_id).scalar()
+    finally:
+        db.close()
+
+def _open_lock_connection():
+    return database.get_engine().connect()
+
+def _try_lock(conn, contractor_id: int) -> bool:
+    locked = conn.execute(
+        text("SELECT pg_try_advisory_lock(:namespace, :key)"),
+        {"namespace": INGESTION_LOCK_NAMESPACE, "key": contractor_id}
+    ).scalar()
+    # Don't sit "idle in transaction" while the lock is held
+    conn.commit()
+    return locked
+
+def _discard(conn):
+    """Closes the lock connection without returning it to the pool.
+
+    Ending the session is what releases a lock we couldn't unlock (or may
+    have taken just before a cancellation); pooled, it would keep it.
+    """
+    try:
+        conn.invalidate()
+    finally:
+        conn.close()
+
+def _unlock(conn, contractor_id: int):
+    try:
+        conn.execute(
+            text("SELECT pg_advisory_unlock(:namespace, :key)"),
+            {"namespace": INGESTION_LOCK_NAMESPACE, "key": contractor_id}
+        )
+        conn.commit()
+    except Exception:
+        _discard(conn)
+        raise
+    conn.close()
+
+@contextlib.asynccontextmanager
+async def contractor_lock(contractor_id: int, timeout: float = INGESTION_LOCK_TIMEOUT_SECONDS):
+    """Holds the contractor's cluster-wide ingestion lock, raising IngestionBusy after `timeout`.
+
+    The lock lives on a dedicated connection, so it is released even if the
+    worker dies. Waiting polls with pg_try_advisory_lock instead of blocking a
+    thread on pg_advisory_lock.
+    """
+    conn = await asyncio.to_thread(_open_lock_connection)
+    try:
+        give_up_at = time.monotonic() + timeout
+        delay = POLL_INITIAL_SECONDS
+        with metrics.ingestion_wait.time(stage="lock"):
+            while not await asyncio.to_thread(_try_lock, conn, contractor_id):
+                remaining = give_up_at - time.monotonic()
+                if remaining <= 0:
+                    raise IngestionBusy(f"Contractor {contractor_id} is already ingesting files")
+                await asyncio.sleep(min(delay, remaining))
+                delay = min(delay * 2, LOCK_POLL_MAX_SECONDS)
+    except BaseException:
+        await asyncio.to_thread(_discard, conn)
+        raise
+    try:
+        yield
+    finally:
+        await asyncio.to_thread(_unlock, conn, contractor_id)
+
+def _same_as(result: dict, first: dict) -> dict:
+    """Result for a file whose content an earlier file of the same batch already carried."""
+    if first["status"] in ("importing", "duplicate"):
+        result["status"] = "duplicate"
+        result["duplicate_of"] = first.get("duplicate_of", first["file_id"])
+    else:
+        result["status"] = "failed"
+        result["error"] = first.get("error")
+    return result
+
+class _LazyStore:
+    """Creates the contractor's store once, when the first file is ready to import."""
+
+    def __init__(self, contractor_id: int, store_name: str | None):
+        self.contractor_id = contractor_id
+        self.name = store_name
+        self._lock = asyncio.Lock()
+
+    async def get(self) -> str:
+        async with self._lock:
+            if not self.name:
+                display_name = f"evaluation_{self.contractor_id}_{int(time.time())}"
+                name = await asyncio.to_thread(services.create_rag_store, display_name)
+                await asyncio.to_thread(_save_store_name, self.contractor_id, name)
+                self.name = name
+        return self.name
+
+async def ingest_files(contractor_id: int, store_name: str | None, files: list) -> list[dict]:
+    """Uploads and imports a batch of UploadFiles as a pipeline.
+
+    Uploads run concurrently (INGESTION_UPLOAD_CONCURRENCY) and each file is
+    imported into the store as soon as it is active, without waiting for the
+    rest of the batch. Files are fingerprinted with SHA-256 first: content the
+    contractor already has is skipped, and content uploaded for someone else is
+    imported from the existing remote file instead of being uploaded again.
+    Identical files within the batch are ingested once, the later ones are
+    reported as duplicates of the first. Returns one result per file; a
+    failure only affects its own file (and its copies in the batch).
+
+    The whole batch runs under the contractor's ingestion lock, so concurrent
+    requests (retries, several staff, several workers) can neither create two
+    stores nor upload the same content twice. `store_name` is only a hint: it
+    is read again once the lock is held. Raises IngestionBusy if the lock
+    can't be taken in time.
+    """
+    async with contractor_lock(contractor_id):
+        # Another worker may have created the store while this one waited
+        store_name = await asyncio.to_thread(_load_store_name, contractor_id) or store_name
+        file_ids = await asyncio.to_thread(
+            _create_file_records, contractor_id, [(f.filename, f.size) for f in files]
+        )
+        store = _LazyStore(contractor_id, store_name)
+        upload_slots = asyncio.Semaphore(INGESTION_UPLOAD_CONCURRENCY)
+
+        # First file of each content hash in this batch -> its result, once ingested
+        first_by_hash: dict[str, asyncio.Future] = {}
+
+        async def ingest_one(file, file_id: int) -> dict:
+            result = {"file_id": file_id, "filename": file.filename, "file_size": file.size, "status": "uploading"}
+            try:
+                content_hash = await asyncio.to_thread(hash_file, file.file)
+            except Exception as e:
+                result["status"] = "failed"
+                result["error"] = str(e)
+                return result
+            result["content_hash"] = content_hash
+            if content_hash in first_by_hash:
+                # Identical files in one request are uploaded and imported once
+                return _same_as(result, await asyncio.shield(first_by_hash[content_hash]))
+            first = first_by_hash[content_hash] = asyncio.get_running_loop().create_future()
+            try:
+                return await ingest_content(file, file_id, result)
+            finally:
+                first.set_result(result)
+
+        async def ingest_content(file, file_id: int, result: dict) -> dict:
+            try:
+                own, failed, other = await asyncio.to_thread(_find_by_hash, contractor_id, result["content_hash"])
+                if own:
+                    result["status"] = "duplicate"
+                    result["duplicate_of"] = own.id
+                    return result
+                # This upload supersedes copies whose import failed
+                result["replaces"] = failed
+
+                if other and await asyncio.to_thread(_is_reusable, other.gemini_file_name):
+                    result["gemini_file_name"] = other.gemini_file_name
+                    result["gemini_file_uri"] = other.gemini_file_uri
+                    result["reused"] = True
+                else:
+                    async with upload_slots:
+                        g_file = await asyncio.to_thread(
+                            services.upload_file, file.file, mime_type=file.content_type, display_name=file.filename
+                        )
+                    # Waiting for PROCESSING doesn't hold an upload slot
+                    g_file = await wait_for_file_active(g_file)
+                    result["gemini_file_name"] = g_file.name
+                    result["gemini_file_uri"] = g_file.uri
+
+                operation = await asyncio.to_thread(
+                    services.add_file_to_store, await store.get(), result["gemini_file_name"]
+                )
+                tracker.track(contractor_id, file_id, operation)
+                result["status"] = "importing"
+            except Exception as e:
+                result["status"] = "failed"
+                result["error"] = str(e)
+                return result
+
+            if retrieval.LOCAL_RETRIEVAL:
+                # The remote copy stays the source of truth, a file that can't be indexed is still usable
+                try:
+                    result["chunks"] = await asyncio.to_thread(
+                        retrieval.index_file, contractor_id, file_id, file.file, file.filename, file.content_type
+                    )
+                except Exception as e:
+                    print(f"Error indexing file {file_id} locally: {e}")
+            return result
+
+        results = await asyncio.gather(*(ingest_one(f, file_id) for f, file_id in zip(files, file_ids)))
+        await asyncio.to_thread(_finalize_file_records, contractor_id, results)
+        if any(r["status"] == "importing" for r in results):
+            # The file set changed, earlier cached evaluations no longer apply
+            await asyncio.to_thread(cache.invalidate_contractor, contractor_id)
+        return results
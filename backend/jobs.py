@@ -0,0 +1,522 @@
+import asyncio
+import contextvars
+import functools
+import os
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from . import models, database, services, ingestion, cache, rollups, metrics, retrieval, resilience
+from .ratelimit import model_limiter, FairSemaphore
+
+# Finished jobs are kept in memory for this long so clients can still read the final status
+JOB_RETENTION_SECONDS = int(os.getenv("EVAL_JOB_RETENTION_SECONDS", "3600"))
+
+STATUS_PENDING = "pending"
+STATUS_RUNNING = "running"
+STATUS_COMPLETED = "completed"
+STATUS_FAILED = "failed"
+STATUS_CANCELLED = "cancelled"
+
+ACTIVE_STATUSES = (STATUS_PENDING, STATUS_RUNNING)
+
+# Max model calls in flight across all jobs of this worker
+EVAL_MAX_CONCURRENCY = int(os.getenv("EVAL_MAX_CONCURRENCY", "8"))
+
+# Dedicated pool so model calls are not capped by the default executor size
+_model_executor = ThreadPoolExecutor(max_workers=EVAL_MAX_CONCURRENCY, thread_name_prefix="model-call")
+# Shared by every job; slots rotate between contractors so all bidders make progress together
+_model_slots = FairSemaphore(EVAL_MAX_CONCURRENCY)
+
+class EvaluationJob:
+    """An evaluation run for one contractor, executed in the background."""
+
+    def __init__(self, contractor_id: int, store_name: str, prompts: list[str],
+                 criteria_set_id: int | None = None, batch_id: str | None = None, group_criteria: bool = False):
+        self.id = uuid.uuid4().hex
+        self.contractor_id = contractor_id
+        self.store_name = store_name
+        self.prompts = prompts
+        self.criteria_set_id = criteria_set_id
+        self.batch_id = batch_id
+        self.group_criteria = group_criteria # Several criteria per request with JSON output
+        self.status = STATUS_PENDING
+        self.error = None
+        self.created_at = datetime.utcnow()
+        self.started_at = None
+        self.finished_at = None
+        self.fingerprint = None # Contractor file set fingerprint, set once indexing is done
+        self.local_retrieval = False # Criteria answered from local passages instead of the store
+        self.results = [
+            {"index": i, "prompt": prompt, "status": STATUS_PENDING}
+            for i, prompt in enumerate(prompts)
+        ]
+        self.finished_order: list[int] = [] # Entry indexes in the order they finished, streams replay it
+        self.task = None
+        self._finished_set: set[int] = set()
+        self._changed = asyncio.Event()
+
+    @property
+    def is_active(self) -> bool:
+        return self.status in ACTIVE_STATUSES
+
+    def changed(self) -> asyncio.Event:
+        """Event set at the next change; take it before reading the state so nothing is missed."""
+        return self._changed
+
+    def notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def entry_finished(self, entry: dict):
+        """Records that an entry reached a final status and wakes the streams."""
+        if entry["status"] not in ACTIVE_STATUSES and entry["index"] not in self._finished_set:
+            self._finished_set.add(entry["index"])
+            self.finished_order.append(entry["index"])
+            self.notify()
+
+    def progress(self) -> dict:
+        done = sum(1 for r in self.results if r["status"] not in ACTIVE_STATUSES)
+        failed = sum(1 for r in self.results if r["status"] == STATUS_FAILED)
+        return {"total": len(self.results), "done": done, "failed": failed}
+
+    def to_dict(self, include_results: bool = True) -> dict:
+        data = {
+            "job_id": self.id,
+            "contractor_id": self.contractor_id,
+            "criteria_set_id": self.criteria_set_id,
+            "batch_id": self.batch_id,
+            "group_criteria": self.group_criteria,
+            "local_retrieval": self.local_retrieval,
+            "status": self.status,
+            "error": self.error,
+            "progress": self.progress(),
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+        if include_results:
+            data["results"] = self.results
+        return data
+
+class BatchEvaluation:
+    """A bid package evaluated with a criteria set: one EvaluationJob per contractor."""
+
+    def __init__(self, bid_package_id: int, criteria_set_id: int):
+        self.id = uuid.uuid4().hex
+        self.bid_package_id = bid_package_id
+        self.criteria_set_id = criteria_set_id
+        self.created_at = datetime.utcnow()
+        self.jobs: list[EvaluationJob] = []
+        self.skipped: list[dict] = [] # Contractors that could not be evaluated
+
+    @property
+    def status(self) -> str:
+        if any(job.is_active for job in self.jobs):
+            return STATUS_RUNNING
+        if self.jobs and all(job.status == STATUS_CANCELLED for job in self.jobs):
+            return STATUS_CANCELLED
+        return STATUS_COMPLETED
+
+    @property
+    def finished_at(self) -> datetime | None:
+        if any(job.is_active for job in self.jobs):
+            return None
+        return max((job.finished_at for job in self.jobs), default=self.created_at)
+
+    def to_dict(self, include_results: bool = False) -> dict:
+        progresses = [job.progress() for job in self.jobs]
+        return {
+            "batch_id": self.id,
+            "bid_package_id": self.bid_package_id,
+            "criteria_set_id": self.criteria_set_id,
+            "status": self.status,
+            "progress": {
+                key: sum(p[key] for p in progresses) for key in ("total", "done", "failed")
+            },
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "jobs": [job.to_dict(include_results=include_results) for job in self.jobs],
+            "skipped": self.skipped,
+        }
+
+_jobs: dict[str, EvaluationJob] = {}
+_batches: dict[str, BatchEvaluation] = {}
+
+def _prune_finished_jobs():
+    """Drops finished jobs and batches older than JOB_RETENTION_SECONDS."""
+    now = datetime.utcnow()
+    for job_id, job in list(_jobs.items()):
+        if job.finished_at and (now - job.finished_at).total_seconds() > JOB_RETENTION_SECONDS:
+            del _jobs[job_id]
+    for batch_id, batch in list(_batches.items()):
+        finished_at = batch.finished_at
+        if finished_at and (now - finished_at).total_seconds() > JOB_RETENTION_SECONDS:
+            del _batches[batch_id]
+
+# Grouped mode limits, see GroupSizer
+EVAL_GROUP_MAX_CRITERIA = int(os.getenv("EVAL_GROUP_MAX_CRITERIA", "10"))
+EVAL_GROUP_MAX_PROMPT_TOKENS = int(os.getenv("EVAL_GROUP_MAX_PROMPT_TOKENS", "4000"))
+EVAL_GROUP_MAX_OUTPUT_TOKENS = int(os.getenv("EVAL_GROUP_MAX_OUTPUT_TOKENS", "6000"))
+GROUP_CACHE_TEMPLATE = f"group-{services.EVAL_GROUP_PROMPT_VERSION}"
+# Passages depend on the chunking and on how many are sent, so both are part of the key
+LOCAL_CACHE_TEMPLATE = (
+    f"local-{services.EVAL_PASSAGES_PROMPT_VERSION}-k{retrieval.RETRIEVAL_TOP_K}"
+    f"-w{retrieval.RETRIEVAL_CHUNK_WORDS}-o{retrieval.RETRIEVAL_CHUNK_OVERLAP}"
+)
+
+class GroupSizer:
+    """Splits criteria into groups for one-request evaluation.
+
+    Groups are bounded by criteria count, estimated prompt tokens and the
+    expected answer size (learned from the output tokens of earlier groups).
+    The count limit halves whenever a group comes back incomplete and grows
+    back by one per clean group.
+    """
+
+    def __init__(self, max_criteria: int, max_prompt_tokens: int, max_output_tokens: int):
+        self.max_criteria = max_criteria
+        self.max_prompt_tokens = max_prompt_tokens
+        self.max_output_tokens = max_output_tokens
+        self.limit = max_criteria
+        self.output_per_criterion = 250.0
+
+    @staticmethod
+    def estimate_tokens(text: str) -> int:
+        # Rough chars-per-token ratio, good enough for sizing
+        return len(text) // 4 + 1
+
+    def split(self, entries: list[dict]) -> list[list[dict]]:
+        groups, current, prompt_tokens = [], [], 0
+        for entry in entries:
+            tokens = self.estimate_tokens(entry["prompt"])
+            full = (
+                len(current) >= self.limit
+                or prompt_tokens + tokens > self.max_prompt_tokens
+                or (len(current) + 1) * self.output_per_criterion > self.max_output_tokens
+            )
+            if current and full:
+                groups.append(current)
+                current, prompt_tokens = [], 0
+            current.append(entry)
+            prompt_tokens += tokens
+        if current:
+            groups.append(current)
+        return groups
+
+    def record(self, size: int, failed: int, output_tokens: int):
+        if failed:
+            self.limit = max(1, size // 2)
+        else:
+            self.limit = min(self.max_criteria, self.limit + 1)
+        if output_tokens and size > failed:
+            per_criterion = output_tokens / (size - failed)
+            self.output_per_criterion = 0.8 * self.output_per_criterion + 0.2 * per_criterion
+
+group_sizer = GroupSizer(EVAL_GROUP_MAX_CRITERIA, EVAL_GROUP_MAX_PROMPT_TOKENS, EVAL_GROUP_MAX_OUTPUT_TOKENS)
+
+def _save_result(job: EvaluationJob, entry: dict, outcome: dict) -> int:
+    """Persists a single criterion result in its own session and returns its id."""
+    db = database.SessionLocal()
+    try:
+        db_result = models.EvaluationResult(
+            contractor_id=job.contractor_id,
+            criteria_id=entry["index"] if job.criteria_set_id else None,
+            criteria_set_id=job.criteria_set_id,
+            job_id=job.id,
+            criteria_prompt=entry["prompt"],
+            score=outcome["score"],
+            comment=outcome["comment"],
+            evidence=outcome["evidence"],
+            input_tokens=outcome["input_tokens"],
+            output_tokens=outcome["output_tokens"],
+            cached=outcome["cached"]
+        )
+        db.add(db_result)
+        rollups.record(
+            db, job.contractor_id,
+            evaluations=1,
+            cached_evaluations=1 if outcome["cached"] else 0,
+            input_tokens=outcome["input_tokens"],
+            output_tokens=outcome["output_tokens"]
+        )
+        db.commit()
+        return db_result.id
+    finally:
+        db.close()
+
+async def _cache_result(key: str, contractor_id: int, eval_result: dict):
+    """Caches a paid-for result; a failed cache write only costs a future cache hit."""
+    try:
+        await asyncio.to_thread(cache.put, key, contractor_id, eval_result)
+    except Exception as e:
+        print(f"Caching evaluation result failed for contractor {contractor_id}: {e}")
+
+async def _complete_entry(job: EvaluationJob, entry: dict, outcome: dict):
+    result_id = await asyncio.to_thread(_save_result, job, entry, outcome)
+    entry.update(outcome)
+    entry.update({"status": STATUS_COMPLETED, "result_id": result_id})
+
+def _outcome_from_text(eval_result: dict, cached: bool) -> dict:
+    """Builds an outcome from a SCORE/EXPLANATION answer, refusing answers without a score.
+
+    Comment and evidence stored with a cached grouped answer take precedence.
+    """
+    score, comment = services.parse_evaluation_text(eval_result["text"])
+    if score is None:
+        raise ValueError("Không đọc được điểm từ phản hồi của mô hình")
+    return {
+        "result": eval_result["text"],
+        "score": score,
+        "comment": eval_result.get("comment") or comment,
+        "evidence": eval_result.get("evidence") or "",
+        "cached": cached,
+        # Cache hits cost nothing, keep the token columns true to what was spent
+        "input_tokens": 0 if cached else eval_result["input_tokens"],
+        "output_tokens": 0 if cached else eval_result["output_tokens"],
+    }
+
+class _QuotaAdmission:
+    """resilience.admission for evaluation calls: every request, retries and hedges too, is charged to model_limiter.
+
+    Called from resilience's threads; the limiter itself is only touched on the event loop.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+
+    def acquire(self) -> int:
+        started = time.monotonic()
+        reserved = asyncio.run_coroutine_threadsafe(model_limiter.acquire(), self.loop).result()
+        metrics.model_quota_wait.observe(time.monotonic() - started)
+        return reserved
+
+    def try_acquire(self) -> int | None:
+        return asyncio.run_coroutine_threadsafe(model_limiter.try_acquire(), self.loop).result()
+
+    def record(self, reserved: int, result: dict | None):
+        used = result["input_tokens"] + result["output_tokens"] if result else None
+        self.loop.call_soon_threadsafe(model_limiter.record, reserved, used)
+
+async def _call_model(contractor_id: int, func, *args) -> dict:
+    """Runs a blocking services call under the shared concurrency cap and quota limiter."""
+    queued = time.monotonic()
+    async with _model_slots.slot(contractor_id):
+        metrics.model_queue_wait.observe(time.monotonic() - queued)
+        loop = asyncio.get_running_loop()
+        context = contextvars.copy_context()
+        context.run(resilience.admission.set, _QuotaAdmission(loop))
+        # Model calls are blocking, keep them off the event loop
+        return await loop.run_in_executor(_model_executor, functools.partial(context.run, func, *args))
+
+async def _evaluate_one(job: EvaluationJob, entry: dict):
+    started = time.monotonic()
+    try:
+        entry["status"] = STATUS_RUNNING
+        passages = None
+        if job.local_retrieval:
+            # No matching passage means the index can't answer, the store still might
+            passages = await asyncio.to_thread(retrieval.search, job.contractor_id, entry["prompt"])
+        cache_key = cache.make_key(job.fingerprint, entry["prompt"], LOCAL_CACHE_TEMPLATE if passages else None)
+        eval_result = await asyncio.to_thread(cache.get, cache_key)
+        cached = eval_result is not None
+        if not cached:
+            if passages:
+                eval_result = await _call_model(
+                    job.contractor_id, services.evaluate_criteria_passages, entry["prompt"], passages
+                )
+            else:
+                eval_result = await _call_model(job.contractor_id, services.evaluate_criteria, job.store_name, entry["prompt"])
+            entry["result"] = eval_result["text"]
+        outcome = _outcome_from_text(eval_result, cached)
+        if passages:
+            outcome["evidence"] = retrieval.evidence_for(passages)
+        await _complete_entry(job, entry, outcome)
+        if not cached:
+            await _cache_result(cache_key, job.contractor_id, eval_result)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        entry.update({"status": STATUS_FAILED, "error": str(e)})
+    finally:
+        entry["duration_ms"] = int((time.monotonic() - started) * 1000)
+        job.entry_finished(entry)
+
+async def _evaluate_group(job: EvaluationJob, group: list[dict]):
+    """Evaluates a group in one request, falling back to single calls for what it misses."""
+    started = time.monotonic()
+    for entry in group:
+        entry["status"] = STATUS_RUNNING
+    items, group_result = {}, None
+    try:
+        group_result = await _call_model(
+            job.contractor_id, services.evaluate_criteria_group, job.store_name,
+            [(entry["index"], entry["prompt"]) for entry in group]
+        )
+        items = group_result["items"]
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        print(f"Grouped evaluation failed for job {job.id}, falling back: {e}")
+
+    answered = [entry for entry in group if entry["index"] in items]
+    missing = [entry for entry in group if entry["index"] not in items]
+    group_sizer.record(len(group), len(missing), group_result["output_tokens"] if group_result else 0)
+
+    if answered:
+        # Token usage is per request, spread it over the criteria it answered; the first takes the remainder
+        n = len(answered)
+        input_share, input_rest = divmod(group_result["input_tokens"], n)
+        output_share, output_rest = divmod(group_result["output_tokens"], n)
+        duration_ms = int((time.monotonic() - started) * 1000)
+        for i, entry in enumerate(answered):
+            item = items[entry["index"]]
+            input_tokens = input_share + (input_rest if i == 0 else 0)
+            output_tokens = output_share + (output_rest if i == 0 else 0)
+            text = f"SCORE: {item['score']}\nEXPLANATION: {item['explanation']}"
+            outcome = {
+                "result": text,
+                "score": item["score"],
+                "comment": item["explanation"],
+                "evidence": item["evidence"],
+                "cached": False,
+                "input_tokens": input_tokens,
+                "output_tokens": output_tokens,
+            }
+            try:
+                await _complete_entry(job, entry, outcome)
+            except Exception as e:
+                entry.update({"status": STATUS_FAILED, "error": str(e)})
+            else:
+                await _cache_result(
+                    cache.make_key(job.fingerprint, entry["prompt"], GROUP_CACHE_TEMPLATE),
+                    job.contractor_id, {
+                        "text": text, "comment": item["explanation"], "evidence": item["evidence"],
+                        "input_tokens": input_tokens, "output_tokens": output_tokens,
+                    }
+                )
+            entry["duration_ms"] = duration_ms
+            job.entry_finished(entry)
+
+    if missing:
+        await asyncio.gather(*(_evaluate_one(job, entry) for entry in missing))
+
+async def _evaluate_grouped(job: EvaluationJob):
+    async def from_cache(entry: dict) -> bool:
+        key = cache.make_key(job.fingerprint, entry["prompt"], GROUP_CACHE_TEMPLATE)
+        try:
+            hit = await asyncio.to_thread(cache.get, key)
+            if hit is None:
+                return False
+            await _complete_entry(job, entry, _outcome_from_text(hit, cached=True))
+            job.entry_finished(entry)
+            return True
+        except Exception as e:
+            print(f"Cache lookup failed for job {job.id}: {e}")
+            return False
+
+    hits = await asyncio.gather(*(from_cache(entry) for entry in job.results))
+    pending = [entry for entry, hit in zip(job.results, hits) if not hit]
+    await asyncio.gather(*(_evaluate_group(job, group) for group in group_sizer.split(pending)))
+
+async def _run_job(job: EvaluationJob):
+    job.status = STATUS_RUNNING
+    job.started_at = datetime.utcnow()
+    try:
+        # Don't query the store before freshly imported files are indexed, on any worker
+        await ingestion.wait_until_indexed(job.contractor_id)
+        job.fingerprint = await asyncio.to_thread(cache.contractor_fingerprint, job.contractor_id)
+        if retrieval.LOCAL_RETRIEVAL and not job.group_criteria:
+            job.local_retrieval = await asyncio.to_thread(retrieval.covers_contractor, job.contractor_id)
+        # Criteria (or groups of them) fan out concurrently, _call_model bounds how many hit the provider
+        if job.group_criteria:
+            await _evaluate_grouped(job)
+        else:
+            await asyncio.gather(*(_evaluate_one(job, entry) for entry in job.results))
+        job.status = STATUS_COMPLETED
+    except asyncio.CancelledError:
+        job.status = STATUS_CANCELLED
+        for entry in job.results:
+            if entry["status"] in ACTIVE_STATUSES:
+                entry["status"] = STATUS_CANCELLED
+                job.entry_finished(entry)
+    except Exception as e:
+        job.status = STATUS_FAILED
+        job.error = str(e)
+    finally:
+        job.finished_at = datetime.utcnow()
+        job.notify()
+
+def start_evaluation_job(contractor_id: int, store_name: str, prompts: list[str],
+                         criteria_set_id: int | None = None, batch_id: str | None = None,
+                         group_criteria: bool = False) -> EvaluationJob:
+    """Registers a job and schedules it on the running event loop.
+
+    Jobs live in the memory of the worker that accepted them, results are
+    persisted to the database as each criterion finishes.
+    """
+    _prune_finished_jobs()
+    job = EvaluationJob(contractor_id, store_name, prompts, criteria_set_id, batch_id, group_criteria)
+    _jobs[job.id] = job
+    job.task = asyncio.get_running_loop().create_task(_run_job(job))
+    return job
+
+def start_batch_evaluation(bid_package_id: int, criteria_set: models.CriteriaSet,
+                           contractors: list[models.Contractor], group_criteria: bool = False) -> BatchEvaluation:
+    """Evaluates every contractor of a package against a criteria set.
+
+    All (contractor x criterion) pairs go through the shared fair scheduler,
+    so the global concurrency cap holds and results arrive for every bidder
+    from the start instead of one contractor after another.
+    """
+    batch = BatchEvaluation(bid_package_id, criteria_set.id)
+    for contractor in contractors:
+        if not contractor.gemini_store_name:
+            batch.skipped.append({"contractor_id": contractor.id, "reason": "Nhà thầu chưa có dữ liệu RAG"})
+            continue
+        batch.jobs.append(start_evaluation_job(
+            contractor.id, contractor.gemini_store_name, list(criteria_set.prompts),
+            criteria_set_id=criteria_set.id, batch_id=batch.id, group_criteria=group_criteria
+        ))
+    _batches[batch.id] = batch
+    return batch
+
+def get_batch(batch_id: str) -> BatchEvaluation | None:
+    return _batches.get(batch_id)
+
+def cancel_batch(batch_id: str) -> BatchEvaluation | None:
+    batch = _batches.get(batch_id)
+    if batch:
+        for job in batch.jobs:
+            cancel_job(job.id)
+    return batch
+
+def get_job(job_id: str) -> EvaluationJob | None:
+    return _jobs.get(job_id)
+
+def list_jobs(include_finished: bool = False) -> list[EvaluationJob]:
+    _prune_finished_jobs()
+    jobs = [job for job in _jobs.values() if include_finished or job.is_active]
+    return sorted(jobs, key=lambda job: job.created_at)
+
+def cancel_job(job_id: str) -> EvaluationJob | None:
+    """Requests cancellation; criteria already finished stay persisted."""
+    job = _jobs.get(job_id)
+    if job and job.is_active and job.task:
+        job.task.cancel()
+        if job.status == STATUS_PENDING:
+            # The task never started, so _run_job won't record the cancellation
+            job.status = STATUS_CANCELLED
+            job.finished_at = datetime.utcnow()
+            for entry in job.results:
+                entry["status"] = STATUS_CANCELLED
+                job.entry_finished(entry)
+            job.notify()
+    return job
+
+def cancel_contractor_jobs(contractor_ids: list[int]):
+    """Cancels active jobs of contractors that are being deleted."""
+    contractor_ids = set(contractor_ids)
+    for job in list(_jobs.values()):
+        if job.contractor_id in contractor_ids and job.is_active:
+            cancel_job(job.id)
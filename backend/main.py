@@ -1,30 +1,80 @@
-from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Form, status
-from datetime import timedelta
+from fastapi import FastAPI, Depends, HTTPException, UploadFile, File, Form, Header, Request, Response, status
+from fastapi.responses import PlainTextResponse, StreamingResponse
+from datetime import date, datetime
 from fastapi.middleware.cors import CORSMiddleware
+from sqlalchemy import func, select, delete, update
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from typing import List, Optional
+import asyncio
 import shutil
+import time
 import os
 import json
-import time
-import uuid
-import re
-from . import models, database, services, auth
+from . import models, database, auth, jobs, ingestion, cache, rollups, pagination, cleanup, reconcile, metrics, profiling, streaming, uploads, retrieval, comparison, export, idempotency
 from pydantic import BaseModel
 from fastapi.security import OAuth2PasswordRequestForm
 
-models.Base.metadata.create_all(bind=database.engine)
+# Nothing here touches the database or the model provider: engines and clients are
+# created on first use and the admin/rollup bootstrap runs after startup (see bootstrap).
+# The schema is managed by migrations (make migrate); DB_CREATE_SCHEMA=1 is only for throwaway databases.
+DB_CREATE_SCHEMA = os.getenv("DB_CREATE_SCHEMA", "0") == "1"
 
 app = FastAPI()
 
+# Registered before CORS so that CORS wraps it: replayed and refused responses get the CORS headers too
+@app.middleware("http")
+async def idempotent_requests(request: Request, call_next):
+    return await idempotency.handle(request, call_next)
+
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"], # Allow all for demo purposes
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[
+        pagination.NEXT_CURSOR_HEADER, pagination.TOTAL_COUNT_HEADER, "Server-Timing", idempotency.REPLAYED_HEADER,
+    ],
 )
 
+# Metrics: statement timing on both engines, plus gauges read at scrape time
+database.on_engine_created(metrics.instrument_engine)
+metrics.pool_gauges(database.created_engines, database.DB_MAX_OVERFLOW)
+metrics.Gauge("model_slots_available", "Free model call slots.", collect=lambda: [({}, jobs._model_slots.available)])
+metrics.Gauge("model_slots_waiting", "Model calls waiting for a slot.", collect=lambda: [({}, jobs._model_slots.waiting())])
+metrics.Gauge("evaluation_jobs_active", "Pending or running evaluation jobs.", collect=lambda: [({}, len(jobs.list_jobs()))])
+metrics.Gauge("ingestion_pending_imports", "Store imports still being indexed.",
+              collect=lambda: [({}, ingestion.tracker.pending_total())])
+metrics.Gauge("cleanup_pending", "Remote deletions waiting in the cleanup queue.",
+              collect=lambda: [({}, cleanup.cleanup_queue.pending())])
+
+@app.middleware("http")
+async def instrument_requests(request: Request, call_next):
+    stats = metrics.RequestStats()
+    token = metrics.current_request.set(stats)
+    profile = profiling.profiler.start()
+    metrics.http_in_flight.inc()
+    started = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        response.headers["Server-Timing"] = (
+            f'db;dur={stats.query_seconds * 1000:.1f};desc="{stats.queries} queries", '
+            f"app;dur={(time.perf_counter() - started) * 1000:.1f}"
+        )
+        return response
+    finally:
+        elapsed = time.perf_counter() - started
+        # The route template keeps label cardinality bounded (no ids in it)
+        route = request.scope.get("route")
+        route_path = route.path if route else "unmatched"
+        metrics.http_in_flight.dec()
+        metrics.record_request(request.method, route_path, status_code, elapsed, stats)
+        profiling.profiler.finish(profile, request.method, route_path, elapsed)
+        metrics.current_request.reset(token)
+
 # Dependency
 def get_db():
     db = database.SessionLocal()
@@ -45,6 +95,11 @@ class ContractorCreate(BaseModel):
 class CriteriaSetCreate(BaseModel):
     name: str
     prompts: List[str]
+    weights: Optional[List[float]] = None # One per prompt, used by the package comparison
+
+class PackageEvaluationCreate(BaseModel):
+    criteria_set_id: int
+    group_criteria: bool = False
 
 class UserCreate(BaseModel):
     username: str
@@ -72,14 +127,23 @@ class PasswordChange(BaseModel):
     old_password: str
     new_password: str
 
+class UploadSessionCreate(BaseModel):
+    filename: str
+    size: int
+    content_type: Optional[str] = None
+    chunk_size: Optional[int] = None
+    sha256: Optional[str] = None # Of the whole file, checked on finalize when given
+
 class Token(BaseModel):
     access_token: str
     token_type: str
 
 # Routes
 
-@app.on_event("startup")
-def startup_event():
+def bootstrap():
+    """Schema, default admin and rollup backfill; blocking, run once per worker after startup."""
+    if DB_CREATE_SCHEMA:
+        database.init_schema()
     db = database.SessionLocal()
     try:
         user = db.query(models.User).filter(models.User.username == "admin").first()
@@ -89,26 +153,58 @@ def startup_event():
             db.add(db_user)
             db.commit()
             print("Admin user created")
+        if idempotency.purge_expired(db):
+            db.commit()
+        # Backfill the usage rollups the first time they are deployed on existing data
+        has_history = db.query(models.EvaluationResult.id).first() or db.query(models.ContractorFile.id).first()
+        if has_history and not db.query(models.UsageRollup.id).first():
+            rollups.rebuild(db)
+            db.commit()
+            print("Usage rollups rebuilt")
     finally:
         db.close()
 
+async def _run_bootstrap():
+    started = time.perf_counter()
+    try:
+        await asyncio.to_thread(bootstrap)
+        app.state.ready = True
+        print(f"Bootstrap finished in {time.perf_counter() - started:.2f}s")
+    except Exception as e:
+        app.state.bootstrap_error = str(e)
+        print(f"Bootstrap failed: {e}")
+
+@app.on_event("startup")
+async def start_background_tasks():
+    app.state.ready = False
+    app.state.bootstrap_error = None
+    # Not awaited: the worker starts serving (and answering /) while the database is still being prepared
+    app.state.bootstrap_task = asyncio.create_task(_run_bootstrap())
+    if reconcile.RECONCILE_INTERVAL_SECONDS > 0:
+        app.state.reconcile_task = asyncio.create_task(reconcile.run_periodically())
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    reconcile_task = getattr(app.state, "reconcile_task", None)
+    if reconcile_task:
+        reconcile_task.cancel()
+    await cleanup.cleanup_queue.stop()
+
 @app.post("/token", response_model=Token)
-async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: Session = Depends(get_db)):
-    user = db.query(models.User).filter(models.User.username == form_data.username).first()
-    if not user or not auth.verify_password(form_data.password, user.hashed_password):
+async def login_for_access_token(form_data: OAuth2PasswordRequestForm = Depends(), db: AsyncSession = Depends(database.get_async_db)):
+    result = await db.execute(select(models.User).where(models.User.username == form_data.username))
+    user = result.scalars().first()
+    if not user or not await auth.verify_password_async(form_data.password, user.hashed_password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    access_token_expires = timedelta(minutes=auth.ACCESS_TOKEN_EXPIRE_MINUTES)
-    access_token = auth.create_access_token(
-        data={"sub": user.username}, expires_delta=access_token_expires
-    )
+    access_token = auth.create_user_token(user)
     return {"access_token": access_token, "token_type": "bearer"}
 
 @app.post("/users/", response_model=UserResponse)
-def create_user(user: UserCreate, db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_admin_user)):
+def create_user(user: UserCreate, db: Session = Depends(get_db), current_user: auth.Principal = Depends(auth.get_current_admin_user)):
     db_user = db.query(models.User).filter(models.User.username == user.username).first()
     if db_user:
         raise HTTPException(status_code=400, detail="Username already registered")
@@ -120,12 +216,20 @@ def create_user(user: UserCreate, db: Session = Depends(get_db), current_user: m
     return db_user
 
 @app.get("/users/", response_model=List[UserResponse])
-def read_users(skip: int = 0, limit: int = 100, db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_admin_user)):
-    users = db.query(models.User).offset(skip).limit(limit).all()
-    return users
+def read_users(
+    response: Response,
+    q: Optional[str] = None,
+    page: pagination.PageParams = Depends(),
+    db: Session = Depends(get_db),
+    current_user: auth.Principal = Depends(auth.get_current_admin_user)
+):
+    query = db.query(models.User)
+    if q:
+        query = query.filter(models.User.username.ilike(f"%{q}%") | models.User.full_name.ilike(f"%{q}%"))
+    return pagination.paginate(query, models.User, page, response)
 
 @app.put("/users/{user_id}", response_model=UserResponse)
-def update_user(user_id: int, user: UserUpdate, db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_admin_user)):
+def update_user(user_id: int, user: UserUpdate, db: Session = Depends(get_db), current_user: auth.Principal = Depends(auth.get_current_admin_user)):
     db_user = db.query(models.User).filter(models.User.id == user_id).first()
     if not db_user:
         raise HTTPException(status_code=404, detail="User not found")
@@ -137,27 +241,38 @@ def update_user(user_id: int, user: UserUpdate, db: Session = Depends(get_db), c
         db_user.is_active = user.is_active
     if user.role:
         db_user.role = user.role
+    if user.password or user.is_active is not None or user.role:
+        # Credentials, status or permissions changed: tokens issued before must stop working
+        auth.revoke_tokens(db_user)
     db.commit()
+    auth.invalidate_principal(db_user.username)
     db.refresh(db_user)
     return db_user
 
 @app.post("/users/me/password")
-async def change_password(password_data: PasswordChange, db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_active_user)):
-    if not auth.verify_password(password_data.old_password, current_user.hashed_password):
+async def change_password(password_data: PasswordChange, db: AsyncSession = Depends(database.get_async_db), current_user: auth.Principal = Depends(auth.get_current_active_user)):
+    if not await auth.verify_password_async(password_data.old_password, current_user.hashed_password):
         raise HTTPException(status_code=400, detail="Mật khẩu cũ không chính xác")
 
     # Re-query user in current session to ensure it's tracked
-    db_user = db.query(models.User).filter(models.User.id == current_user.id).first()
+    db_user = await db.get(models.User, current_user.id)
     if not db_user:
         raise HTTPException(status_code=404, detail="User not found")
 
-    db_user.hashed_password = auth.get_password_hash(password_data.new_password)
-    db.commit()
-    db.refresh(db_user)
-    return {"status": "success", "message": "Đổi mật khẩu thành công"}
+    db_user.hashed_password = await auth.get_password_hash_async(password_data.new_password)
+    # Old tokens stop working; hand back a fresh one so this session stays logged in
+    auth.revoke_tokens(db_user)
+    await db.commit()
+    auth.invalidate_principal(db_user.username)
+    return {
+        "status": "success",
+        "message": "Đổi mật khẩu thành công",
+        "access_token": auth.create_user_token(db_user),
+        "token_type": "bearer"
+    }
 
 @app.delete("/users/{user_id}")
-def delete_user(user_id: int, db: Session = Depends(get_db), current_user: models.User = Depends(auth.get_current_admin_user)):
+def delete_user(user_id: int, db: Session = Depends(get_db), current_user: auth.Principal = Depends(auth.get_current_admin_user)):
     db_user = db.query(models.User).filter(models.User.id == user_id).first()
     if not db_user:
         raise HTTPException(status_code=404, detail="User not found")
@@ -165,6 +280,7 @@ def delete_user(user_id: int, db: Session = Depends(get_db), current_user: model
         raise HTTPException(status_code=400, detail="Không thể xóa tài khoản đang đăng nhập")
     db.delete(db_user)
     db.commit()
+    auth.invalidate_principal(db_user.username)
     return {"status": "success", "message": "User deleted"}
 
 @app.post("/bid_packages/")
@@ -176,8 +292,16 @@ def create_bid_package(bid: BidPackageCreate, db: Session = Depends(get_db)):
     return db_bid
 
 @app.get("/bid_packages/")
-def list_bid_packages(db: Session = Depends(get_db)):
-    return db.query(models.BidPackage).all()
+def list_bid_packages(
+    response: Response,
+    q: Optional[str] = None,
+    page: pagination.PageParams = Depends(),
+    db: Session = Depends(get_db)
+):
+    query = db.query(models.BidPackage)
+    if q:
+        query = query.filter(models.BidPackage.name.ilike(f"%{q}%"))
+    return pagination.paginate(query, models.BidPackage, page, response)
 
 @app.put("/bid_packages/{bid_id}")
 def update_bid_package(bid_id: int, bid: BidPackageCreate, db: Session = Depends(get_db)):
@@ -192,23 +316,25 @@ def update_bid_package(bid_id: int, bid: BidPackageCreate, db: Session = Depends
     return db_bid
 
 @app.delete("/bid_packages/{bid_id}")
-def delete_bid_package(bid_id: int, db: Session = Depends(get_db)):
-    db_bid = db.query(models.BidPackage).filter(models.BidPackage.id == bid_id).first()
+async def delete_bid_package(bid_id: int, db: AsyncSession = Depends(database.get_async_db)):
+    db_bid = await db.get(models.BidPackage, bid_id)
     if not db_bid:
         raise HTTPException(status_code=404, detail="Không tìm thấy gói thầu")
     
-    # Delete all contractors and their stores first
-    contractors = db.query(models.Contractor).filter(models.Contractor.bid_package_id == bid_id).all()
-    for contractor in contractors:
-        if contractor.gemini_store_name:
-            services.delete_store(contractor.gemini_store_name)
-        # Delete files from DB (and maybe local FS? keeping it simple for now)
-        db.query(models.ContractorFile).filter(models.ContractorFile.contractor_id == contractor.id).delete()
-        db.query(models.EvaluationResult).filter(models.EvaluationResult.contractor_id == contractor.id).delete()
-        db.delete(contractor)
-        
-    db.delete(db_bid)
-    db.commit()
+    # Delete all contractors and their data first, one statement per table
+    removed = await cleanup.delete_contractors(
+        db, select(models.Contractor.id).where(models.Contractor.bid_package_id == bid_id)
+    )
+    await db.execute(
+        update(models.UsageRollup).where(models.UsageRollup.bid_package_id == bid_id).values(bid_package_id=None)
+    )
+    await db.execute(delete(models.BidPackage).where(models.BidPackage.id == bid_id))
+    await db.commit()
+
+    # Remote stores and files are removed in the background
+    jobs.cancel_contractor_jobs(removed["contractor_ids"])
+    cleanup.cleanup_queue.enqueue_stores(removed["stores"])
+    cleanup.cleanup_queue.enqueue_files(removed["files"])
     return {"status": "success", "message": "Đã xóa gói thầu và dữ liệu liên quan"}
 
 @app.post("/contractors/")
@@ -220,8 +346,17 @@ def create_contractor(contractor: ContractorCreate, db: Session = Depends(get_db
     return db_contractor
 
 @app.get("/bid_packages/{bid_id}/contractors")
-def list_contractors(bid_id: int, db: Session = Depends(get_db)):
-    return db.query(models.Contractor).filter(models.Contractor.bid_package_id == bid_id).all()
+def list_contractors(
+    bid_id: int,
+    response: Response,
+    q: Optional[str] = None,
+    page: pagination.PageParams = Depends(),
+    db: Session = Depends(get_db)
+):
+    query = db.query(models.Contractor).filter(models.Contractor.bid_package_id == bid_id)
+    if q:
+        query = query.filter(models.Contractor.name.ilike(f"%{q}%"))
+    return pagination.paginate(query, models.Contractor, page, response)
 
 @app.put("/contractors/{contractor_id}")
 def update_contractor(contractor_id: int, contractor: ContractorCreate, db: Session = Depends(get_db)):
@@ -234,28 +369,28 @@ def update_contractor(contractor_id: int, contractor: ContractorCreate, db: Sess
     return db_contractor
 
 @app.delete("/contractors/{contractor_id}")
-def delete_contractor(contractor_id: int, db: Session = Depends(get_db)):
-    db_contractor = db.query(models.Contractor).filter(models.Contractor.id == contractor_id).first()
+async def delete_contractor(contractor_id: int, db: AsyncSession = Depends(database.get_async_db)):
+    db_contractor = await db.get(models.Contractor, contractor_id)
     if not db_contractor:
         raise HTTPException(status_code=404, detail="Không tìm thấy nhà thầu")
     
-    # Delete Gemini store
-    if db_contractor.gemini_store_name:
-        services.delete_store(db_contractor.gemini_store_name)
-        
-    # Delete related data
-    db.query(models.ContractorFile).filter(models.ContractorFile.contractor_id == contractor_id).delete()
-    db.query(models.EvaluationResult).filter(models.EvaluationResult.contractor_id == contractor_id).delete()
-    
-    db.delete(db_contractor)
-    db.commit()
+    # Delete the contractor and related data
+    removed = await cleanup.delete_contractors(
+        db, select(models.Contractor.id).where(models.Contractor.id == contractor_id)
+    )
+    await db.commit()
+
+    # Gemini store and unreferenced files are removed in the background
+    jobs.cancel_contractor_jobs(removed["contractor_ids"])
+    cleanup.cleanup_queue.enqueue_stores(removed["stores"])
+    cleanup.cleanup_queue.enqueue_files(removed["files"])
     return {"status": "success", "message": "Đã xóa nhà thầu và dữ liệu liên quan"}
 
 @app.post("/upload_file/")
-async def upload_file(file: UploadFile = File(...)):
+def upload_file(file: UploadFile = File(...)):
     upload_dir = "uploads"
     os.makedirs(upload_dir, exist_ok=True)
-    file_path = os.path.join(upload_dir, file.filename)
+    file_path = os.path.join(upload_dir, os.path.basename(file.filename))
     with open(file_path, "wb") as buffer:
         shutil.copyfileobj(file.file, buffer)
     return {"filename": file.filename, "path": file_path}
@@ -264,106 +399,147 @@ async def upload_file(file: UploadFile = File(...)):
 async def process_contractor_files(
     contractor_id: int,
     files: List[UploadFile] = File(...),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(database.get_async_db)
 ):
     # Fetch contractor
-    contractor = db.query(models.Contractor).filter(models.Contractor.id == contractor_id).first()
+    contractor = await db.get(models.Contractor, contractor_id)
     if not contractor:
         raise HTTPException(status_code=404, detail="Không tìm thấy nhà thầu")
 
-    # 1. Save uploaded files locally & Upload to Gemini
-    upload_dir = "uploads"
-    os.makedirs(upload_dir, exist_ok=True)
-    
-    uploaded_file_records = [] # List of (db_file, gemini_file)
-    
-    for file in files:
-        # Use placeholder for local path since we are not saving locally
-        # We still generate a safe filename for the display_name or potential future use
-        file_extension = os.path.splitext(file.filename)[1]
-        safe_filename = f"{uuid.uuid4()}{file_extension}"
-        # Use a special scheme to indicate it's not on disk
-        file_path = f"memory://{safe_filename}"
-        
-        # Create DB record
-        db_file = models.ContractorFile(
-            contractor_id=contractor_id,
-            filename=file.filename,
-            file_path=file_path,
-            file_size=file.size, # Save file size
-            is_stored_in_gemini=False
+    if not files:
+        raise HTTPException(status_code=400, detail="Không có tệp nào để xử lý.")
+
+    # Upload, wait for processing and import each file as a pipeline.
+    # is_stored_in_gemini is set by the ingestion tracker once each import operation is done.
+    try:
+        results = await ingestion.ingest_files(contractor_id, contractor.gemini_store_name, files)
+    except ingestion.IngestionBusy:
+        raise HTTPException(status_code=409, detail="Nhà thầu đang có một lượt tải tệp khác, vui lòng thử lại sau")
+    failed = [r for r in results if r["status"] == "failed"]
+    if len(failed) == len(results):
+        raise HTTPException(
+            status_code=500,
+            detail="Tải lên Gemini thất bại: " + "; ".join(f"{r['filename']}: {r['error']}" for r in failed)
+        )
+
+    return {
+        "status": "partial" if failed else "success",
+        "message": f"Đã xử lý {len(results) - len(failed)}/{len(results)} tệp, đang lập chỉ mục trong RAG store",
+        "files": results,
+        "pending_imports": ingestion.tracker.pending_count(contractor_id)
+    }
+
+# Resumable uploads: create a session, PUT the chunks (in any order, retried as needed), finalize.
+# The finalized file goes through the same ingestion as process-files.
+
+@app.post("/contractors/{contractor_id}/uploads", status_code=status.HTTP_201_CREATED)
+async def create_upload_session(
+    contractor_id: int,
+    upload: UploadSessionCreate,
+    db: AsyncSession = Depends(database.get_async_db)
+):
+    if not await db.get(models.Contractor, contractor_id):
+        raise HTTPException(status_code=404, detail="Không tìm thấy nhà thầu")
+    try:
+        session = await asyncio.to_thread(
+            uploads.create_session, contractor_id, upload.filename, upload.size,
+            upload.content_type, upload.chunk_size, upload.sha256
         )
-        db.add(db_file)
-        db.commit()
-        db.refresh(db_file)
+    except uploads.UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    return await asyncio.to_thread(session.status)
 
-        # Upload to Gemini
+async def _get_upload_session(upload_id: str) -> uploads.UploadSession:
+    try:
+        return await asyncio.to_thread(uploads.get_session, upload_id)
+    except uploads.UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+
+@app.get("/uploads/{upload_id}")
+async def get_upload_session(upload_id: str):
+    """Session state; missing_offsets tells a resuming client what to send."""
+    session = await _get_upload_session(upload_id)
+    return await asyncio.to_thread(session.status)
+
+@app.put("/uploads/{upload_id}/chunks")
+async def put_upload_chunk(
+    upload_id: str,
+    offset: int,
+    request: Request,
+    x_chunk_sha256: Optional[str] = Header(None) # Hex SHA-256 of this chunk's bytes
+):
+    session = await _get_upload_session(upload_id)
+    try:
+        await asyncio.to_thread(uploads.check_chunk, session, offset, x_chunk_sha256)
+        writer = await asyncio.to_thread(uploads.ChunkWriter, session, offset, x_chunk_sha256)
         try:
-            # Pass the file-like object directly
-            g_file = services.upload_file(file.file, mime_type=file.content_type, display_name=file.filename)
-            
-            # Update DB record
-            db_file.gemini_file_name = g_file.name
-            db_file.gemini_file_uri = g_file.uri
-            db.commit()
-            
-            uploaded_file_records.append((db_file, g_file))
-        except Exception as e:
-            # If one fails, we continue but log/warn? For now, fail hard to ensure integrity
-            raise HTTPException(status_code=500, detail=f"Tải lên Gemini thất bại cho {file.filename}: {str(e)}")
+            # The body is consumed as it arrives, at most one write buffer is held
+            buffer = bytearray()
+            async for piece in request.stream():
+                buffer += piece
+                if len(buffer) >= uploads.UPLOAD_WRITE_BUFFER:
+                    await asyncio.to_thread(writer.write, bytes(buffer))
+                    buffer.clear()
+            if buffer:
+                await asyncio.to_thread(writer.write, bytes(buffer))
+            chunk = await asyncio.to_thread(writer.commit)
+        finally:
+            writer.close()
+    except uploads.UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    return {**chunk, "missing_chunks": len(await asyncio.to_thread(session.missing))}
+
+@app.post("/uploads/{upload_id}/finalize")
+async def finalize_upload(upload_id: str, db: AsyncSession = Depends(database.get_async_db)):
+    session = await _get_upload_session(upload_id)
+    try:
+        await asyncio.to_thread(uploads.begin_finalize, session)
+    except uploads.UploadError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
 
-    # 2. Manage RAG Store
-    rag_store_name = contractor.gemini_store_name
-    gemini_files_to_add = [g for _, g in uploaded_file_records]
-    
-    if rag_store_name:
-        # Store exists, add new files
-        if gemini_files_to_add:
-            try:
-                for g_file in gemini_files_to_add:
-                    services.add_file_to_store(rag_store_name, g_file.name)
-                
-                # Update status
-                for db_file, _ in uploaded_file_records:
-                    db_file.is_stored_in_gemini = True
-                db.commit()
-
-                # Wait for indexing
-                time.sleep(5)
-            except Exception as e:
-                raise HTTPException(status_code=500, detail=f"Không thể thêm tệp vào kho hiện có: {str(e)}")
-    else:
-        # No store exists, create new one
-        if gemini_files_to_add:
-            store_display_name = f"evaluation_{contractor_id}_{int(time.time())}"
+    try:
+        contractor = await db.get(models.Contractor, session.meta["contractor_id"])
+        if not contractor:
+            await asyncio.to_thread(uploads.delete_session, session)
+            raise HTTPException(status_code=404, detail="Không tìm thấy nhà thầu")
+
+        assembled = await asyncio.to_thread(uploads.AssembledFile, session)
+        try:
+            expected = session.meta["sha256"]
+            if expected and await asyncio.to_thread(ingestion.hash_file, assembled.file) != expected:
+                await asyncio.to_thread(uploads.delete_session, session)
+                raise HTTPException(status_code=422, detail="Mã kiểm tra SHA-256 của tệp không khớp")
             try:
-                rag_store_name = services.create_store_with_files(store_display_name, [f.name for f in gemini_files_to_add])
-                
-                # Update contractor with store name
-                contractor.gemini_store_name = rag_store_name
-                
-                # Update status
-                for db_file, _ in uploaded_file_records:
-                    db_file.is_stored_in_gemini = True
-                db.commit()
-                
-                # Wait for indexing
-                time.sleep(5)
-            except Exception as e:
-                raise HTTPException(status_code=500, detail=f"Tạo kho RAG thất bại: {str(e)}")
-        else:
-             raise HTTPException(status_code=400, detail="Không có tệp nào để xử lý.")
-
-    return {"status": "success", "message": f"Đã xử lý {len(files)} tệp và cập nhật RAG store"}
-
-@app.post("/evaluate/")
-async def evaluate_contractor(
-    contractor_id: int = Form(...),
-    prompts: str = Form(...), # Expecting JSON string for list of prompts
-    db: Session = Depends(get_db)
-):
+                result = (await ingestion.ingest_files(contractor.id, contractor.gemini_store_name, [assembled]))[0]
+            except ingestion.IngestionBusy:
+                raise HTTPException(status_code=409, detail="Nhà thầu đang có một lượt tải tệp khác, vui lòng thử lại sau")
+        finally:
+            assembled.close()
+    except BaseException:
+        await asyncio.to_thread(uploads.abort_finalize, session)
+        raise
+
+    if result["status"] == "failed":
+        # Keep the chunks so the finalize can be retried without uploading again
+        await asyncio.to_thread(uploads.abort_finalize, session)
+        raise HTTPException(status_code=500, detail=f"Tải lên Gemini thất bại: {result['error']}")
+    await asyncio.to_thread(uploads.delete_session, session)
+    return {
+        "status": "success",
+        "file": result,
+        "pending_imports": ingestion.tracker.pending_count(contractor.id)
+    }
+
+@app.delete("/uploads/{upload_id}")
+async def abort_upload(upload_id: str):
+    session = await _get_upload_session(upload_id)
+    await asyncio.to_thread(uploads.delete_session, session)
+    return {"status": "success", "message": "Đã hủy phiên tải lên"}
+
+async def _start_contractor_evaluation(contractor_id: int, prompts: str, group_criteria: bool,
+                                      db: AsyncSession) -> jobs.EvaluationJob:
     # Fetch contractor to check for existing store
-    contractor = db.query(models.Contractor).filter(models.Contractor.id == contractor_id).first()
+    contractor = await db.get(models.Contractor, contractor_id)
     if not contractor:
         raise HTTPException(status_code=404, detail="Không tìm thấy nhà thầu")
     
@@ -371,8 +547,6 @@ async def evaluate_contractor(
     if not rag_store_name:
         raise HTTPException(status_code=400, detail="Nhà thầu chưa có dữ liệu RAG. Vui lòng tải lên và xử lý tệp trước.")
 
-    # 3. Evaluate each prompt
-    results = []
     # Parse prompts
     try:
         prompt_list = json.loads(prompts)
@@ -381,104 +555,379 @@ async def evaluate_contractor(
     except (json.JSONDecodeError, ValueError) as e:
         raise HTTPException(status_code=400, detail=f"Định dạng lời nhắc không hợp lệ: {str(e)}")
 
-    for prompt in prompt_list:
-        try:
-            eval_result = services.evaluate_criteria(rag_store_name, prompt)
-            eval_text = eval_result["text"]
-            
-            # Parse score and explanation
-            score = 0
-            comment = eval_text
-            
-            match = re.search(r"SCORE:\s*(\d+)", eval_text)
-            if match:
-                score = int(match.group(1))
-            
-            explanation_match = re.search(r"EXPLANATION:\s*(.*)", eval_text, re.DOTALL)
-            if explanation_match:
-                comment = explanation_match.group(1).strip()
-            else:
-                # Fallback if format isn't perfect, try to strip SCORE line
-                comment = re.sub(r"SCORE:\s*\d+\s*", "", eval_text).strip()
-            
-            # Save to DB
-            db_result = models.EvaluationResult(
-                contractor_id=contractor_id,
-                criteria_prompt=prompt,
-                score=score, # Placeholder
-                comment=comment,
-                evidence="",
-                input_tokens=eval_result["input_tokens"],
-                output_tokens=eval_result["output_tokens"]
-            )
-            db.add(db_result)
-            results.append({"prompt": prompt, "result": eval_text})
-        except Exception as e:
-            results.append({"prompt": prompt, "error": str(e)})
+    # Evaluate in the background, results are saved as each criterion finishes
+    return jobs.start_evaluation_job(contractor_id, rag_store_name, prompt_list, group_criteria=group_criteria)
+
+def _stream_job(job: jobs.EvaluationJob, fmt: str, after: int = -1) -> StreamingResponse:
+    if fmt not in streaming.MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail="Định dạng phải là sse hoặc ndjson")
+    return StreamingResponse(
+        streaming.job_events(job, fmt, after),
+        media_type=streaming.MEDIA_TYPES[fmt],
+        headers={**streaming.STREAM_HEADERS, "X-Job-Id": job.id},
+    )
 
+@app.post("/evaluate/", status_code=status.HTTP_202_ACCEPTED)
+async def evaluate_contractor(
+    contractor_id: int = Form(...),
+    prompts: str = Form(...), # Expecting JSON string for list of prompts
+    group_criteria: bool = Form(False), # Evaluate several criteria per request with JSON output
+    db: AsyncSession = Depends(database.get_async_db)
+):
+    job = await _start_contractor_evaluation(contractor_id, prompts, group_criteria, db)
+    return {"status": "Đã bắt đầu đánh giá", "job_id": job.id, "total": len(job.results)}
+
+@app.post("/evaluate/stream")
+async def evaluate_contractor_stream(
+    contractor_id: int = Form(...),
+    prompts: str = Form(...),
+    group_criteria: bool = Form(False),
+    format: str = Form(streaming.FORMAT_SSE), # sse or ndjson
+    db: AsyncSession = Depends(database.get_async_db)
+):
+    """Like /evaluate/, but streams each criterion as soon as it finishes.
+
+    The job keeps running if the client disconnects; it can reattach with
+    GET /evaluate/jobs/{job_id}/stream.
+    """
+    if format not in streaming.MEDIA_TYPES:
+        raise HTTPException(status_code=400, detail="Định dạng phải là sse hoặc ndjson")
+    job = await _start_contractor_evaluation(contractor_id, prompts, group_criteria, db)
+    return _stream_job(job, format)
+
+@app.get("/evaluate/jobs")
+def list_evaluation_jobs(include_finished: bool = False):
+    return [job.to_dict(include_results=False) for job in jobs.list_jobs(include_finished)]
+
+@app.get("/evaluate/jobs/{job_id}")
+def get_evaluation_job(job_id: str):
+    job = jobs.get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Không tìm thấy tác vụ đánh giá")
+    return job.to_dict()
+
+@app.get("/evaluate/jobs/{job_id}/stream")
+def stream_evaluation_job(
+    job_id: str,
+    format: str = streaming.FORMAT_SSE,
+    after: int = -1, # Last seq received, results up to it are not sent again
+    last_event_id: Optional[int] = Header(None) # Sent by EventSource when it reconnects
+):
+    job = jobs.get_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Không tìm thấy tác vụ đánh giá")
+    if last_event_id is not None:
+        after = max(after, last_event_id)
+    return _stream_job(job, format, after)
+
+@app.post("/evaluate/jobs/{job_id}/cancel")
+def cancel_evaluation_job(job_id: str):
+    job = jobs.cancel_job(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Không tìm thấy tác vụ đánh giá")
+    return job.to_dict(include_results=False)
+
+@app.post("/bid_packages/{bid_id}/evaluate", status_code=status.HTTP_202_ACCEPTED)
+def evaluate_bid_package(bid_id: int, request: PackageEvaluationCreate, db: Session = Depends(get_db)):
+    db_bid = db.query(models.BidPackage).filter(models.BidPackage.id == bid_id).first()
+    if not db_bid:
+        raise HTTPException(status_code=404, detail="Không tìm thấy gói thầu")
+    criteria_set = db.query(models.CriteriaSet).filter(models.CriteriaSet.id == request.criteria_set_id).first()
+    if not criteria_set:
+        raise HTTPException(status_code=404, detail="Không tìm thấy bộ tiêu chí")
+    if not criteria_set.prompts:
+        raise HTTPException(status_code=400, detail="Bộ tiêu chí không có tiêu chí nào")
+
+    contractors = db.query(models.Contractor).filter(models.Contractor.bid_package_id == bid_id).all()
+    batch = jobs.start_batch_evaluation(bid_id, criteria_set, contractors, request.group_criteria)
+    return batch.to_dict()
+
+@app.get("/bid_packages/{bid_id}/comparison")
+def compare_bid_package(
+    bid_id: int,
+    criteria_set_id: int,
+    selection: str = "latest_run",
+    normalization: str = "scale",
+    db: Session = Depends(get_db)
+):
+    """Contractor x criterion score matrix with weighted totals and ranks, without comment text."""
+    if selection not in comparison.SELECTIONS:
+        raise HTTPException(status_code=400, detail=f"selection phải là một trong {', '.join(comparison.SELECTIONS)}")
+    if normalization not in comparison.NORMALIZATIONS:
+        raise HTTPException(status_code=400, detail=f"normalization phải là một trong {', '.join(comparison.NORMALIZATIONS)}")
+    if not db.query(models.BidPackage.id).filter(models.BidPackage.id == bid_id).first():
+        raise HTTPException(status_code=404, detail="Không tìm thấy gói thầu")
+    criteria_set = db.query(models.CriteriaSet).filter(models.CriteriaSet.id == criteria_set_id).first()
+    if not criteria_set:
+        raise HTTPException(status_code=404, detail="Không tìm thấy bộ tiêu chí")
+
+    contractors = db.query(models.Contractor.id, models.Contractor.name).filter(
+        models.Contractor.bid_package_id == bid_id
+    ).order_by(models.Contractor.created_at, models.Contractor.id).all()
+    rows = comparison.fetch_scores(db, bid_id, criteria_set_id)
+    return {
+        "bid_package_id": bid_id,
+        **comparison.build_matrix(criteria_set, contractors, rows, selection, normalization),
+    }
+
+@app.get("/bid_packages/{bid_id}/export")
+def export_bid_package(
+    bid_id: int,
+    format: str = export.FORMAT_CSV,
+    contractor_id: Optional[int] = None,
+    criteria_set_id: Optional[int] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    db: Session = Depends(get_db)
+):
+    """Every evaluation result of the package as CSV or XLSX, streamed with constant memory."""
+    if format not in export.formats():
+        raise HTTPException(status_code=400, detail=f"format phải là một trong {', '.join(export.formats())}")
+    if not db.query(models.BidPackage.id).filter(models.BidPackage.id == bid_id).first():
+        raise HTTPException(status_code=404, detail="Không tìm thấy gói thầu")
+    stmt = export.export_query(bid_id, contractor_id, criteria_set_id, created_from, created_to)
+    filename = f"evaluations_package_{bid_id}_{datetime.utcnow():%Y%m%d_%H%M%S}.{format}"
+    return StreamingResponse(
+        export.stream(format, stmt),
+        media_type=export.MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+@app.get("/evaluate/batches/{batch_id}")
+def get_batch_evaluation(batch_id: str, include_results: bool = False):
+    batch = jobs.get_batch(batch_id)
+    if not batch:
+        raise HTTPException(status_code=404, detail="Không tìm thấy lượt đánh giá gói thầu")
+    return batch.to_dict(include_results=include_results)
+
+@app.post("/evaluate/batches/{batch_id}/cancel")
+def cancel_batch_evaluation(batch_id: str):
+    batch = jobs.cancel_batch(batch_id)
+    if not batch:
+        raise HTTPException(status_code=404, detail="Không tìm thấy lượt đánh giá gói thầu")
+    return batch.to_dict()
+
+def _check_weights(criteria_set: CriteriaSetCreate):
+    weights = criteria_set.weights
+    if weights is None:
+        return
+    if len(weights) != len(criteria_set.prompts):
+        raise HTTPException(status_code=400, detail="Số trọng số phải bằng số tiêu chí")
+    if any(w < 0 for w in weights) or not sum(weights) > 0:
+        raise HTTPException(status_code=400, detail="Trọng số phải không âm và có tổng lớn hơn 0")
+
+@app.post("/criteria_sets/")
+def create_criteria_set(criteria_set: CriteriaSetCreate, db: Session = Depends(get_db)):
+    _check_weights(criteria_set)
+    db_set = models.CriteriaSet(name=criteria_set.name, prompts=criteria_set.prompts, weights=criteria_set.weights)
+    db.add(db_set)
+    db.commit()
+    db.refresh(db_set)
+    return db_set
+
+@app.get("/criteria_sets/")
+def list_criteria_sets(db: Session = Depends(get_db)):
+    return db.query(models.CriteriaSet).all()
+
+@app.get("/criteria_sets/{set_id}")
+def get_criteria_set(set_id: int, db: Session = Depends(get_db)):
+    db_set = db.query(models.CriteriaSet).filter(models.CriteriaSet.id == set_id).first()
+    if not db_set:
+        raise HTTPException(status_code=404, detail="Không tìm thấy bộ tiêu chí")
+    return db_set
+
+@app.put("/criteria_sets/{set_id}")
+def update_criteria_set(set_id: int, criteria_set: CriteriaSetCreate, db: Session = Depends(get_db)):
+    db_set = db.query(models.CriteriaSet).filter(models.CriteriaSet.id == set_id).first()
+    if not db_set:
+        raise HTTPException(status_code=404, detail="Không tìm thấy bộ tiêu chí")
+    _check_weights(criteria_set)
+    db_set.name = criteria_set.name
+    db_set.prompts = criteria_set.prompts
+    db_set.weights = criteria_set.weights
     db.commit()
-    return {"status": "Đánh giá hoàn tất", "results": results}
+    db.refresh(db_set)
+    return db_set
+
+@app.delete("/criteria_sets/{set_id}")
+def delete_criteria_set(set_id: int, db: Session = Depends(get_db)):
+    db_set = db.query(models.CriteriaSet).filter(models.CriteriaSet.id == set_id).first()
+    if not db_set:
+        raise HTTPException(status_code=404, detail="Không tìm thấy bộ tiêu chí")
+    # Keep past results, just unlink them from the set
+    db.query(models.EvaluationResult).filter(models.EvaluationResult.criteria_set_id == set_id).update(
+        {models.EvaluationResult.criteria_set_id: None}, synchronize_session=False
+    )
+    db.delete(db_set)
+    db.commit()
+    return {"status": "success", "message": "Đã xóa bộ tiêu chí"}
 
 @app.get("/reports/stats")
-def get_stats(db: Session = Depends(get_db)):
-    total_packages = db.query(models.BidPackage).count()
-    total_contractors = db.query(models.Contractor).count()
-    total_evaluations = db.query(models.EvaluationResult).count()
-    
-    # File stats
-    files = db.query(models.ContractorFile).all()
-    total_files = len(files)
-    total_size_bytes = sum(f.file_size for f in files if f.file_size)
-    total_size_mb = total_size_bytes / (1024 * 1024)
-    
-    # Token stats
-    evals = db.query(models.EvaluationResult).all()
-    total_input_tokens = sum(e.input_tokens for e in evals if e.input_tokens)
-    total_output_tokens = sum(e.output_tokens for e in evals if e.output_tokens)
-    
-    # Cost estimation (Gemini 1.5 Flash rates)
-    # Input: $0.075 / 1M tokens (for < 128k context, assuming short context for now)
-    # Output: $0.30 / 1M tokens
-    # Storage: Free up to 2GB? Actually File Search has costs.
-    # Let's use generic rates:
-    # Input: $0.075 per 1M
-    # Output: $0.30 per 1M
-    # Storage: $0.10 per GB/month (approx)
-    
-    cost_input = (total_input_tokens / 1_000_000) * 0.075
-    cost_output = (total_output_tokens / 1_000_000) * 0.30
-    cost_storage = (total_size_mb / 1024) * 0.10 # Very rough estimate per month
-    
-    total_cost = cost_input + cost_output + cost_storage
-    
-    return {
+def get_stats(
+    date_from: Optional[date] = None,
+    date_to: Optional[date] = None,
+    bid_package_id: Optional[int] = None,
+    breakdown: bool = False,
+    db: Session = Depends(get_db)
+):
+    # Totals come from the usage_rollups table, which is maintained as files and results are written
+    usage = rollups.totals(db, date_from, date_to, bid_package_id)
+
+    if bid_package_id is not None:
+        total_packages = 1
+        total_contractors = db.query(func.count(models.Contractor.id)).filter(
+            models.Contractor.bid_package_id == bid_package_id
+        ).scalar()
+    else:
+        total_packages = db.query(func.count(models.BidPackage.id)).scalar()
+        total_contractors = db.query(func.count(models.Contractor.id)).scalar()
+
+    # Tokens a cache hit would have cost, counted from the entries that served the hits
+    tokens_saved = db.query(func.coalesce(func.sum(
+        models.EvaluationCacheEntry.hit_count
+        * (models.EvaluationCacheEntry.input_tokens + models.EvaluationCacheEntry.output_tokens)
+    ), 0)).scalar()
+
+    total_size_mb = usage["storage_bytes"] / (1024 * 1024)
+    total_cost = rollups.estimate_cost(usage["input_tokens"], usage["output_tokens"], usage["storage_bytes"])
+
+    stats = {
         "total_packages": total_packages,
         "total_contractors": total_contractors,
-        "total_evaluations": total_evaluations,
-        "total_files": total_files,
+        "total_evaluations": usage["evaluations"],
+        "total_files": usage["files"],
         "total_storage_mb": round(total_size_mb, 2),
-        "total_input_tokens": total_input_tokens,
-        "total_output_tokens": total_output_tokens,
+        "total_input_tokens": usage["input_tokens"],
+        "total_output_tokens": usage["output_tokens"],
+        "cache_hits": usage["cached_evaluations"],
+        "cache_misses": usage["evaluations"] - usage["cached_evaluations"],
+        "cache_tokens_saved": int(tokens_saved),
+        "cache_runtime": cache.stats(),
         "estimated_cost_usd": round(total_cost, 4)
     }
 
+    if breakdown:
+        per_package = rollups.totals(db, date_from, date_to, bid_package_id, group_by_package=True)
+        names = dict(db.query(models.BidPackage.id, models.BidPackage.name).filter(
+            models.BidPackage.id.in_(list(per_package))
+        ))
+        stats["packages"] = [
+            {
+                "bid_package_id": package_id,
+                # Usage of deleted packages is kept under bid_package_id None
+                "name": names.get(package_id) if package_id is not None else "Gói thầu đã xóa",
+                "total_evaluations": usage_row["evaluations"],
+                "total_files": usage_row["files"],
+                "total_storage_mb": round(usage_row["storage_bytes"] / (1024 * 1024), 2),
+                "total_input_tokens": usage_row["input_tokens"],
+                "total_output_tokens": usage_row["output_tokens"],
+                "estimated_cost_usd": round(rollups.estimate_cost(
+                    usage_row["input_tokens"], usage_row["output_tokens"], usage_row["storage_bytes"]
+                ), 4),
+            }
+            for package_id, usage_row in per_package.items()
+        ]
+    return stats
+
+@app.post("/reports/rollups/rebuild")
+def rebuild_rollups(db: Session = Depends(get_db), current_user: auth.Principal = Depends(auth.get_current_admin_user)):
+    rows = rollups.rebuild(db)
+    db.commit()
+    return {"status": "success", "rows": rows}
+
+@app.post("/admin/reconcile")
+async def run_reconciliation(dry_run: bool = True, current_user: auth.Principal = Depends(auth.get_current_admin_user)):
+    return await reconcile.run_once(dry_run=dry_run)
+
+@app.get("/admin/reconcile")
+def get_reconciliation_status(current_user: auth.Principal = Depends(auth.get_current_admin_user)):
+    return {
+        "checkpoints": reconcile.checkpoints(),
+        "cleanup_pending": cleanup.cleanup_queue.pending(),
+        "cleanup_failed": cleanup.cleanup_queue.failed,
+    }
+
 @app.get("/contractors/{contractor_id}/files")
-def list_contractor_files(contractor_id: int, db: Session = Depends(get_db)):
-    return db.query(models.ContractorFile).filter(models.ContractorFile.contractor_id == contractor_id).all()
+def list_contractor_files(
+    contractor_id: int,
+    response: Response,
+    q: Optional[str] = None,
+    is_stored_in_gemini: Optional[bool] = None,
+    page: pagination.PageParams = Depends(),
+    db: Session = Depends(get_db)
+):
+    query = db.query(models.ContractorFile).filter(models.ContractorFile.contractor_id == contractor_id)
+    if q:
+        query = query.filter(models.ContractorFile.filename.ilike(f"%{q}%"))
+    if is_stored_in_gemini is not None:
+        query = query.filter(models.ContractorFile.is_stored_in_gemini == is_stored_in_gemini)
+    return pagination.paginate(query, models.ContractorFile, page, response)
+
+@app.get("/contractors/{contractor_id}/search")
+def search_contractor_documents(contractor_id: int, q: str, k: int = retrieval.RETRIEVAL_TOP_K):
+    """Passages local retrieval would send to the model for `q`, with their BM25 scores."""
+    if not 1 <= k <= 50:
+        raise HTTPException(status_code=400, detail="k must be between 1 and 50")
+    return {
+        "enabled": retrieval.LOCAL_RETRIEVAL,
+        "complete": retrieval.covers_contractor(contractor_id),
+        "passages": retrieval.search(contractor_id, q, k),
+    }
 
 @app.get("/evaluations/{contractor_id}")
-def get_evaluations(contractor_id: int, db: Session = Depends(get_db)):
-    return db.query(models.EvaluationResult).filter(models.EvaluationResult.contractor_id == contractor_id).all()
+def get_evaluations(
+    contractor_id: int,
+    response: Response,
+    q: Optional[str] = None,
+    score_min: Optional[int] = None,
+    score_max: Optional[int] = None,
+    criteria_set_id: Optional[int] = None,
+    page: pagination.PageParams = Depends(),
+    db: Session = Depends(get_db)
+):
+    query = db.query(models.EvaluationResult).filter(models.EvaluationResult.contractor_id == contractor_id)
+    if q:
+        query = query.filter(models.EvaluationResult.criteria_prompt.ilike(f"%{q}%"))
+    if score_min is not None:
+        query = query.filter(models.EvaluationResult.score >= score_min)
+    if score_max is not None:
+        query = query.filter(models.EvaluationResult.score <= score_max)
+    if criteria_set_id is not None:
+        query = query.filter(models.EvaluationResult.criteria_set_id == criteria_set_id)
+    return pagination.paginate(query, models.EvaluationResult, page, response)
 
 @app.delete("/evaluations/{evaluation_id}")
 def delete_evaluation(evaluation_id: int, db: Session = Depends(get_db)):
     db_eval = db.query(models.EvaluationResult).filter(models.EvaluationResult.id == evaluation_id).first()
     if not db_eval:
         raise HTTPException(status_code=404, detail="Không tìm thấy kết quả đánh giá")
+    # The tokens were spent all the same, the usage rollups keep counting them
     db.delete(db_eval)
     db.commit()
     return {"status": "success", "message": "Đã xóa kết quả đánh giá"}
 
+@app.get("/metrics", response_class=PlainTextResponse)
+async def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/metrics/profiles")
+def get_slow_request_profiles(current_user: auth.Principal = Depends(auth.get_current_admin_user)):
+    """Stack samples of recent slow requests (enable with PROFILE_SLOW_REQUEST_MS)."""
+    return {
+        "enabled": profiling.profiler.enabled,
+        "threshold_ms": profiling.profiler.threshold_ms,
+        "profiles": list(profiling.profiler.recent),
+    }
+
 @app.get("/")
 def read_root():
+    # Liveness: answers without touching the database or the model provider
     return {"message": "API Backend Hệ thống Đấu thầu AI"}
+
+@app.get("/ready")
+def readiness(response: Response):
+    """Readiness: 503 until the startup bootstrap has finished."""
+    ready = getattr(app.state, "ready", False)
+    if not ready:
+        response.status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    return {"ready": ready, "error": getattr(app.state, "bootstrap_error", None)}
@@ -0,0 +1,287 @@
+import threading
+import time
+from contextvars import ContextVar
+from functools import wraps
+from sqlalchemy import event
+
+# In-process metrics rendered in the Prometheus text format by GET /metrics.
+# Each worker process exposes its own numbers; scrape every worker (or run one).
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+QUERY_COUNT_BUCKETS = (0, 1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+def _format_labels(names: tuple, values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+class Metric:
+    kind = ""
+
+    def __init__(self, name: str, documentation: str, labels: tuple = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labels = tuple(labels)
+        self._values: dict[tuple, object] = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(name, "") for name in self.labels)
+
+    def samples(self) -> list[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        return "\n".join(lines + self.samples())
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def samples(self) -> list[str]:
+        with self._lock:
+            items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}" for key, value in items]
+
+class Gauge(Metric):
+    """A gauge set directly, or read from `collect()` at scrape time.
+
+    `collect` returns (labels dict, value) pairs, which suits values another
+    object already tracks, like a connection pool.
+    """
+    kind = "gauge"
+
+    def __init__(self, name: str, documentation: str, labels: tuple = (), collect=None):
+        super().__init__(name, documentation, labels)
+        self.collect = collect
+
+    def set(self, value: float, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels):
+        self.inc(-amount, **labels)
+
+    def samples(self) -> list[str]:
+        if self.collect:
+            try:
+                items = [(self._key(labels), value) for labels, value in self.collect()]
+            except Exception:
+                # A collector must never break the scrape
+                items = []
+        else:
+            with self._lock:
+                items = list(self._values.items())
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}" for key, value in items]
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, documentation: str, labels: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labels)
+        self.buckets = tuple(buckets) + (float("inf"),)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = {"counts": [0] * len(self.buckets), "sum": 0.0, "count": 0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state["counts"][i] += 1
+                    break
+            state["sum"] += value
+            state["count"] += 1
+
+    def time(self, **labels):
+        return _Timer(self, labels)
+
+    def samples(self) -> list[str]:
+        with self._lock:
+            items = [(key, list(state["counts"]), state["sum"], state["count"]) for key, state in self._values.items()]
+        lines = []
+        for key, counts, total, count in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                le = f'le="{_format_value(bound)}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(total)}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {count}")
+        return lines
+
+class _Timer:
+    def __init__(self, histogram: Histogram, labels: dict):
+        self.histogram = histogram
+        self.labels = labels
+
+    def __enter__(self):
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.started, **self.labels)
+
+REGISTRY: list[Metric] = []
+
+def render() -> str:
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
+
+# HTTP
+
+http_requests = Counter("http_requests_total", "HTTP requests by route and status.", ("method", "route", "status"))
+http_request_duration = Histogram(
+    "http_request_duration_seconds", "Time to produce the response headers, by route.", ("method", "route")
+)
+http_in_flight = Gauge("http_requests_in_flight", "Requests currently being handled.")
+
+# Database
+
+db_query_duration = Histogram(
+    "db_query_duration_seconds", "Duration of individual SQL statements.", ("engine", "statement")
+)
+db_query_errors = Counter("db_query_errors_total", "SQL statements that raised.", ("engine", "statement"))
+db_queries_per_request = Histogram(
+    "db_queries_per_request", "SQL statements executed while handling a request.", ("route",), QUERY_COUNT_BUCKETS
+)
+db_time_per_request = Histogram(
+    "db_time_per_request_seconds", "Time spent in SQL statements while handling a request.", ("route",)
+)
+
+# Model provider
+
+model_call_duration = Histogram(
+    "model_call_duration_seconds", "Provider call latency by operation.", ("operation",)
+)
+model_calls = Counter("model_calls_total", "Provider calls by operation and outcome.", ("operation", "outcome"))
+model_errors = Counter("model_errors_total", "Failed provider calls by operation and error code.", ("operation", "code"))
+model_tokens = Counter("model_tokens_total", "Tokens reported by the provider.", ("operation", "kind"))
+model_retries = Counter("model_retries_total", "Provider call retries by operation and reason.", ("operation", "reason"))
+model_hedges = Counter(
+    "model_hedges_total", "Hedged provider requests: sent, and whether the duplicate won or lost.", ("operation", "outcome")
+)
+model_circuit_rejections = Counter(
+    "model_circuit_rejections_total", "Provider calls refused while the circuit was open.", ("family",)
+)
+model_queue_wait = Histogram(
+    "model_queue_wait_seconds", "Time evaluation calls waited for a model slot."
+)
+model_quota_wait = Histogram(
+    "model_quota_wait_seconds", "Time each provider request of an evaluation (retries included) waited for quota."
+)
+
+# Ingestion
+
+ingestion_wait = Histogram(
+    "ingestion_wait_seconds",
+    "Time uploaded files spend PROCESSING (stage=processing), imports take to index (stage=indexing) "
+    "and ingestions wait for the contractor's lock (stage=lock).",
+    ("stage",), DEFAULT_BUCKETS + (300, 900),
+)
+
+class RequestStats:
+    __slots__ = ("queries", "query_seconds")
+
+    def __init__(self):
+        self.queries = 0
+        self.query_seconds = 0.0
+
+current_request: ContextVar[RequestStats | None] = ContextVar("current_request", default=None)
+
+def record_request(method: str, route: str, status: int, seconds: float, stats: RequestStats):
+    http_requests.inc(method=method, route=route, status=status)
+    http_request_duration.observe(seconds, method=method, route=route)
+    db_queries_per_request.observe(stats.queries, route=route)
+    db_time_per_request.observe(stats.query_seconds, route=route)
+
+def _statement_kind(statement: str) -> str:
+    words = statement.lstrip().split(None, 1)
+    return words[0].upper() if words else ""
+
+def instrument_engine(engine, name: str):
+    """Times every statement of a sync Engine (for async engines pass `.sync_engine`)."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_started"].pop()
+        db_query_duration.observe(elapsed, engine=name, statement=_statement_kind(statement))
+        stats = current_request.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.query_seconds += elapsed
+
+    @event.listens_for(engine, "handle_error")
+    def _error(context):
+        started = context.connection.info.get("query_started") if context.connection is not None else None
+        if started:
+            started.pop()
+        db_query_errors.inc(engine=name, statement=_statement_kind(context.statement or ""))
+
+def pool_gauges(engines, max_overflow: int):
+    """Registers checked-out / size / overflow gauges for the pools of the engines `engines()` returns."""
+
+    def _collect(attribute):
+        def collect():
+            return [({"engine": name}, getattr(engine.pool, attribute)()) for name, engine in engines().items()]
+        return collect
+
+    Gauge("db_pool_checked_out", "Connections currently checked out.", ("engine",), _collect("checkedout"))
+    Gauge("db_pool_size", "Configured pool size.", ("engine",), _collect("size"))
+    Gauge("db_pool_overflow", "Connections open beyond the pool size (negative: unused capacity).",
+          ("engine",), _collect("overflow"))
+    Gauge(
+        "db_pool_capacity", "Most connections the pool will open (size + max_overflow).", ("engine",),
+        lambda: [({"engine": name}, engine.pool.size() + max_overflow) for name, engine in engines().items()],
+    )
+
+def _error_code(e: Exception) -> str:
+    code = getattr(e, "code", None)
+    return str(code) if code is not None else type(e).__name__
+
+def observe_model_call(operation: str):
+    """Decorates a blocking provider call with latency, outcome, error and token metrics."""
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                result = func(*args, **kwargs)
+            except Exception as e:
+                model_calls.inc(operation=operation, outcome="error")
+                model_errors.inc(operation=operation, code=_error_code(e))
+                raise
+            finally:
+                model_call_duration.observe(time.perf_counter() - started, operation=operation)
+            model_calls.inc(operation=operation, outcome="ok")
+            if isinstance(result, dict):
+                model_tokens.inc(result.get("input_tokens") or 0, operation=operation, kind="input")
+                model_tokens.inc(result.get("output_tokens") or 0, operation=operation, kind="output")
+            return result
+        return wrapper
+    return decorator
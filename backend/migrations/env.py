@@ -0,0 +1,43 @@
+import os
+import sys
+from logging.config import fileConfig
+from alembic import context
+from sqlalchemy import create_engine
+
+# Make `backend` importable when alembic is run from the repository root
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+
+from backend import database, models # noqa: E402
+
+config = context.config
+if config.config_file_name is not None:
+    fileConfig(config.config_file_name)
+
+target_metadata = models.Base.metadata
+
+def run_migrations_offline():
+    """Emits the SQL instead of running it (alembic upgrade head --sql)."""
+    context.configure(
+        url=database.SQLALCHEMY_DATABASE_URL,
+        target_metadata=target_metadata,
+        literal_binds=True,
+        dialect_opts={"paramstyle": "named"},
+    )
+    with context.begin_transaction():
+        context.run_migrations()
+
+def run_migrations_online():
+    # No statement timeout here: index builds and backfills legitimately run long
+    engine = create_engine(database.SQLALCHEMY_DATABASE_URL)
+    try:
+        with engine.connect() as connection:
+            context.configure(connection=connection, target_metadata=target_metadata, compare_type=True)
+            with context.begin_transaction():
+                context.run_migrations()
+    finally:
+        engine.dispose()
+
+if context.is_offline_mode():
+    run_migrations_offline()
+else:
+    run_migrations_online()
@@ -0,0 +1,100 @@
+"""Baseline: the schema create_all built before migrations existed
+
+Databases created by create_all already have these tables, so each one is
+only created when missing; on such a database this revision just records
+the starting point.
+
+Revision ID: 0001
+Revises:
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0001"
+down_revision = None
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    existing = set(sa.inspect(op.get_bind()).get_table_names())
+
+    if "bid_packages" not in existing:
+        op.create_table(
+            "bid_packages",
+            sa.Column("id", sa.Integer, primary_key=True),
+            sa.Column("name", sa.String),
+            sa.Column("description", sa.Text, nullable=True),
+            sa.Column("created_at", sa.DateTime),
+        )
+        op.create_index("ix_bid_packages_id", "bid_packages", ["id"])
+        op.create_index("ix_bid_packages_name", "bid_packages", ["name"])
+
+    if "contractors" not in existing:
+        op.create_table(
+            "contractors",
+            sa.Column("id", sa.Integer, primary_key=True),
+            sa.Column("name", sa.String),
+            sa.Column("gemini_store_name", sa.String, nullable=True),
+            sa.Column("bid_package_id", sa.Integer, sa.ForeignKey("bid_packages.id")),
+        )
+        op.create_index("ix_contractors_id", "contractors", ["id"])
+        op.create_index("ix_contractors_name", "contractors", ["name"])
+
+    if "contractor_files" not in existing:
+        op.create_table(
+            "contractor_files",
+            sa.Column("id", sa.Integer, primary_key=True),
+            sa.Column("contractor_id", sa.Integer, sa.ForeignKey("contractors.id")),
+            sa.Column("filename", sa.String),
+            sa.Column("file_path", sa.String),
+            sa.Column("file_size", sa.Integer),
+            sa.Column("gemini_file_name", sa.String, nullable=True),
+            sa.Column("gemini_file_uri", sa.String, nullable=True),
+            sa.Column("is_stored_in_gemini", sa.Boolean),
+            sa.Column("created_at", sa.DateTime),
+        )
+        op.create_index("ix_contractor_files_id", "contractor_files", ["id"])
+
+    if "criteria_sets" not in existing:
+        op.create_table(
+            "criteria_sets",
+            sa.Column("id", sa.Integer, primary_key=True),
+            sa.Column("name", sa.String),
+            sa.Column("prompts", sa.JSON),
+        )
+        op.create_index("ix_criteria_sets_id", "criteria_sets", ["id"])
+        op.create_index("ix_criteria_sets_name", "criteria_sets", ["name"])
+
+    if "evaluation_results" not in existing:
+        op.create_table(
+            "evaluation_results",
+            sa.Column("id", sa.Integer, primary_key=True),
+            sa.Column("contractor_id", sa.Integer, sa.ForeignKey("contractors.id")),
+            sa.Column("criteria_id", sa.Integer, nullable=True),
+            sa.Column("criteria_prompt", sa.Text),
+            sa.Column("score", sa.Integer),
+            sa.Column("comment", sa.Text),
+            sa.Column("evidence", sa.Text),
+            sa.Column("input_tokens", sa.Integer),
+            sa.Column("output_tokens", sa.Integer),
+            sa.Column("created_at", sa.DateTime),
+        )
+        op.create_index("ix_evaluation_results_id", "evaluation_results", ["id"])
+
+    if "users" not in existing:
+        op.create_table(
+            "users",
+            sa.Column("id", sa.Integer, primary_key=True),
+            sa.Column("username", sa.String),
+            sa.Column("full_name", sa.String, nullable=True),
+            sa.Column("hashed_password", sa.String),
+            sa.Column("is_active", sa.Boolean),
+            sa.Column("role", sa.String),
+        )
+        op.create_index("ix_users_id", "users", ["id"])
+        op.create_index("ix_users_username", "users", ["username"], unique=True)
+
+def downgrade():
+    for table in ("users", "evaluation_results", "criteria_sets", "contractor_files", "contractors", "bid_packages"):
+        op.drop_table(table)
@@ -0,0 +1,138 @@
+"""Tables and columns added to the models since the baseline
+
+create_all only ever created missing tables, so databases that predate a
+column never got it. Everything here is added only when missing, then the
+columns that existing rows left NULL are backfilled.
+
+Revision ID: 0002
+Revises: 0001
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0002"
+down_revision = "0001"
+branch_labels = None
+depends_on = None
+
+NEW_COLUMNS = {
+    "contractors": [
+        sa.Column("created_at", sa.DateTime),
+    ],
+    "contractor_files": [
+        sa.Column("content_hash", sa.String(64), nullable=True),
+    ],
+    "evaluation_results": [
+        sa.Column("criteria_set_id", sa.Integer, sa.ForeignKey("criteria_sets.id"), nullable=True),
+        sa.Column("job_id", sa.String(32), nullable=True),
+        sa.Column("cached", sa.Boolean),
+    ],
+    "users": [
+        sa.Column("token_version", sa.Integer),
+        sa.Column("created_at", sa.DateTime),
+    ],
+}
+
+def upgrade():
+    inspector = sa.inspect(op.get_bind())
+    existing = set(inspector.get_table_names())
+
+    for table, columns in NEW_COLUMNS.items():
+        present = {column["name"] for column in inspector.get_columns(table)}
+        for column in columns:
+            if column.name not in present:
+                op.add_column(table, column)
+    op.create_index("ix_contractor_files_content_hash", "contractor_files", ["content_hash"], if_not_exists=True)
+    op.create_index("ix_evaluation_results_job_id", "evaluation_results", ["job_id"], if_not_exists=True)
+
+    if "document_chunks" not in existing:
+        op.create_table(
+            "document_chunks",
+            sa.Column("id", sa.Integer, primary_key=True),
+            sa.Column("contractor_id", sa.Integer, sa.ForeignKey("contractors.id")),
+            sa.Column("file_id", sa.Integer, sa.ForeignKey("contractor_files.id")),
+            sa.Column("position", sa.Integer),
+            sa.Column("page", sa.Integer, nullable=True),
+            sa.Column("text", sa.Text),
+            sa.Column("created_at", sa.DateTime),
+        )
+        op.create_index("ix_document_chunks_id", "document_chunks", ["id"])
+        op.create_index("ix_document_chunks_contractor_id", "document_chunks", ["contractor_id"])
+        op.create_index("ix_document_chunks_file_id", "document_chunks", ["file_id"])
+
+    if "evaluation_cache" not in existing:
+        op.create_table(
+            "evaluation_cache",
+            sa.Column("id", sa.Integer, primary_key=True),
+            sa.Column("cache_key", sa.String(64)),
+            sa.Column("contractor_id", sa.Integer, sa.ForeignKey("contractors.id")),
+            sa.Column("response_text", sa.Text),
+            sa.Column("input_tokens", sa.Integer),
+            sa.Column("output_tokens", sa.Integer),
+            sa.Column("hit_count", sa.Integer),
+            sa.Column("created_at", sa.DateTime),
+        )
+        op.create_index("ix_evaluation_cache_id", "evaluation_cache", ["id"])
+        op.create_index("ix_evaluation_cache_cache_key", "evaluation_cache", ["cache_key"], unique=True)
+        op.create_index("ix_evaluation_cache_contractor_id", "evaluation_cache", ["contractor_id"])
+
+    if "usage_rollups" not in existing:
+        op.create_table(
+            "usage_rollups",
+            sa.Column("id", sa.Integer, primary_key=True),
+            sa.Column("day", sa.Date),
+            sa.Column("bid_package_id", sa.Integer, sa.ForeignKey("bid_packages.id")),
+            sa.Column("contractor_id", sa.Integer, sa.ForeignKey("contractors.id")),
+            sa.Column("files", sa.Integer),
+            sa.Column("file_bytes", sa.BigInteger),
+            sa.Column("storage_bytes", sa.BigInteger),
+            sa.Column("evaluations", sa.Integer),
+            sa.Column("cached_evaluations", sa.Integer),
+            sa.Column("input_tokens", sa.BigInteger),
+            sa.Column("output_tokens", sa.BigInteger),
+            sa.UniqueConstraint("day", "contractor_id", name="uq_usage_rollups_day_contractor"),
+        )
+        op.create_index("ix_usage_rollups_id", "usage_rollups", ["id"])
+        op.create_index("ix_usage_rollups_day", "usage_rollups", ["day"])
+        op.create_index("ix_usage_rollups_bid_package_id", "usage_rollups", ["bid_package_id"])
+        op.create_index("ix_usage_rollups_contractor_id", "usage_rollups", ["contractor_id"])
+
+    if "reconcile_checkpoints" not in existing:
+        op.create_table(
+            "reconcile_checkpoints",
+            sa.Column("id", sa.Integer, primary_key=True),
+            sa.Column("scope", sa.String),
+            sa.Column("cursor", sa.String, nullable=True),
+            sa.Column("last_report", sa.JSON, nullable=True),
+            sa.Column("updated_at", sa.DateTime),
+        )
+        op.create_index("ix_reconcile_checkpoints_id", "reconcile_checkpoints", ["id"])
+        op.create_index("ix_reconcile_checkpoints_scope", "reconcile_checkpoints", ["scope"], unique=True)
+
+    # Keyset pages encode created_at in their cursor, rows without one would break them.
+    # Old contractors get the time of their earliest file or result, else their package's.
+    op.execute("""
+        UPDATE contractors c SET created_at = COALESCE(
+            LEAST(
+                (SELECT MIN(f.created_at) FROM contractor_files f WHERE f.contractor_id = c.id),
+                (SELECT MIN(r.created_at) FROM evaluation_results r WHERE r.contractor_id = c.id)
+            ),
+            (SELECT p.created_at FROM bid_packages p WHERE p.id = c.bid_package_id),
+            now() AT TIME ZONE 'utc'
+        )
+        WHERE c.created_at IS NULL
+    """)
+    for table in ("bid_packages", "contractor_files", "evaluation_results", "users"):
+        op.execute(f"UPDATE {table} SET created_at = now() AT TIME ZONE 'utc' WHERE created_at IS NULL")
+    op.execute("UPDATE users SET token_version = 0 WHERE token_version IS NULL")
+    op.execute("UPDATE evaluation_results SET cached = false WHERE cached IS NULL")
+
+def downgrade():
+    for table in ("reconcile_checkpoints", "usage_rollups", "evaluation_cache", "document_chunks"):
+        op.drop_table(table)
+    op.drop_index("ix_evaluation_results_job_id", "evaluation_results")
+    op.drop_index("ix_contractor_files_content_hash", "contractor_files")
+    for table, columns in NEW_COLUMNS.items():
+        for column in columns:
+            op.drop_column(table, column.name)
@@ -0,0 +1,41 @@
+"""Indexes for the foreign keys behind per-contractor and per-package queries
+
+contractor_files.contractor_id, evaluation_results.contractor_id and
+contractors.bid_package_id had no index, so listings, cascade deletes and
+reports scanned the whole table. Each index leads with the foreign key and
+continues with (created_at, id), the keyset order of pagination.py, so one
+index serves both the lookups and the pages.
+
+They are built CONCURRENTLY to keep the tables writable on a live database.
+That can't run in a transaction, and a build that fails halfway leaves an
+INVALID index behind: drop it and run the upgrade again.
+
+Revision ID: 0003
+Revises: 0002
+Create Date: 2026-10-17
+"""
+from alembic import op
+
+revision = "0003"
+down_revision = "0002"
+branch_labels = None
+depends_on = None
+
+INDEXES = [
+    ("ix_contractors_bid_package_id_created_at", "contractors", ["bid_package_id", "created_at", "id"]),
+    ("ix_contractor_files_contractor_id_created_at", "contractor_files", ["contractor_id", "created_at", "id"]),
+    ("ix_evaluation_results_contractor_id_created_at", "evaluation_results", ["contractor_id", "created_at", "id"]),
+    ("ix_evaluation_results_criteria_set_id", "evaluation_results", ["criteria_set_id"]),
+]
+
+def upgrade():
+    with op.get_context().autocommit_block():
+        for name, table, columns in INDEXES:
+            op.create_index(name, table, columns, postgresql_concurrently=True, if_not_exists=True)
+        for table in sorted({table for _, table, _ in INDEXES}):
+            op.execute(f"ANALYZE {table}")
+
+def downgrade():
+    with op.get_context().autocommit_block():
+        for name, table, _ in INDEXES:
+            op.drop_index(name, table, postgresql_concurrently=True, if_exists=True)
@@ -0,0 +1,24 @@
+"""Per-criterion weights on criteria sets, for the package comparison
+
+Added only when missing: a database built from the models (DB_CREATE_SCHEMA=1)
+already has the column.
+
+Revision ID: 0004
+Revises: 0003
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0004"
+down_revision = "0003"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    present = {column["name"] for column in sa.inspect(op.get_bind()).get_columns("criteria_sets")}
+    if "weights" not in present:
+        op.add_column("criteria_sets", sa.Column("weights", sa.JSON, nullable=True))
+
+def downgrade():
+    op.drop_column("criteria_sets", "weights")
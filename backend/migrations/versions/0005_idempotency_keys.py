@@ -0,0 +1,39 @@
+"""Stored responses for requests made with an Idempotency-Key
+
+Created only when missing: a database built from the models (DB_CREATE_SCHEMA=1)
+already has the table.
+
+Revision ID: 0005
+Revises: 0004
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0005"
+down_revision = "0004"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    if "idempotency_keys" in sa.inspect(op.get_bind()).get_table_names():
+        return
+    op.create_table(
+        "idempotency_keys",
+        sa.Column("id", sa.Integer, primary_key=True),
+        sa.Column("scope", sa.String(64)),
+        sa.Column("key", sa.String(255)),
+        sa.Column("fingerprint", sa.String(64)),
+        sa.Column("status", sa.String(16)),
+        sa.Column("response_status", sa.Integer, nullable=True),
+        sa.Column("response_headers", sa.JSON, nullable=True),
+        sa.Column("response_body", sa.LargeBinary, nullable=True),
+        sa.Column("created_at", sa.DateTime),
+        sa.Column("completed_at", sa.DateTime, nullable=True),
+        sa.UniqueConstraint("scope", "key", name="uq_idempotency_keys_scope_key"),
+    )
+    op.create_index("ix_idempotency_keys_id", "idempotency_keys", ["id"])
+    op.create_index("ix_idempotency_keys_created_at", "idempotency_keys", ["created_at"])
+
+def downgrade():
+    op.drop_table("idempotency_keys")
@@ -0,0 +1,29 @@
+"""Import state on contractor files, so evaluations only wait for imports in flight
+
+import_started_at is set while a store import is being followed and cleared
+when it ends; import_error keeps the reason of the last failed import.
+Added only when missing: a database built from the models (DB_CREATE_SCHEMA=1)
+already has the columns.
+
+Revision ID: 0006
+Revises: 0005
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0006"
+down_revision = "0005"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    present = {column["name"] for column in sa.inspect(op.get_bind()).get_columns("contractor_files")}
+    if "import_started_at" not in present:
+        op.add_column("contractor_files", sa.Column("import_started_at", sa.DateTime, nullable=True))
+    if "import_error" not in present:
+        op.add_column("contractor_files", sa.Column("import_error", sa.String, nullable=True))
+
+def downgrade():
+    op.drop_column("contractor_files", "import_error")
+    op.drop_column("contractor_files", "import_started_at")
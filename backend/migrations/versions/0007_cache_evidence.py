@@ -0,0 +1,27 @@
+"""Comment and evidence on evaluation cache entries, so grouped answers keep them on a hit
+
+Added only when missing: a database built from the models (DB_CREATE_SCHEMA=1)
+already has the columns.
+
+Revision ID: 0007
+Revises: 0006
+Create Date: 2026-10-17
+"""
+from alembic import op
+import sqlalchemy as sa
+
+revision = "0007"
+down_revision = "0006"
+branch_labels = None
+depends_on = None
+
+def upgrade():
+    present = {column["name"] for column in sa.inspect(op.get_bind()).get_columns("evaluation_cache")}
+    if "comment" not in present:
+        op.add_column("evaluation_cache", sa.Column("comment", sa.Text, nullable=True))
+    if "evidence" not in present:
+        op.add_column("evaluation_cache", sa.Column("evidence", sa.Text, nullable=True))
+
+def downgrade():
+    op.drop_column("evaluation_cache", "evidence")
+    op.drop_column("evaluation_cache", "comment")
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, Text, JSON, DateTime, Boolean
+from sqlalchemy import Column, Integer, BigInteger, String, ForeignKey, Text, JSON, DateTime, Date, Boolean, Index, LargeBinary, UniqueConstraint
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from .database import Base
@@ -13,13 +13,18 @@ class BidPackage(Base):
 
     contractors = relationship("Contractor", back_populates="bid_package")
 
+# Schema changes go through migrations (backend/migrations), keep them in step with these models.
+# The (parent_id, created_at, id) indexes serve both the FK lookups and the keyset pages, see pagination.py.
+
 class Contractor(Base):
     __tablename__ = "contractors"
+    __table_args__ = (Index("ix_contractors_bid_package_id_created_at", "bid_package_id", "created_at", "id"),)
 
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, index=True)
     gemini_store_name = Column(String, nullable=True)
     bid_package_id = Column(Integer, ForeignKey("bid_packages.id"))
+    created_at = Column(DateTime, default=datetime.utcnow)
 
     bid_package = relationship("BidPackage", back_populates="contractors")
     evaluation_results = relationship("EvaluationResult", back_populates="contractor")
@@ -27,6 +32,7 @@ class Contractor(Base):
 
 class ContractorFile(Base):
     __tablename__ = "contractor_files"
+    __table_args__ = (Index("ix_contractor_files_contractor_id_created_at", "contractor_id", "created_at", "id"),)
 
     id = Column(Integer, primary_key=True, index=True)
     contractor_id = Column(Integer, ForeignKey("contractors.id"))
@@ -36,33 +42,116 @@ class ContractorFile(Base):
     gemini_file_name = Column(String, nullable=True)
     gemini_file_uri = Column(String, nullable=True)
     is_stored_in_gemini = Column(Boolean, default=False)
+    import_started_at = Column(DateTime, nullable=True) # Set while a store import is in flight
+    import_error = Column(String, nullable=True) # Why the last store import failed
+    content_hash = Column(String(64), nullable=True, index=True) # SHA-256 of the file content
     created_at = Column(DateTime, default=datetime.utcnow)
 
     contractor = relationship("Contractor", back_populates="files")
 
+class DocumentChunk(Base):
+    """A passage of a contractor file's extracted text, indexed by retrieval.py."""
+    __tablename__ = "document_chunks"
+
+    id = Column(Integer, primary_key=True, index=True)
+    contractor_id = Column(Integer, ForeignKey("contractors.id"), index=True)
+    file_id = Column(Integer, ForeignKey("contractor_files.id"), index=True)
+    position = Column(Integer) # Order within the file
+    page = Column(Integer, nullable=True) # 1-based, for formats that have pages
+    text = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
 class CriteriaSet(Base):
     __tablename__ = "criteria_sets"
 
     id = Column(Integer, primary_key=True, index=True)
     name = Column(String, index=True)
     prompts = Column(JSON)  # List of criteria prompts
+    weights = Column(JSON, nullable=True) # One weight per prompt for comparisons, None = equal weights
 
 class EvaluationResult(Base):
     __tablename__ = "evaluation_results"
+    __table_args__ = (Index("ix_evaluation_results_contractor_id_created_at", "contractor_id", "created_at", "id"),)
 
     id = Column(Integer, primary_key=True, index=True)
     contractor_id = Column(Integer, ForeignKey("contractors.id"))
-    criteria_id = Column(Integer, nullable=True) # Optional link if we want to track specific criteria ID from the JSON
+    criteria_id = Column(Integer, nullable=True) # Position of the prompt in its set when evaluated; comparisons match by criteria_prompt
+    criteria_set_id = Column(Integer, ForeignKey("criteria_sets.id"), nullable=True, index=True) # Set the prompt came from, if any
+    job_id = Column(String(32), nullable=True, index=True) # Evaluation job (run) that produced the result
     criteria_prompt = Column(Text) # Store the prompt text used
     score = Column(Integer)
     comment = Column(Text)
     evidence = Column(Text)
     input_tokens = Column(Integer, default=0)
     output_tokens = Column(Integer, default=0)
+    cached = Column(Boolean, default=False) # Served from the evaluation cache, no tokens spent
     created_at = Column(DateTime, default=datetime.utcnow)
 
     contractor = relationship("Contractor", back_populates="evaluation_results")
 
+class EvaluationCacheEntry(Base):
+    __tablename__ = "evaluation_cache"
+
+    id = Column(Integer, primary_key=True, index=True)
+    cache_key = Column(String(64), unique=True, index=True)
+    contractor_id = Column(Integer, ForeignKey("contractors.id"), index=True)
+    response_text = Column(Text)
+    # Set for grouped answers, which return them separately; otherwise parsed from response_text
+    comment = Column(Text, nullable=True)
+    evidence = Column(Text, nullable=True)
+    input_tokens = Column(Integer, default=0)
+    output_tokens = Column(Integer, default=0)
+    hit_count = Column(Integer, default=0)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class UsageRollup(Base):
+    """Per contractor, per day usage totals, kept up to date as files and results are written.
+
+    Rollups track spend: they only ever grow. Deleting a result, a contractor
+    or a package leaves the usage it recorded in place.
+    """
+    __tablename__ = "usage_rollups"
+    __table_args__ = (UniqueConstraint("day", "contractor_id", name="uq_usage_rollups_day_contractor"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    day = Column(Date, index=True)
+    # Both ids are set to NULL when the package or contractor is deleted, the usage stays in the reports
+    bid_package_id = Column(Integer, ForeignKey("bid_packages.id"), index=True)
+    contractor_id = Column(Integer, ForeignKey("contractors.id"), index=True)
+    files = Column(Integer, default=0)
+    file_bytes = Column(BigInteger, default=0)
+    storage_bytes = Column(BigInteger, default=0) # Only bytes actually uploaded, deduplicated copies excluded
+    evaluations = Column(Integer, default=0)
+    cached_evaluations = Column(Integer, default=0)
+    input_tokens = Column(BigInteger, default=0)
+    output_tokens = Column(BigInteger, default=0)
+
+class ReconcileCheckpoint(Base):
+    """Where the reconciliation sweeper stopped in each of its passes."""
+    __tablename__ = "reconcile_checkpoints"
+
+    id = Column(Integer, primary_key=True, index=True)
+    scope = Column(String, unique=True, index=True) # stores, files, contractors
+    cursor = Column(String, nullable=True) # Remote page token or last contractor id, None = start over
+    last_report = Column(JSON, nullable=True)
+    updated_at = Column(DateTime, default=datetime.utcnow)
+
+class IdempotencyKey(Base):
+    """A mutating request made with an Idempotency-Key header, and its response once it finished."""
+    __tablename__ = "idempotency_keys"
+    __table_args__ = (UniqueConstraint("scope", "key", name="uq_idempotency_keys_scope_key"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    scope = Column(String(64)) # Hash of the caller's credentials, keys are per caller
+    key = Column(String(255))
+    fingerprint = Column(String(64)) # Hash of method, path, query, content type and length, plus the body unless multipart or large; a reused key must match it
+    status = Column(String(16)) # in_progress, completed
+    response_status = Column(Integer, nullable=True)
+    response_headers = Column(JSON, nullable=True)
+    response_body = Column(LargeBinary, nullable=True) # None when the response was too large to keep
+    created_at = Column(DateTime, default=datetime.utcnow, index=True)
+    completed_at = Column(DateTime, nullable=True)
+
 class User(Base):
     __tablename__ = "users"
 
@@ -72,3 +161,5 @@ class User(Base):
     hashed_password = Column(String)
     is_active = Column(Boolean, default=True)
     role = Column(String, default="user") # admin, user
+    token_version = Column(Integer, default=0) # Bumped to revoke tokens issued earlier
+    created_at = Column(DateTime, default=datetime.utcnow)
@@ -0,0 +1,89 @@
+import base64
+import json
+from datetime import datetime
+from typing import Optional
+from fastapi import HTTPException, Query, Response
+from sqlalchemy import and_, or_, tuple_, literal
+
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 500
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+TOTAL_COUNT_HEADER = "X-Total-Count"
+
+# Rows created before created_at existed have NULL there until it is backfilled (migration 0002).
+# They sort after every dated row ascending and before them descending, Postgres' default
+# NULLS LAST/FIRST, so the (created_at, id) indexes still serve the order.
+
+def encode_cursor(created_at: datetime | None, row_id: int) -> str:
+    raw = json.dumps([created_at.isoformat() if created_at else None, row_id]).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> tuple[datetime | None, int]:
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, row_id = json.loads(raw)
+        return datetime.fromisoformat(created_at) if created_at is not None else None, int(row_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Con trỏ phân trang không hợp lệ")
+
+class PageParams:
+    """Query parameters shared by every keyset-paginated list endpoint."""
+
+    def __init__(
+        self,
+        cursor: Optional[str] = None,
+        limit: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+        order: str = "asc",
+        include_total: bool = False,
+        created_from: Optional[datetime] = None,
+        created_to: Optional[datetime] = None,
+    ):
+        if order not in ("asc", "desc"):
+            raise HTTPException(status_code=400, detail="Tham số order phải là asc hoặc desc")
+        self.cursor = cursor
+        self.limit = limit
+        self.descending = order == "desc"
+        self.include_total = include_total
+        self.created_from = created_from
+        self.created_to = created_to
+
+def page_query(query, model, params: PageParams):
+    """`query` limited to the requested page, plus one row to tell whether another page follows."""
+    key = tuple_(model.created_at, model.id)
+    if params.cursor:
+        created_at, row_id = decode_cursor(params.cursor)
+        if created_at is None:
+            undated_after = and_(model.created_at.is_(None), model.id < row_id if params.descending else model.id > row_id)
+            # Descending, the dated rows all come after the undated ones
+            query = query.filter(or_(undated_after, model.created_at.isnot(None)) if params.descending else undated_after)
+        else:
+            position = tuple_(literal(created_at), literal(row_id))
+            # Ascending, the undated rows all come after the dated ones
+            query = query.filter(key < position if params.descending else or_(key > position, model.created_at.is_(None)))
+
+    if params.descending:
+        query = query.order_by(model.created_at.desc().nulls_first(), model.id.desc())
+    else:
+        query = query.order_by(model.created_at.asc().nulls_last(), model.id.asc())
+    return query.limit(params.limit + 1)
+
+def paginate(query, model, params: PageParams, response: Response) -> list:
+    """Applies the date filters and a (created_at, id) keyset page to `query`.
+
+    The rows are returned as a plain list so existing clients keep working;
+    the cursor for the next page and the optional total go in headers.
+    """
+    if params.created_from:
+        query = query.filter(model.created_at >= params.created_from)
+    if params.created_to:
+        query = query.filter(model.created_at <= params.created_to)
+
+    if params.include_total:
+        response.headers[TOTAL_COUNT_HEADER] = str(query.order_by(None).count())
+
+    rows = page_query(query, model, params).all()
+    if len(rows) > params.limit:
+        rows = rows[:params.limit]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(rows[-1].created_at, rows[-1].id)
+    return rows
@@ -0,0 +1,108 @@
+import itertools
+import os
+import random
+import sys
+import threading
+import time
+from collections import Counter, deque
+from datetime import datetime
+
+# Opt-in sampling profiler for slow requests, off unless PROFILE_SLOW_REQUEST_MS > 0
+PROFILE_SLOW_REQUEST_MS = float(os.getenv("PROFILE_SLOW_REQUEST_MS", "0"))
+# Fraction of requests that get sampled; the rest cost nothing
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "1"))
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "10"))
+PROFILE_KEEP = int(os.getenv("PROFILE_KEEP", "20"))
+PROFILE_MAX_DEPTH = 64
+PROFILE_TOP_STACKS = 50
+
+# Leaf frames of threads that are just waiting for work
+_IDLE_FILES = ("threading.py", "selectors.py", "queue.py")
+
+def _collapse(frame) -> str | None:
+    """Formats a stack as root;...;leaf (the folded format flame graph tools read)."""
+    if frame.f_code.co_filename.endswith(_IDLE_FILES):
+        return None
+    names = []
+    while frame is not None and len(names) < PROFILE_MAX_DEPTH:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}:{frame.f_lineno}")
+        frame = frame.f_back
+    return ";".join(reversed(names))
+
+class SlowRequestProfiler:
+    """Samples every thread's stack while selected requests are in flight.
+
+    Requests share one sampling thread that only runs while at least one of
+    them is active. Async handlers interleave on the event loop, so a sample
+    shows what the whole process was doing during the request, not just that
+    request; with a single slow request in flight it is usually the same.
+    Only requests that end up slower than the threshold are kept.
+    """
+
+    def __init__(self, threshold_ms: float, sample_rate: float, interval_ms: float, keep: int):
+        self.threshold_ms = threshold_ms
+        self.sample_rate = sample_rate
+        self.interval = interval_ms / 1000
+        self.recent: deque[dict] = deque(maxlen=keep)
+        self._active: set[int] = set()
+        self._samples: dict[int, Counter] = {}
+        self._handles = itertools.count(1)
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    @property
+    def enabled(self) -> bool:
+        return self.threshold_ms > 0
+
+    def start(self) -> int | None:
+        """Starts sampling for a request; returns a handle for finish(), or None."""
+        if not self.enabled or random.random() >= self.sample_rate:
+            return None
+        with self._lock:
+            handle = next(self._handles)
+            self._active.add(handle)
+            self._samples[handle] = Counter()
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="slow-request-profiler", daemon=True)
+                self._thread.start()
+            self._wakeup.set()
+        return handle
+
+    def finish(self, handle: int | None, method: str, route: str, seconds: float):
+        if handle is None:
+            return
+        with self._lock:
+            self._active.discard(handle)
+            samples = self._samples.pop(handle)
+        if seconds * 1000 < self.threshold_ms:
+            return
+        self.recent.append({
+            "method": method,
+            "route": route,
+            "duration_ms": round(seconds * 1000, 1),
+            "finished_at": datetime.utcnow().isoformat(),
+            "samples": sum(samples.values()),
+            "interval_ms": self.interval * 1000,
+            "stacks": [{"stack": stack, "count": count} for stack, count in samples.most_common(PROFILE_TOP_STACKS)],
+        })
+
+    def _run(self):
+        me = threading.get_ident()
+        while True:
+            self._wakeup.wait()
+            with self._lock:
+                if not self._active:
+                    self._wakeup.clear()
+                    continue
+            stacks = [
+                stack for ident, frame in sys._current_frames().items()
+                if ident != me and (stack := _collapse(frame))
+            ]
+            with self._lock:
+                for handle in self._active:
+                    self._samples[handle].update(stacks)
+            time.sleep(self.interval)
+
+profiler = SlowRequestProfiler(PROFILE_SLOW_REQUEST_MS, PROFILE_SAMPLE_RATE, PROFILE_INTERVAL_MS, PROFILE_KEEP)
@@ -0,0 +1,87 @@
+import json
+import os
+import re
+
+# Prompts and answer parsing shared by every model provider
+
+EVAL_MODEL = os.getenv("GEMINI_EVAL_MODEL", "gemini-flash-latest")
+# Bump EVAL_PROMPT_VERSION whenever the instructions change, cached results are keyed on it
+EVAL_PROMPT_VERSION = 1
+EVAL_PROMPT_SUFFIX = " ALWAYS ANSWER IN VIETNAMESE. Format your response exactly like this:\nSCORE: <number from 0 to 10>\nEXPLANATION: <brief explanation>"
+
+# Grouped mode: several criteria answered in one request as a JSON array
+EVAL_GROUP_PROMPT_VERSION = 1
+EVAL_GROUP_PROMPT = """Evaluate the documents in the file search store against each criterion below. ALWAYS ANSWER IN VIETNAMESE.
+Return a JSON array with exactly one object per criterion, using these fields:
+- criterion_id: the number in brackets before the criterion
+- score: integer from 0 to 10
+- explanation: brief explanation
+- evidence: short quote or document reference supporting the score
+
+Criteria:
+"""
+
+# Local retrieval: the criterion is answered from passages sent inline instead of a file search store
+EVAL_PASSAGES_PROMPT_VERSION = 1
+EVAL_PASSAGES_PROMPT = """Evaluate the contractor's documents against the criterion below, using ONLY the numbered excerpts that follow.
+If the excerpts don't contain the information, say so and give a low score.
+
+Criterion: """
+
+def passages_prompt(prompt: str, passages: list[dict]) -> str:
+    excerpts = "\n\n".join(
+        f"[{i}] ({p['filename']}{', page ' + str(p['page']) if p.get('page') else ''})\n{p['text']}"
+        for i, p in enumerate(passages, start=1)
+    )
+    return EVAL_PASSAGES_PROMPT + prompt + "\n\nExcerpts:\n" + excerpts + "\n\n" + EVAL_PROMPT_SUFFIX
+
+def group_prompt(criteria: list[tuple[int, str]]) -> str:
+    return EVAL_GROUP_PROMPT + "\n".join(f"[{criterion_id}] {prompt}" for criterion_id, prompt in criteria)
+
+def parse_group_response(text: str, criterion_ids: set[int]) -> dict[int, dict]:
+    """Validates a grouped JSON answer, raising ValueError if it isn't a JSON array."""
+    # Without a response schema the model may wrap the JSON in a code fence
+    text = re.sub(r"^```(?:json)?\s*|\s*```$", "", text.strip())
+    data = json.loads(text)
+    if not isinstance(data, list):
+        raise ValueError("Grouped evaluation response is not a JSON array")
+
+    items = {}
+    for item in data:
+        if not isinstance(item, dict):
+            continue
+        criterion_id = item.get("criterion_id")
+        score = item.get("score")
+        explanation = item.get("explanation")
+        if criterion_id not in criterion_ids or criterion_id in items:
+            continue
+        if not isinstance(score, int) or isinstance(score, bool) or not 0 <= score <= 10:
+            continue
+        if not isinstance(explanation, str) or not explanation.strip():
+            continue
+        evidence = item.get("evidence")
+        items[criterion_id] = {
+            "score": score,
+            "explanation": explanation.strip(),
+            "evidence": evidence.strip() if isinstance(evidence, str) else "",
+        }
+    return items
+
+def parse_evaluation_text(eval_text: str) -> tuple[int | None, str]:
+    """Extracts the score and explanation from an evaluation response.
+
+    The score is None when the response doesn't follow the SCORE format.
+    """
+    score = None
+    match = re.search(r"SCORE:\s*(\d+)", eval_text)
+    if match:
+        score = int(match.group(1))
+
+    explanation_match = re.search(r"EXPLANATION:\s*(.*)", eval_text, re.DOTALL)
+    if explanation_match:
+        comment = explanation_match.group(1).strip()
+    else:
+        # Fallback if format isn't perfect, try to strip SCORE line
+        comment = re.sub(r"SCORE:\s*\d+\s*", "", eval_text).strip()
+
+    return score, comment
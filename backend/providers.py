@@ -0,0 +1,236 @@
+import os
+import threading
+from abc import ABC, abstractmethod
+from . import prompts
+
+# gemini (default) or fake, see fake_provider.py
+MODEL_PROVIDER = os.getenv("MODEL_PROVIDER", "gemini")
+
+class ModelProvider(ABC):
+    """What the backend needs from a model provider.
+
+    Remote objects are returned as the provider's own objects; callers only
+    rely on the attributes the Gemini SDK exposes: files have `name`, `uri`,
+    `state.name` and `error.message`, operations have `done` and `error`,
+    stores and documents have `name` (documents also `display_name`).
+    Errors are raised as-is, except that a missing store or file is not an
+    error for `get_store`, `delete_store` and `delete_file`. Every method is
+    abstract, so a provider missing one fails when it is created.
+    """
+
+    @abstractmethod
+    def create_store(self, display_name: str) -> str:
+        ...
+
+    @abstractmethod
+    def upload_file(self, file, mime_type: str = None, display_name: str = None):
+        """Uploads a path or file-like object; the result may still be PROCESSING."""
+
+    @abstractmethod
+    def get_file(self, file_name: str):
+        ...
+
+    @abstractmethod
+    def import_file(self, store_name: str, file_name: str):
+        """Adds an uploaded file to a store and returns the import operation."""
+
+    @abstractmethod
+    def get_operation(self, operation):
+        ...
+
+    @abstractmethod
+    def evaluate(self, store_name: str, prompt: str) -> dict:
+        """Answers one criterion prompt: {"text", "input_tokens", "output_tokens"}."""
+
+    @abstractmethod
+    def evaluate_group(self, store_name: str, criteria: list[tuple[int, str]]) -> dict:
+        """Answers several criteria at once: the evaluate fields plus the parsed "items"."""
+
+    @abstractmethod
+    def evaluate_passages(self, prompt: str, passages: list[dict]) -> dict:
+        """Answers one criterion from the given passages only, like evaluate without a store."""
+
+    @abstractmethod
+    def get_store(self, store_name: str):
+        ...
+
+    @abstractmethod
+    def delete_store(self, store_name: str):
+        ...
+
+    @abstractmethod
+    def delete_file(self, file_name: str):
+        ...
+
+    @abstractmethod
+    def list_stores_page(self, page_token: str | None = None, page_size: int = 20) -> tuple[list, str | None]:
+        ...
+
+    @abstractmethod
+    def list_files_page(self, page_token: str | None = None, page_size: int = 100) -> tuple[list, str | None]:
+        ...
+
+    @abstractmethod
+    def list_store_documents(self, store_name: str) -> list:
+        ...
+
+class GeminiProvider(ModelProvider):
+    """Gemini API with file search stores."""
+
+    def __init__(self, api_key: str | None = None):
+        from google import genai
+        from google.genai import errors, types
+
+        api_key = api_key or os.getenv("GEMINI_API_KEY") or os.getenv("VITE_GEMINI_API_KEY")
+        if not api_key:
+            raise ValueError("GEMINI_API_KEY not found in environment variables")
+        self.client = genai.Client(api_key=api_key)
+        self._errors = errors
+        self._types = types
+        # Some models reject response schemas together with tools, the prompt alone then carries the format
+        self.group_response_schema = os.getenv("GEMINI_GROUP_RESPONSE_SCHEMA", "1") == "1"
+        self.group_schema = types.Schema(
+            type=types.Type.ARRAY,
+            items=types.Schema(
+                type=types.Type.OBJECT,
+                properties={
+                    "criterion_id": types.Schema(type=types.Type.INTEGER),
+                    "score": types.Schema(type=types.Type.INTEGER),
+                    "explanation": types.Schema(type=types.Type.STRING),
+                    "evidence": types.Schema(type=types.Type.STRING),
+                },
+                required=["criterion_id", "score", "explanation"],
+            ),
+        )
+
+    def _is_not_found(self, e: Exception) -> bool:
+        return isinstance(e, self._errors.APIError) and e.code == 404
+
+    def _file_search(self, store_name: str):
+        types = self._types
+        return types.Tool(file_search=types.FileSearch(file_search_store_names=[store_name]))
+
+    def _usage(self, response) -> dict:
+        usage = response.usage_metadata
+        return {
+            "input_tokens": usage.prompt_token_count if usage else 0,
+            "output_tokens": usage.candidates_token_count if usage else 0,
+        }
+
+    def create_store(self, display_name: str) -> str:
+        return self.client.file_search_stores.create(config={"display_name": display_name}).name
+
+    def upload_file(self, file, mime_type: str = None, display_name: str = None):
+        config = {"mime_type": mime_type}
+        if display_name:
+            config["display_name"] = display_name
+        # client.files.upload handles both path strings and file-like objects
+        return self.client.files.upload(file=file, config=config)
+
+    def get_file(self, file_name: str):
+        return self.client.files.get(name=file_name)
+
+    def import_file(self, store_name: str, file_name: str):
+        return self.client.file_search_stores.import_file(file_search_store_name=store_name, file_name=file_name)
+
+    def get_operation(self, operation):
+        return self.client.operations.get(operation)
+
+    def evaluate(self, store_name: str, prompt: str) -> dict:
+        response = self.client.models.generate_content(
+            model=prompts.EVAL_MODEL,
+            contents=prompt + prompts.EVAL_PROMPT_SUFFIX,
+            config=self._types.GenerateContentConfig(tools=[self._file_search(store_name)])
+        )
+        return {"text": response.text, **self._usage(response)}
+
+    def evaluate_group(self, store_name: str, criteria: list[tuple[int, str]]) -> dict:
+        config = {"tools": [self._file_search(store_name)]}
+        if self.group_response_schema:
+            config["response_mime_type"] = "application/json"
+            config["response_schema"] = self.group_schema
+
+        response = self.client.models.generate_content(
+            model=prompts.EVAL_MODEL,
+            contents=prompts.group_prompt(criteria),
+            config=self._types.GenerateContentConfig(**config)
+        )
+        return {
+            "text": response.text,
+            "items": prompts.parse_group_response(response.text or "", {criterion_id for criterion_id, _ in criteria}),
+            **self._usage(response),
+        }
+
+    def evaluate_passages(self, prompt: str, passages: list[dict]) -> dict:
+        response = self.client.models.generate_content(
+            model=prompts.EVAL_MODEL,
+            contents=prompts.passages_prompt(prompt, passages),
+        )
+        return {"text": response.text, **self._usage(response)}
+
+    def get_store(self, store_name: str):
+        try:
+            return self.client.file_search_stores.get(name=store_name)
+        except Exception as e:
+            if self._is_not_found(e):
+                return None
+            raise
+
+    def delete_store(self, store_name: str):
+        try:
+            self.client.file_search_stores.delete(name=store_name, config={"force": True})
+        except Exception as e:
+            if not self._is_not_found(e):
+                raise
+
+    def delete_file(self, file_name: str):
+        try:
+            self.client.files.delete(name=file_name)
+        except Exception as e:
+            if not self._is_not_found(e):
+                raise
+
+    def _page(self, list_method, page_token: str | None, page_size: int) -> tuple[list, str | None]:
+        """One page from an SDK list method, with the page size and token passed in explicitly."""
+        config = {"page_size": page_size}
+        if page_token:
+            config["page_token"] = page_token
+        pager = list_method(config=config)
+        # Pager.config is the config of the next request, holding the next page's token
+        next_token = pager.config.get("page_token") or None
+        return list(pager.page), next_token if next_token != page_token else None
+
+    def list_stores_page(self, page_token: str | None = None, page_size: int = 20) -> tuple[list, str | None]:
+        return self._page(self.client.file_search_stores.list, page_token, page_size)
+
+    def list_files_page(self, page_token: str | None = None, page_size: int = 100) -> tuple[list, str | None]:
+        return self._page(self.client.files.list, page_token, page_size)
+
+    def list_store_documents(self, store_name: str) -> list:
+        return list(self.client.file_search_stores.documents.list(parent=store_name))
+
+_provider: ModelProvider | None = None
+_provider_lock = threading.Lock()
+
+def create_provider(name: str = MODEL_PROVIDER) -> ModelProvider:
+    if name == "gemini":
+        return GeminiProvider()
+    if name == "fake":
+        from .fake_provider import FakeProvider
+        return FakeProvider.from_env()
+    raise ValueError(f"Unknown MODEL_PROVIDER: {name}")
+
+def get_provider() -> ModelProvider:
+    """Returns the process-wide provider, creating it on first use."""
+    global _provider
+    if _provider is None:
+        with _provider_lock:
+            if _provider is None:
+                _provider = create_provider()
+    return _provider
+
+def set_provider(provider: ModelProvider | None):
+    """Replaces the process-wide provider; None makes the next call create it again."""
+    global _provider
+    with _provider_lock:
+        _provider = provider
@@ -0,0 +1,171 @@
+import asyncio
+import os
+import time
+from collections import OrderedDict, deque
+
+# Provider quotas, 0 disables the corresponding limit
+GEMINI_REQUESTS_PER_MINUTE = int(os.getenv("GEMINI_REQUESTS_PER_MINUTE", "60"))
+GEMINI_TOKENS_PER_MINUTE = int(os.getenv("GEMINI_TOKENS_PER_MINUTE", "1000000"))
+
+class TokenBucket:
+    """Async token bucket refilled continuously at `per_minute` tokens per minute."""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.rate = per_minute / 60.0
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        return self.rate > 0
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount: float = 1):
+        if not self.enabled:
+            return
+        # A single request larger than the bucket would wait forever
+        amount = min(amount, self.capacity)
+        # Waiters queue on the lock, so the bucket is served in FIFO order
+        async with self._lock:
+            while True:
+                self._refill()
+                if self.tokens >= amount:
+                    self.tokens -= amount
+                    return
+                await asyncio.sleep((amount - self.tokens) / self.rate)
+
+    def try_acquire(self, amount: float = 1) -> bool:
+        """Takes the tokens only if they are there now and nobody is waiting for them."""
+        if not self.enabled:
+            return True
+        amount = min(amount, self.capacity)
+        if self._lock.locked():
+            return False
+        self._refill()
+        if self.tokens < amount:
+            return False
+        self.tokens -= amount
+        return True
+
+    def adjust(self, delta: float):
+        """Charges (positive) or refunds (negative) tokens after the fact.
+
+        The balance may go negative, later acquirers then wait off the debt.
+        """
+        if not self.enabled:
+            return
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - delta)
+
+class ModelRateLimiter:
+    """Enforces requests-per-minute and tokens-per-minute quotas for model calls.
+
+    Token usage is only known once a call returns, so each call reserves an
+    estimate (the running average of recent calls) and the difference is
+    settled with `record` using the call's usage_metadata counts.
+    """
+
+    def __init__(self, requests_per_minute: int, tokens_per_minute: int, initial_estimate: int = 2000):
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self.estimate = float(initial_estimate)
+
+    async def acquire(self) -> int:
+        """Waits for quota and returns the number of tokens reserved."""
+        reserved = int(self.estimate)
+        await self.requests.acquire(1)
+        await self.tokens.acquire(reserved)
+        return reserved
+
+    async def try_acquire(self) -> int | None:
+        """Reserves like acquire without waiting, None when the quota isn't free right now."""
+        reserved = int(self.estimate)
+        if not self.requests.try_acquire(1):
+            return None
+        if not self.tokens.try_acquire(reserved):
+            self.requests.adjust(-1)
+            return None
+        return reserved
+
+    def record(self, reserved: int, actual_tokens: int | None):
+        """Settles a reservation; pass None when the call failed before using tokens."""
+        if actual_tokens is None:
+            self.tokens.adjust(-reserved)
+            return
+        self.tokens.adjust(actual_tokens - reserved)
+        # Exponential moving average keeps the estimate close to recent prompts
+        self.estimate = 0.8 * self.estimate + 0.2 * actual_tokens
+
+model_limiter = ModelRateLimiter(GEMINI_REQUESTS_PER_MINUTE, GEMINI_TOKENS_PER_MINUTE)
+
+class FairSemaphore:
+    """Semaphore that hands free slots to waiting keys in round-robin order.
+
+    A plain asyncio.Semaphore serves waiters FIFO, so a contractor that queued
+    50 criteria first would get all of them answered before the next one
+    starts. Here each released slot goes to the next key in rotation.
+    """
+
+    def __init__(self, value: int):
+        self._value = value
+        self._waiters: OrderedDict[object, deque[asyncio.Future]] = OrderedDict()
+
+    async def acquire(self, key):
+        if self._value > 0 and not self._waiters:
+            self._value -= 1
+            return
+        fut = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(key, deque()).append(fut)
+        try:
+            await fut
+        except asyncio.CancelledError:
+            if fut.done() and not fut.cancelled():
+                # The slot was granted just before the cancellation, pass it on
+                self.release()
+            else:
+                queue = self._waiters.get(key)
+                if queue is not None and fut in queue:
+                    queue.remove(fut)
+                    if not queue:
+                        del self._waiters[key]
+            raise
+
+    def release(self):
+        while self._waiters:
+            key, queue = next(iter(self._waiters.items()))
+            fut = queue.popleft()
+            if queue:
+                self._waiters.move_to_end(key)
+            else:
+                del self._waiters[key]
+            if not fut.done():
+                fut.set_result(None)
+                return
+        self._value += 1
+
+    @property
+    def available(self) -> int:
+        return self._value
+
+    def waiting(self) -> int:
+        return sum(len(queue) for queue in self._waiters.values())
+
+    def slot(self, key):
+        return _FairSlot(self, key)
+
+class _FairSlot:
+    def __init__(self, semaphore: FairSemaphore, key):
+        self.semaphore = semaphore
+        self.key = key
+
+    async def __aenter__(self):
+        await self.semaphore.acquire(self.key)
+
+    async def __aexit__(self, *exc):
+        self.semaphore.release()
@@ -0,0 +1,256 @@
+import asyncio
+import os
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from sqlalchemy import or_, text
+from . import models, database, services, ingestion, cleanup
+from .ratelimit import TokenBucket
+
+# 0 disables the periodic sweep, it can still be triggered from the admin endpoint
+RECONCILE_INTERVAL_SECONDS = int(os.getenv("RECONCILE_INTERVAL_SECONDS", "3600"))
+RECONCILE_REQUESTS_PER_MINUTE = int(os.getenv("RECONCILE_REQUESTS_PER_MINUTE", "30"))
+# Work done per run; the checkpoints carry the rest over to the next run
+RECONCILE_PAGES_PER_RUN = int(os.getenv("RECONCILE_PAGES_PER_RUN", "5"))
+RECONCILE_CONTRACTORS_PER_RUN = int(os.getenv("RECONCILE_CONTRACTORS_PER_RUN", "50"))
+# Anything younger than this may still be in the middle of an ingestion
+RECONCILE_GRACE_SECONDS = int(os.getenv("RECONCILE_GRACE_SECONDS", "3600"))
+RECONCILE_REPORT_MAX_ACTIONS = 500
+RECONCILE_LOCK_KEY = 714_002
+
+SCOPE_STORES = "stores"
+SCOPE_FILES = "files"
+SCOPE_CONTRACTORS = "contractors"
+
+_limiter = TokenBucket(RECONCILE_REQUESTS_PER_MINUTE)
+_running = asyncio.Lock()
+
+async def _remote(func, *args):
+    """Rate-limited provider call so a sweep never competes with evaluations for quota."""
+    await _limiter.acquire()
+    return await asyncio.to_thread(func, *args)
+
+def _new_report(dry_run: bool) -> dict:
+    return {"dry_run": dry_run, "started_at": datetime.utcnow().isoformat(), "counts": Counter(), "actions": []}
+
+def _record(report: dict, action: str, name: str, **details):
+    report["counts"][action] += 1
+    if len(report["actions"]) < RECONCILE_REPORT_MAX_ACTIONS:
+        report["actions"].append({"action": action, "name": name, **details})
+
+def _is_recent(created) -> bool:
+    if created is None:
+        return False
+    if created.tzinfo is None:
+        created = created.replace(tzinfo=timezone.utc)
+    return (datetime.now(timezone.utc) - created).total_seconds() < RECONCILE_GRACE_SECONDS
+
+def _load_checkpoint(scope: str) -> str | None:
+    db = database.SessionLocal()
+    try:
+        checkpoint = db.query(models.ReconcileCheckpoint).filter(models.ReconcileCheckpoint.scope == scope).first()
+        return checkpoint.cursor if checkpoint else None
+    finally:
+        db.close()
+
+def _save_checkpoint(scope: str, cursor: str | None, report: dict):
+    db = database.SessionLocal()
+    try:
+        checkpoint = db.query(models.ReconcileCheckpoint).filter(models.ReconcileCheckpoint.scope == scope).first()
+        if not checkpoint:
+            checkpoint = models.ReconcileCheckpoint(scope=scope)
+            db.add(checkpoint)
+        checkpoint.cursor = cursor
+        checkpoint.last_report = {"counts": dict(report["counts"]), "started_at": report["started_at"]}
+        checkpoint.updated_at = datetime.utcnow()
+        db.commit()
+    finally:
+        db.close()
+
+def _referenced(column, names: list[str]) -> set[str]:
+    db = database.SessionLocal()
+    try:
+        return {name for (name,) in db.query(column).filter(column.in_(names)).distinct()}
+    finally:
+        db.close()
+
+def _contractor_batch(after_id: int, limit: int) -> list[dict]:
+    db = database.SessionLocal()
+    try:
+        contractors = db.query(models.Contractor.id, models.Contractor.gemini_store_name).filter(
+            models.Contractor.id > after_id
+        ).order_by(models.Contractor.id).limit(limit).all()
+        # The batch's unindexed files in one query rather than a lazy load per contractor
+        file = models.ContractorFile
+        settled_before = datetime.utcnow() - timedelta(seconds=RECONCILE_GRACE_SECONDS)
+        unindexed: dict[int, list[dict]] = {}
+        for f in db.query(file.id, file.contractor_id, file.filename, file.gemini_file_name).filter(
+            file.contractor_id.in_([c.id for c in contractors]),
+            file.gemini_file_name.isnot(None),
+            file.is_stored_in_gemini.isnot(True),
+            or_(file.created_at.is_(None), file.created_at < settled_before),
+        ).order_by(file.id):
+            unindexed.setdefault(f.contractor_id, []).append(
+                {"id": f.id, "filename": f.filename, "gemini_file_name": f.gemini_file_name}
+            )
+        return [
+            {"id": c.id, "store_name": c.gemini_store_name, "unindexed": unindexed.get(c.id, [])}
+            for c in contractors
+        ]
+    finally:
+        db.close()
+
+def _document_file_id(document) -> str:
+    """The id of the uploaded file a store document was imported from.
+
+    Imported documents are named <store>/documents/<file id>, the file itself files/<file id>.
+    """
+    return document.name.rsplit("/", 1)[-1]
+
+def _forget_store(contractor_id: int):
+    """The contractor's store is gone remotely: clear it so the next ingestion creates a new one."""
+    db = database.SessionLocal()
+    try:
+        db.query(models.Contractor).filter(models.Contractor.id == contractor_id).update(
+            {models.Contractor.gemini_store_name: None}, synchronize_session=False
+        )
+        db.query(models.ContractorFile).filter(models.ContractorFile.contractor_id == contractor_id).update(
+            {models.ContractorFile.is_stored_in_gemini: False}, synchronize_session=False
+        )
+        db.commit()
+    finally:
+        db.close()
+
+def _mark_indexed(file_ids: list[int]):
+    db = database.SessionLocal()
+    try:
+        db.query(models.ContractorFile).filter(models.ContractorFile.id.in_(file_ids)).update(
+            {models.ContractorFile.is_stored_in_gemini: True, models.ContractorFile.import_error: None},
+            synchronize_session=False
+        )
+        db.commit()
+    finally:
+        db.close()
+
+async def _sweep_remote(scope: str, list_page, column, kind: str, report: dict, dry_run: bool):
+    """Pages through remote stores or files and collects the ones no row references."""
+    token = await asyncio.to_thread(_load_checkpoint, scope)
+    for _ in range(RECONCILE_PAGES_PER_RUN):
+        items, token = await _remote(list_page, token)
+        referenced = await asyncio.to_thread(_referenced, column, [item.name for item in items])
+        for item in items:
+            if item.name in referenced or _is_recent(getattr(item, "create_time", None)):
+                continue
+            _record(report, f"orphan_{kind}", item.name)
+            if not dry_run:
+                cleanup.cleanup_queue.enqueue(kind, item.name)
+        if not token:
+            break
+    if not dry_run:
+        await asyncio.to_thread(_save_checkpoint, scope, token, report)
+
+async def _sweep_contractors(report: dict, dry_run: bool):
+    """Checks each contractor's store still exists and repairs is_stored_in_gemini flags."""
+    cursor = await asyncio.to_thread(_load_checkpoint, SCOPE_CONTRACTORS)
+    batch = await asyncio.to_thread(_contractor_batch, int(cursor or 0), RECONCILE_CONTRACTORS_PER_RUN)
+    for contractor in batch:
+        store_name = contractor["store_name"]
+        if not store_name:
+            continue
+        if await _remote(services.get_store, store_name) is None:
+            _record(report, "missing_store", store_name, contractor_id=contractor["id"])
+            if not dry_run:
+                await asyncio.to_thread(_forget_store, contractor["id"])
+            continue
+
+        # Files still being imported by this worker are not drift
+        if not contractor["unindexed"] or ingestion.tracker.pending_count(contractor["id"]):
+            continue
+        documents = await _remote(services.list_store_documents, store_name)
+        # By file resource, not display name: two uploads may share a filename
+        indexed_files = {_document_file_id(d) for d in documents}
+        repaired = []
+        for f in contractor["unindexed"]:
+            if f["gemini_file_name"].rsplit("/", 1)[-1] in indexed_files:
+                _record(report, "repair_flag", f["gemini_file_name"], file_id=f["id"])
+                repaired.append(f["id"])
+                continue
+            _record(report, "reimport_file", f["gemini_file_name"], file_id=f["id"])
+            if dry_run:
+                continue
+            try:
+                operation = await _remote(services.add_file_to_store, store_name, f["gemini_file_name"])
+                ingestion.tracker.track(contractor["id"], f["id"], operation)
+            except Exception as e:
+                # Typically the uploaded file expired; it has to be uploaded again
+                _record(report, "reimport_failed", f["gemini_file_name"], file_id=f["id"], error=str(e))
+        if repaired and not dry_run:
+            await asyncio.to_thread(_mark_indexed, repaired)
+
+    next_cursor = str(batch[-1]["id"]) if len(batch) == RECONCILE_CONTRACTORS_PER_RUN else None
+    if not dry_run:
+        await asyncio.to_thread(_save_checkpoint, SCOPE_CONTRACTORS, next_cursor, report)
+
+def _try_lock():
+    """Takes the cluster-wide sweep lock on a dedicated connection, or returns None."""
+    conn = database.get_engine().connect()
+    locked = conn.execute(text("SELECT pg_try_advisory_lock(:key)"), {"key": RECONCILE_LOCK_KEY}).scalar()
+    # The session-level lock outlives the transaction; don't sit "idle in transaction" for the whole sweep
+    conn.commit()
+    if locked:
+        return conn
+    conn.close()
+    return None
+
+def _unlock(conn):
+    try:
+        conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": RECONCILE_LOCK_KEY})
+        conn.commit()
+    finally:
+        conn.close()
+
+async def run_once(dry_run: bool = False) -> dict:
+    """Runs one increment of every pass and returns the report.
+
+    With dry_run nothing is changed and checkpoints stay where they are, so
+    the report shows what the next real run would do.
+    """
+    report = _new_report(dry_run)
+    if _running.locked():
+        report["skipped"] = "Already running in this worker"
+        return report
+    async with _running:
+        lock = await asyncio.to_thread(_try_lock)
+        if lock is None:
+            report["skipped"] = "Already running in another worker"
+            return report
+        try:
+            await _sweep_remote(SCOPE_STORES, services.list_stores_page, models.Contractor.gemini_store_name,
+                                cleanup.KIND_STORE, report, dry_run)
+            await _sweep_remote(SCOPE_FILES, services.list_files_page, models.ContractorFile.gemini_file_name,
+                                cleanup.KIND_FILE, report, dry_run)
+            await _sweep_contractors(report, dry_run)
+        finally:
+            await asyncio.to_thread(_unlock, lock)
+    report["finished_at"] = datetime.utcnow().isoformat()
+    report["counts"] = dict(report["counts"])
+    return report
+
+async def run_periodically():
+    while True:
+        await asyncio.sleep(RECONCILE_INTERVAL_SECONDS)
+        try:
+            report = await run_once()
+            if report["counts"]:
+                print(f"Reconciliation: {report['counts']}")
+        except Exception as e:
+            print(f"Reconciliation failed: {e}")
+
+def checkpoints() -> list[dict]:
+    db = database.SessionLocal()
+    try:
+        return [
+            {"scope": c.scope, "cursor": c.cursor, "last_report": c.last_report, "updated_at": c.updated_at}
+            for c in db.query(models.ReconcileCheckpoint).all()
+        ]
+    finally:
+        db.close()
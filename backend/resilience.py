@@ -0,0 +1,401 @@
+import os
+import random
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+from functools import wraps
+from . import metrics
+
+# Retries, timeouts, circuit breaking and hedging for the blocking provider calls in services.py.
+#
+# retries   transient failures (429, 408, 5xx, timeouts, connection errors) are retried
+#           with full-jitter exponential backoff, or after the Retry-After the provider sent.
+#           Operations that aren't safe to repeat (create_store, upload, import) are only
+#           retried on 429, which means the request was refused before doing anything.
+# timeouts  per operation (MODEL_TIMEOUTS, op=seconds pairs, 0 = none). The attempt runs on
+#           a helper thread, timed from when it starts running. A timed-out request is not
+#           retried while it is still running; if it answers during the backoff, that answer is used.
+# breaker   per family of operations (generation, everything else): after
+#           MODEL_BREAKER_FAILURES consecutive transient failures calls fail immediately
+#           with CircuitOpenError for MODEL_BREAKER_RESET_SECONDS, then one probe decides.
+# hedging   generate calls still running after the MODEL_HEDGE_PERCENTILE latency of recent
+#           calls get one duplicate request and the first answer wins. Off by default (0);
+#           at most MODEL_HEDGE_MAX_RATIO of the calls are hedged, and never while the
+#           breaker isn't closed or without spare quota, so an incident is not met with extra load.
+
+MODEL_RETRY_ATTEMPTS = int(os.getenv("MODEL_RETRY_ATTEMPTS", "3"))
+MODEL_RETRY_BASE_SECONDS = float(os.getenv("MODEL_RETRY_BASE_SECONDS", "1"))
+# Longest backoff; a Retry-After beyond it fails the call instead of holding a model slot
+MODEL_RETRY_MAX_SECONDS = float(os.getenv("MODEL_RETRY_MAX_SECONDS", "30"))
+MODEL_BREAKER_FAILURES = int(os.getenv("MODEL_BREAKER_FAILURES", "5"))
+MODEL_BREAKER_RESET_SECONDS = float(os.getenv("MODEL_BREAKER_RESET_SECONDS", "30"))
+MODEL_HEDGE_PERCENTILE = float(os.getenv("MODEL_HEDGE_PERCENTILE", "0"))
+MODEL_HEDGE_MAX_RATIO = float(os.getenv("MODEL_HEDGE_MAX_RATIO", "0.05"))
+# Threads for attempts that have a timeout or may be hedged, abandoned attempts included.
+# Timeouts run from when an attempt starts, so a full pool delays calls without failing them.
+MODEL_CALL_THREADS = int(os.getenv("MODEL_CALL_THREADS", "64"))
+
+DEFAULT_TIMEOUTS = {
+    "create_store": 60,
+    "upload": 0, # Proportional to the file size, left to the HTTP client
+    "file_status": 30,
+    "operation_status": 30,
+    "import": 60,
+    "generate": 120,
+    "generate_group": 180,
+    "list": 60,
+    "get_store": 30,
+    "delete_store": 60,
+    "delete_file": 30,
+}
+# Not idempotent: a timeout or 5xx may have done the work already
+UNSAFE_TO_REPEAT = ("create_store", "upload", "import")
+# Retried by the cleanup queue, which already backs off between attempts
+SINGLE_ATTEMPT = ("delete_store", "delete_file")
+HEDGED = ("generate",)
+BREAKER_FAMILIES = {"generate": "generate", "generate_group": "generate"}
+HEDGE_MIN_SAMPLES = 20
+LATENCY_WINDOW = 200
+RETRYABLE_CODES = (408, 429, 500, 502, 503, 504)
+# Transport errors of the HTTP client under the SDK, matched by name so it needn't be imported
+TRANSPORT_ERRORS = {
+    "ConnectError": "unavailable", "ReadError": "unavailable", "RemoteProtocolError": "unavailable",
+    "ConnectTimeout": "timeout", "ReadTimeout": "timeout", "WriteTimeout": "timeout", "PoolTimeout": "timeout",
+}
+
+# Meters provider requests for the current call, set by callers that have a quota (jobs).
+# Every request goes through it, retries and hedges included: acquire() returns a
+# reservation before sending, try_acquire() a reservation or None without waiting (hedges),
+# record(reservation, result) settles it once the request is over (result None if it failed).
+admission: ContextVar = ContextVar("model_admission", default=None)
+
+def _parse_timeouts(raw: str) -> dict[str, float]:
+    timeouts = {}
+    for part in raw.split(","):
+        if part.strip():
+            op, _, seconds = part.partition("=")
+            timeouts[op.strip()] = float(seconds)
+    return timeouts
+
+MODEL_TIMEOUTS = {**DEFAULT_TIMEOUTS, **_parse_timeouts(os.getenv("MODEL_TIMEOUTS", ""))}
+
+class ModelCallTimeout(TimeoutError):
+    """An attempt took longer than the operation's timeout; `pending` are its requests still running."""
+    code = "timeout"
+
+    def __init__(self, message: str, pending: set = frozenset()):
+        super().__init__(message)
+        self.pending = set(pending)
+
+class CircuitOpenError(Exception):
+    """The provider is failing, the call was refused without being sent."""
+    code = "circuit_open"
+
+    def __init__(self, family: str, retry_in: float):
+        super().__init__(f"Dịch vụ mô hình đang gián đoạn ({family}), thử lại sau {retry_in:.0f}s")
+        self.retry_in = retry_in
+
+def classify(e: Exception) -> str | None:
+    """"throttled", "unavailable" or "timeout" for transient failures, None for the rest."""
+    if isinstance(e, CircuitOpenError):
+        return None
+    if isinstance(e, TimeoutError):
+        return "timeout"
+    if isinstance(e, ConnectionError):
+        return "unavailable"
+    code = getattr(e, "code", None)
+    if code == 429:
+        return "throttled"
+    if code in RETRYABLE_CODES:
+        return "unavailable"
+    return TRANSPORT_ERRORS.get(type(e).__name__)
+
+def retry_after(e: Exception) -> float | None:
+    """Seconds from the error's Retry-After header (delta or HTTP date), if it has one."""
+    headers = getattr(getattr(e, "response", None), "headers", None)
+    value = headers.get("retry-after") if headers is not None else None
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, (parsedate_to_datetime(value) - datetime.now(timezone.utc)).total_seconds())
+    except (TypeError, ValueError):
+        return None
+
+def backoff(attempt: int, after: float | None = None) -> float | None:
+    """Delay before retry number `attempt` (1-based), None when it would exceed MODEL_RETRY_MAX_SECONDS."""
+    if after is None:
+        return random.uniform(0, min(MODEL_RETRY_MAX_SECONDS, MODEL_RETRY_BASE_SECONDS * 2 ** (attempt - 1)))
+    if after > MODEL_RETRY_MAX_SECONDS:
+        return None
+    # A little jitter on top, so the callers told the same time don't all come back at once
+    return after + random.uniform(0, MODEL_RETRY_BASE_SECONDS)
+
+class CircuitBreaker:
+    """Consecutive-failure breaker: closed, open for `reset_seconds`, then half-open.
+
+    Half-open lets a single probe through; its outcome closes or reopens the
+    breaker. Only transient failures count, an answered error (400, 404) shows
+    the provider is up.
+    """
+
+    def __init__(self, family: str, threshold: int = MODEL_BREAKER_FAILURES,
+                 reset_seconds: float = MODEL_BREAKER_RESET_SECONDS):
+        self.family = family
+        self.threshold = threshold
+        self.reset_seconds = reset_seconds
+        self.failures = 0
+        self.opened_at = None
+        self.probe_started = None
+        self._lock = threading.Lock()
+
+    @property
+    def state(self) -> str:
+        if self.opened_at is None:
+            return "closed"
+        return "open" if time.monotonic() - self.opened_at < self.reset_seconds else "half_open"
+
+    def before_call(self):
+        """Raises CircuitOpenError unless the call may go out."""
+        if self.threshold <= 0:
+            return
+        with self._lock:
+            if self.opened_at is None:
+                return
+            now = time.monotonic()
+            retry_in = self.opened_at + self.reset_seconds - now
+            # A probe that never reported back (its caller died) doesn't block the next one forever
+            probing = self.probe_started is not None and now - self.probe_started < self.reset_seconds
+            if retry_in > 0 or probing:
+                metrics.model_circuit_rejections.inc(family=self.family)
+                raise CircuitOpenError(self.family, max(retry_in, 1))
+            self.probe_started = now
+
+    def record_success(self):
+        with self._lock:
+            self.failures = 0
+            self.opened_at = None
+            self.probe_started = None
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.probe_started is not None or (self.opened_at is None and self.failures >= self.threshold > 0):
+                if self.opened_at is None:
+                    print(f"Model circuit '{self.family}' opened after {self.failures} failures")
+                self.opened_at = time.monotonic()
+                self.probe_started = None
+
+class LatencyTracker:
+    """Recent successful attempt latencies of one operation and its hedge budget."""
+
+    def __init__(self, window: int = LATENCY_WINDOW):
+        self.samples = deque(maxlen=window)
+        self.calls = 0
+        self.hedges = 0
+        self._lock = threading.Lock()
+
+    def record(self, seconds: float):
+        with self._lock:
+            self.samples.append(seconds)
+
+    def hedge_after(self, percentile: float) -> float | None:
+        """Seconds after which this call may be hedged, None when it may not.
+
+        Counts the call towards the budget, so call it once per call.
+        """
+        with self._lock:
+            self.calls += 1
+            if percentile <= 0 or len(self.samples) < HEDGE_MIN_SAMPLES:
+                return None
+            if self.hedges >= self.calls * MODEL_HEDGE_MAX_RATIO:
+                return None
+            ordered = sorted(self.samples)
+            return ordered[min(len(ordered) - 1, int(len(ordered) * percentile / 100))]
+
+    def hedged(self):
+        with self._lock:
+            self.hedges += 1
+
+_executor = ThreadPoolExecutor(max_workers=MODEL_CALL_THREADS, thread_name_prefix="model-attempt")
+_breakers: dict[str, CircuitBreaker] = {}
+_latencies: dict[str, LatencyTracker] = {}
+_registry_lock = threading.Lock()
+
+def breaker_for(operation: str) -> CircuitBreaker:
+    family = BREAKER_FAMILIES.get(operation, "files")
+    with _registry_lock:
+        if family not in _breakers:
+            _breakers[family] = CircuitBreaker(family)
+        return _breakers[family]
+
+def _tracker_for(operation: str) -> LatencyTracker:
+    with _registry_lock:
+        if operation not in _latencies:
+            _latencies[operation] = LatencyTracker()
+        return _latencies[operation]
+
+metrics.Gauge(
+    "model_circuit_open", "1 while the model circuit of a family is open or half-open.", ("family",),
+    lambda: [({"family": family}, 0 if b.state == "closed" else 1) for family, b in list(_breakers.items())],
+)
+
+class _Attempt:
+    """One request to the provider; its clock starts once it runs and has been admitted."""
+
+    def __init__(self, func, args, kwargs, gate, reserved=None):
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs
+        self.gate = gate
+        self.reserved = reserved
+        self.started = threading.Event()
+        self.started_at = None
+
+    def run(self):
+        try:
+            if self.gate is not None and self.reserved is None:
+                self.reserved = self.gate.acquire()
+        finally:
+            self.started_at = time.monotonic()
+            self.started.set()
+        result = None
+        try:
+            result = self.func(*self.args, **self.kwargs)
+            return result
+        finally:
+            if self.gate is not None:
+                self.gate.record(self.reserved, result)
+
+def _attempt(operation: str, func, args, kwargs, timeout: float, hedge_after: float | None,
+             tracker: LatencyTracker, gate):
+    """One attempt, on a helper thread when it has a timeout or may be hedged."""
+    primary = _Attempt(func, args, kwargs, gate)
+    if not timeout and hedge_after is None:
+        result = primary.run()
+        tracker.record(time.monotonic() - primary.started_at)
+        return result
+
+    primary_future = _executor.submit(primary.run)
+    # Time spent queued for a pool thread or for quota is not the provider's, it doesn't count
+    primary.started.wait()
+    deadline = primary.started_at + timeout if timeout else None
+    pending = {primary_future}
+    hedged = False
+    if hedge_after is not None and (not timeout or hedge_after < timeout):
+        done, _ = wait(pending, timeout=max(0.0, primary.started_at + hedge_after - time.monotonic()))
+        if not done:
+            # Only with quota to spare: a hedge must not wait behind, or crowd out, first attempts
+            reserved = gate.try_acquire() if gate is not None else None
+            if gate is None or reserved is not None:
+                hedged = True
+                tracker.hedged()
+                metrics.model_hedges.inc(operation=operation, outcome="sent")
+                hedge = _executor.submit(_Attempt(func, args, kwargs, gate, reserved).run)
+                if gate is not None:
+                    # Cancelled before it ran: hand its reservation back
+                    hedge.add_done_callback(lambda f: f.cancelled() and gate.record(reserved, None))
+                pending.add(hedge)
+            else:
+                metrics.model_hedges.inc(operation=operation, outcome="no_quota")
+
+    error = None
+    while pending:
+        remaining = None if deadline is None else deadline - time.monotonic()
+        if remaining is not None and remaining <= 0:
+            break
+        done, pending = wait(pending, timeout=remaining, return_when=FIRST_COMPLETED)
+        if not done:
+            break
+        for future in done:
+            if future.exception() is None:
+                if hedged:
+                    metrics.model_hedges.inc(operation=operation, outcome="won" if future is not primary_future else "lost")
+                else:
+                    tracker.record(time.monotonic() - primary.started_at)
+                for other in pending:
+                    other.cancel()
+                return future.result()
+            error = future.exception()
+    if pending or error is None:
+        for other in pending:
+            other.cancel()
+        raise ModelCallTimeout(f"{operation} did not answer within {timeout:g}s", pending)
+    raise error
+
+def _late_result(pending: set, delay: float) -> tuple[str, object]:
+    """Waits up to `delay` for timed-out requests that are still running.
+
+    ("answered", result) when one of them answered after all, ("failed", None)
+    once they all failed (after the rest of the delay), ("running", None) otherwise.
+    """
+    give_up_at = time.monotonic() + delay
+    while pending:
+        done, pending = wait(pending, timeout=max(0.0, give_up_at - time.monotonic()), return_when=FIRST_COMPLETED)
+        if not done:
+            return "running", None
+        for future in done:
+            if not future.cancelled() and future.exception() is None:
+                return "answered", future.result()
+    time.sleep(max(0.0, give_up_at - time.monotonic()))
+    return "failed", None
+
+def call(operation: str, func, *args, **kwargs):
+    """Runs the blocking provider call `func` with the operation's retries, timeout, breaker and hedging."""
+    breaker = breaker_for(operation)
+    tracker = _tracker_for(operation)
+    gate = admission.get()
+    timeout = MODEL_TIMEOUTS.get(operation, 0)
+    attempts = 1 if operation in SINGLE_ATTEMPT else MODEL_RETRY_ATTEMPTS
+    attempt = 1
+    while True:
+        breaker.before_call()
+        hedge_after = None
+        if operation in HEDGED and breaker.state == "closed":
+            hedge_after = tracker.hedge_after(MODEL_HEDGE_PERCENTILE)
+        try:
+            result = _attempt(operation, func, args, kwargs, timeout, hedge_after, tracker, gate)
+        except Exception as e:
+            reason = classify(e)
+            if reason is None:
+                breaker.record_success()
+                raise
+            breaker.record_failure()
+            if attempt >= attempts or (operation in UNSAFE_TO_REPEAT and reason != "throttled"):
+                raise
+            delay = backoff(attempt, retry_after(e))
+            if delay is None:
+                raise
+            if isinstance(e, ModelCallTimeout) and e.pending:
+                # A retry next to a request that is still running doubles the load on a slow
+                # provider: the backoff goes to waiting for it, and it's only retried once it failed
+                state, result = _late_result(e.pending, delay)
+                if state == "running":
+                    raise
+                if state == "answered":
+                    breaker.record_success()
+                    return result
+            else:
+                time.sleep(delay)
+            metrics.model_retries.inc(operation=operation, reason=reason)
+            attempt += 1
+            continue
+        breaker.record_success()
+        return result
+
+def resilient(operation: str):
+    """Decorates a blocking provider call to go through `call`."""
+
+    def decorator(func):
+        @wraps(func)
+        def wrapper(*args, **kwargs):
+            return call(operation, func, *args, **kwargs)
+        return wrapper
+    return decorator
@@ -0,0 +1,210 @@
+import math
+import os
+import re
+import threading
+import unicodedata
+import zipfile
+from collections import Counter, OrderedDict
+from xml.etree import ElementTree
+from sqlalchemy import func
+from . import models, database
+
+try:
+    from pypdf import PdfReader
+except ImportError: # Optional: without it PDFs are left to the remote file search
+    PdfReader = None
+
+# Optional local retrieval: extract and chunk the text of uploaded files, index it
+# per contractor with BM25, and send only the best passages to the model.
+LOCAL_RETRIEVAL = os.getenv("LOCAL_RETRIEVAL", "0") == "1"
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "6"))
+RETRIEVAL_CHUNK_WORDS = int(os.getenv("RETRIEVAL_CHUNK_WORDS", "180"))
+RETRIEVAL_CHUNK_OVERLAP = int(os.getenv("RETRIEVAL_CHUNK_OVERLAP", "40"))
+# Text past this many characters per file is not indexed
+RETRIEVAL_MAX_CHARS = int(os.getenv("RETRIEVAL_MAX_CHARS", str(5_000_000)))
+RETRIEVAL_INDEX_CACHE_SIZE = int(os.getenv("RETRIEVAL_INDEX_CACHE_SIZE", "32"))
+BM25_K1 = 1.5
+BM25_B = 0.75
+
+_WORD = re.compile(r"\w+")
+_DOCX_NS = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+TEXT_EXTENSIONS = (".txt", ".md", ".csv")
+
+def tokenize(text: str) -> list[str]:
+    text = unicodedata.normalize("NFC", text).lower()
+    return [t for t in _WORD.findall(text) if len(t) > 1 or t.isdigit()]
+
+def _pdf_pages(fileobj) -> list[tuple[int | None, str]]:
+    reader = PdfReader(fileobj)
+    return [(number, page.extract_text() or "") for number, page in enumerate(reader.pages, start=1)]
+
+def _docx_pages(fileobj) -> list[tuple[int | None, str]]:
+    paragraphs = []
+    with zipfile.ZipFile(fileobj) as archive, archive.open("word/document.xml") as xml:
+        # iterparse keeps memory flat on long documents
+        for _, element in ElementTree.iterparse(xml):
+            if element.tag == f"{_DOCX_NS}p":
+                text = "".join(node.text or "" for node in element.iter(f"{_DOCX_NS}t"))
+                if text.strip():
+                    paragraphs.append(text)
+                element.clear()
+    return [(None, "\n".join(paragraphs))]
+
+def extract_text(fileobj, filename: str, content_type: str | None = None) -> list[tuple[int | None, str]] | None:
+    """Returns (page, text) pairs, or None when the format isn't supported here."""
+    extension = os.path.splitext(filename)[1].lower()
+    fileobj.seek(0)
+    try:
+        if extension == ".pdf" or content_type == "application/pdf":
+            return _pdf_pages(fileobj) if PdfReader else None
+        if extension == ".docx":
+            return _docx_pages(fileobj)
+        if extension in TEXT_EXTENSIONS or (content_type or "").startswith("text/"):
+            return [(None, fileobj.read(RETRIEVAL_MAX_CHARS).decode("utf-8", errors="replace"))]
+        return None
+    finally:
+        fileobj.seek(0)
+
+def chunk_pages(pages: list[tuple[int | None, str]]) -> list[tuple[int | None, str]]:
+    """Splits page texts into overlapping windows of RETRIEVAL_CHUNK_WORDS words."""
+    chunks, budget = [], RETRIEVAL_MAX_CHARS
+    step = max(1, RETRIEVAL_CHUNK_WORDS - RETRIEVAL_CHUNK_OVERLAP)
+    for page, text in pages:
+        text = text[:budget]
+        budget -= len(text)
+        words = text.split()
+        for start in range(0, len(words), step):
+            window = words[start:start + RETRIEVAL_CHUNK_WORDS]
+            chunks.append((page, " ".join(window)))
+            if start + RETRIEVAL_CHUNK_WORDS >= len(words):
+                break
+        if budget <= 0:
+            break
+    return chunks
+
+def index_file(contractor_id: int, file_id: int, fileobj, filename: str, content_type: str | None = None) -> int:
+    """Extracts, chunks and stores a file's passages; returns how many were stored."""
+    pages = extract_text(fileobj, filename, content_type)
+    if not pages:
+        return 0
+    chunks = chunk_pages(pages)
+    db = database.SessionLocal()
+    try:
+        db.query(models.DocumentChunk).filter(models.DocumentChunk.file_id == file_id).delete(synchronize_session=False)
+        db.add_all([
+            models.DocumentChunk(contractor_id=contractor_id, file_id=file_id, position=i, page=page, text=text)
+            for i, (page, text) in enumerate(chunks)
+        ])
+        db.commit()
+    finally:
+        db.close()
+    return len(chunks)
+
+class BM25Index:
+    """Okapi BM25 over one contractor's chunks, held in memory."""
+
+    def __init__(self, chunks: list[dict]):
+        self.chunks = chunks
+        self.postings: dict[str, list[tuple[int, int]]] = {}
+        self.lengths = []
+        for i, chunk in enumerate(chunks):
+            terms = Counter(tokenize(chunk["text"]))
+            self.lengths.append(sum(terms.values()))
+            for term, tf in terms.items():
+                self.postings.setdefault(term, []).append((i, tf))
+        self.average_length = (sum(self.lengths) / len(self.lengths)) if self.lengths else 0.0
+
+    def search(self, query: str, k: int) -> list[dict]:
+        n = len(self.chunks)
+        scores: dict[int, float] = {}
+        for term in set(tokenize(query)):
+            postings = self.postings.get(term)
+            if not postings:
+                continue
+            idf = math.log(1 + (n - len(postings) + 0.5) / (len(postings) + 0.5))
+            for i, tf in postings:
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.lengths[i] / (self.average_length or 1))
+                scores[i] = scores.get(i, 0.0) + idf * tf * (BM25_K1 + 1) / (tf + norm)
+        best = sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+        return [{**self.chunks[i], "score": round(score, 4)} for i, score in best]
+
+_indexes: OrderedDict[int, tuple[tuple, BM25Index]] = OrderedDict()
+_indexes_lock = threading.Lock()
+
+def _load_index(contractor_id: int) -> BM25Index | None:
+    db = database.SessionLocal()
+    try:
+        # Cheap version check so an index is rebuilt only when the contractor's chunks changed
+        version = tuple(db.query(func.count(models.DocumentChunk.id), func.max(models.DocumentChunk.id)).filter(
+            models.DocumentChunk.contractor_id == contractor_id
+        ).one())
+        if not version[0]:
+            return None
+        with _indexes_lock:
+            cached = _indexes.get(contractor_id)
+            if cached and cached[0] == version:
+                _indexes.move_to_end(contractor_id)
+                return cached[1]
+
+        rows = db.query(
+            models.DocumentChunk.id, models.DocumentChunk.page, models.DocumentChunk.text,
+            models.ContractorFile.filename,
+        ).join(models.ContractorFile, models.ContractorFile.id == models.DocumentChunk.file_id).filter(
+            models.DocumentChunk.contractor_id == contractor_id
+        ).order_by(models.DocumentChunk.file_id, models.DocumentChunk.position).all()
+    finally:
+        db.close()
+
+    index = BM25Index([
+        {"chunk_id": chunk_id, "page": page, "text": text, "filename": filename}
+        for chunk_id, page, text, filename in rows
+    ])
+    with _indexes_lock:
+        _indexes[contractor_id] = (version, index)
+        _indexes.move_to_end(contractor_id)
+        while len(_indexes) > RETRIEVAL_INDEX_CACHE_SIZE:
+            _indexes.popitem(last=False)
+    return index
+
+def search(contractor_id: int, query: str, k: int = RETRIEVAL_TOP_K) -> list[dict]:
+    """Top-k passages for `query`, or [] when the contractor has nothing indexed."""
+    index = _load_index(contractor_id)
+    return index.search(query, k) if index else []
+
+def covers_contractor(contractor_id: int) -> bool:
+    """True when every remote file of the contractor has local passages.
+
+    A file ingested before LOCAL_RETRIEVAL was enabled, or in a format that
+    can't be read here, makes the contractor fall back to the remote store.
+    """
+    db = database.SessionLocal()
+    try:
+        indexed = db.query(models.DocumentChunk.id).filter(
+            models.DocumentChunk.file_id == models.ContractorFile.id
+        ).exists()
+        files, unindexed = db.query(
+            func.count(models.ContractorFile.id),
+            func.count(models.ContractorFile.id).filter(~indexed),
+        ).filter(
+            models.ContractorFile.contractor_id == contractor_id,
+            models.ContractorFile.gemini_file_name.isnot(None)
+        ).one()
+        return files > 0 and unindexed == 0
+    finally:
+        db.close()
+
+def passage_label(passage: dict) -> str:
+    label = passage["filename"]
+    if passage.get("page"):
+        label += f", tr. {passage['page']}"
+    return label
+
+def evidence_for(passages: list[dict], max_chars: int = 300) -> str:
+    """Readable evidence: where each passage came from and how it starts."""
+    return "\n".join(
+        f"[{i}] {passage_label(p)}: {p['text'][:max_chars]}" for i, p in enumerate(passages, start=1)
+    )
+
+def forget_contractor(contractor_id: int):
+    with _indexes_lock:
+        _indexes.pop(contractor_id, None)
@@ -0,0 +1,130 @@
+from collections import defaultdict
+from datetime import date, datetime
+from sqlalchemy import func, select, case, exists, and_
+from sqlalchemy.dialects.postgresql import insert
+from sqlalchemy.orm import aliased
+from . import models
+
+COUNTERS = (
+    "files", "file_bytes", "storage_bytes",
+    "evaluations", "cached_evaluations", "input_tokens", "output_tokens",
+)
+
+def estimate_cost(input_tokens: int, output_tokens: int, storage_bytes: int) -> float:
+    # Cost estimation (Gemini 1.5 Flash rates)
+    # Input: $0.075 / 1M tokens (for < 128k context, assuming short context for now)
+    # Output: $0.30 / 1M tokens
+    # Storage: $0.10 per GB/month (approx)
+    cost_input = (input_tokens / 1_000_000) * 0.075
+    cost_output = (output_tokens / 1_000_000) * 0.30
+    cost_storage = (storage_bytes / (1024 ** 3)) * 0.10 # Very rough estimate per month
+    return cost_input + cost_output + cost_storage
+
+def record(db, contractor_id: int, day: date | None = None, **deltas):
+    """Adds `deltas` to the contractor's rollup row for `day` (today by default).
+
+    Runs as a single upsert inside the caller's transaction, so the rollup
+    commits or rolls back together with the rows it describes.
+    """
+    deltas = {k: v for k, v in deltas.items() if v}
+    if not deltas:
+        return
+    unknown = set(deltas) - set(COUNTERS)
+    if unknown:
+        raise ValueError(f"Unknown rollup counters: {', '.join(sorted(unknown))}")
+
+    package_id = select(models.Contractor.bid_package_id).where(
+        models.Contractor.id == contractor_id
+    ).scalar_subquery()
+    stmt = insert(models.UsageRollup).values(
+        day=day or datetime.utcnow().date(),
+        contractor_id=contractor_id,
+        bid_package_id=package_id,
+        **deltas
+    )
+    stmt = stmt.on_conflict_do_update(
+        constraint="uq_usage_rollups_day_contractor",
+        set_={k: getattr(models.UsageRollup, k) + stmt.excluded[k] for k in deltas}
+    )
+    db.execute(stmt)
+
+def rebuild(db):
+    """Recomputes every rollup row from the base tables with grouped queries.
+
+    Used to backfill the table; the caller commits. Usage of deleted
+    contractors is no longer in the base tables and stays as recorded;
+    usage of deleted results can't be recomputed and drops out, so a
+    rebuild (POST /reports/rollups/rebuild) may lower the totals.
+    """
+    rows = defaultdict(lambda: dict.fromkeys(COUNTERS, 0))
+    packages = {}
+
+    EvaluationResult = models.EvaluationResult
+    eval_day = func.date(EvaluationResult.created_at)
+    evaluations = (
+        db.query(
+            eval_day,
+            EvaluationResult.contractor_id,
+            func.count(EvaluationResult.id),
+            func.sum(case((EvaluationResult.cached.is_(True), 1), else_=0)),
+            func.coalesce(func.sum(EvaluationResult.input_tokens), 0),
+            func.coalesce(func.sum(EvaluationResult.output_tokens), 0),
+        )
+        .group_by(eval_day, EvaluationResult.contractor_id)
+    )
+    for day, contractor_id, count, cached, input_tokens, output_tokens in evaluations:
+        row = rows[(day, contractor_id)]
+        row.update(evaluations=count, cached_evaluations=cached or 0,
+                   input_tokens=input_tokens, output_tokens=output_tokens)
+
+    ContractorFile = models.ContractorFile
+    earlier = aliased(ContractorFile)
+    # A file only adds storage if no earlier file has the same content
+    is_first_copy = ~exists().where(and_(
+        earlier.content_hash == ContractorFile.content_hash,
+        earlier.id < ContractorFile.id,
+    ))
+    file_day = func.date(ContractorFile.created_at)
+    files = (
+        db.query(
+            file_day,
+            ContractorFile.contractor_id,
+            func.count(ContractorFile.id),
+            func.coalesce(func.sum(ContractorFile.file_size), 0),
+            func.coalesce(func.sum(case((is_first_copy, ContractorFile.file_size), else_=0)), 0),
+        )
+        .group_by(file_day, ContractorFile.contractor_id)
+    )
+    for day, contractor_id, count, file_bytes, storage_bytes in files:
+        rows[(day, contractor_id)].update(files=count, file_bytes=file_bytes, storage_bytes=storage_bytes)
+
+    for contractor_id, package_id in db.query(models.Contractor.id, models.Contractor.bid_package_id):
+        packages[contractor_id] = package_id
+
+    # Rows of deleted contractors (contractor_id NULL) can't be recomputed, they are kept as they are
+    db.query(models.UsageRollup).filter(models.UsageRollup.contractor_id.isnot(None)).delete(synchronize_session=False)
+    db.add_all([
+        models.UsageRollup(day=day, contractor_id=contractor_id, bid_package_id=packages.get(contractor_id), **counters)
+        for (day, contractor_id), counters in rows.items()
+        if contractor_id in packages
+    ])
+    return len(rows)
+
+def totals(db, date_from: date | None = None, date_to: date | None = None,
+           bid_package_id: int | None = None, group_by_package: bool = False):
+    """Sums rollup counters over a date range, optionally per bid package."""
+    columns = [func.coalesce(func.sum(getattr(models.UsageRollup, k)), 0).label(k) for k in COUNTERS]
+    query = db.query(*columns)
+    if group_by_package:
+        query = db.query(models.UsageRollup.bid_package_id, *columns).group_by(models.UsageRollup.bid_package_id)
+    if date_from:
+        query = query.filter(models.UsageRollup.day >= date_from)
+    if date_to:
+        query = query.filter(models.UsageRollup.day <= date_to)
+    if bid_package_id is not None:
+        query = query.filter(models.UsageRollup.bid_package_id == bid_package_id)
+
+    if group_by_package:
+        return {row[0]: {k: int(row[i + 1]) for i, k in enumerate(COUNTERS)} for row in query}
+    row = query.one()
+    return {k: int(row[i]) for i, k in enumerate(COUNTERS)}
@@ -0,0 +1,114 @@
+"""Startup time of a backend worker.
+
+Each run starts a fresh interpreter, so nothing is shared between runs:
+
+    python -m backend.startup_benchmark --runs 10 --json startup.json
+
+Measured per run:
+  import          importing backend.main, timed inside the child process
+  first-response  spawning uvicorn until GET / answers 200
+  ready           spawning uvicorn until GET /ready answers 200 (database bootstrapped)
+
+"ready" needs a reachable database; without one (--no-ready) only the first
+two are measured, which is what a liveness check sees. --baseline and
+--max-regression work like in backend.benchmark.
+"""
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from .benchmark import summarize, print_report, compare
+
+IMPORT_SNIPPET = "import time; t = time.perf_counter(); import backend.main; print(time.perf_counter() - t)"
+POLL_SECONDS = 0.02
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+def _answers(url: str) -> bool:
+    try:
+        with urllib.request.urlopen(url, timeout=1) as response:
+            return response.status == 200
+    except (urllib.error.URLError, ConnectionError, TimeoutError):
+        return False
+
+def measure_import(env: dict) -> float:
+    output = subprocess.run(
+        [sys.executable, "-c", IMPORT_SNIPPET], env=env, check=True, capture_output=True, text=True
+    ).stdout
+    return float(output.strip().splitlines()[-1])
+
+def measure_server(env: dict, ready: bool, timeout: float) -> dict:
+    port = _free_port()
+    base_url = f"http://127.0.0.1:{port}"
+    started = time.perf_counter()
+    server = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "backend.main:app", "--port", str(port), "--log-level", "warning"],
+        env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    try:
+        timings = {}
+        targets = [("first-response", "/")] + ([("ready", "/ready")] if ready else [])
+        for name, path in targets:
+            while not _answers(base_url + path):
+                if server.poll() is not None:
+                    raise RuntimeError(f"uvicorn exited with status {server.returncode}")
+                if time.perf_counter() - started > timeout:
+                    raise TimeoutError(f"{path} did not answer within {timeout}s")
+                time.sleep(POLL_SECONDS)
+            timings[name] = time.perf_counter() - started
+        return timings
+    finally:
+        server.terminate()
+        server.wait()
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Measure import and time-to-first-response of a worker.")
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--no-ready", action="store_true", help="Don't wait for /ready (no database available)")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Per run, in seconds")
+    parser.add_argument("--json", help="Write the report rows to this file")
+    parser.add_argument("--baseline", help="Earlier --json output to compare against")
+    parser.add_argument("--max-regression", type=float, default=0.10)
+    args = parser.parse_args(argv)
+
+    # The fake provider keeps a missing API key from mattering, as it would for a real worker
+    env = {**os.environ, "MODEL_PROVIDER": os.getenv("MODEL_PROVIDER", "fake")}
+    measurements: dict[str, list[float]] = {}
+    errors: list[str] = []
+    started = time.perf_counter()
+    for _ in range(args.runs):
+        try:
+            measurements.setdefault("import", []).append(measure_import(env))
+            for name, value in measure_server(env, not args.no_ready, args.timeout).items():
+                measurements.setdefault(name, []).append(value)
+        except Exception as e:
+            errors.append(str(e))
+    elapsed = time.perf_counter() - started
+
+    rows = [summarize(name, values, errors, elapsed) for name, values in measurements.items()]
+    if not rows:
+        rows = [summarize("import", [], errors, elapsed)]
+    print_report(rows)
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump({"args": vars(args), "rows": rows}, f, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            regressions = compare(rows, json.load(f)["rows"], args.max_regression)
+        for regression in regressions:
+            print(f"REGRESSION {regression}", file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,68 @@
+import asyncio
+import json
+import os
+from .jobs import EvaluationJob, STATUS_COMPLETED
+
+# Sent while nothing finishes so proxies and clients don't drop an idle stream
+EVAL_STREAM_HEARTBEAT_SECONDS = float(os.getenv("EVAL_STREAM_HEARTBEAT_SECONDS", "15"))
+
+FORMAT_SSE = "sse"
+FORMAT_NDJSON = "ndjson"
+MEDIA_TYPES = {FORMAT_SSE: "text/event-stream", FORMAT_NDJSON: "application/x-ndjson"}
+STREAM_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+RESULT_FIELDS = (
+    "index", "prompt", "status", "score", "comment", "evidence", "result", "error",
+    "cached", "input_tokens", "output_tokens", "duration_ms", "result_id",
+)
+
+def frame(fmt: str, event: str, data: dict, seq: int | None = None) -> str:
+    """One SSE event (`id` = seq) or one NDJSON line (`type` and `seq` fields)."""
+    if fmt == FORMAT_SSE:
+        lines = [] if seq is None else [f"id: {seq}"]
+        lines += [f"event: {event}", "data: " + json.dumps(data, ensure_ascii=False, default=str)]
+        return "\n".join(lines) + "\n\n"
+    line = {"type": event, **({} if seq is None else {"seq": seq}), **data}
+    return json.dumps(line, ensure_ascii=False, default=str) + "\n"
+
+def summary(job: EvaluationJob) -> dict:
+    completed = [r for r in job.results if r["status"] == STATUS_COMPLETED]
+    scores = [r["score"] for r in completed if r.get("score") is not None]
+    duration_ms = None
+    if job.started_at and job.finished_at:
+        duration_ms = int((job.finished_at - job.started_at).total_seconds() * 1000)
+    return {
+        "job_id": job.id,
+        "status": job.status,
+        "error": job.error,
+        "progress": job.progress(),
+        "average_score": round(sum(scores) / len(scores), 2) if scores else None,
+        "input_tokens": sum(r.get("input_tokens") or 0 for r in completed),
+        "output_tokens": sum(r.get("output_tokens") or 0 for r in completed),
+        "duration_ms": duration_ms,
+    }
+
+async def job_events(job: EvaluationJob, fmt: str, after: int = -1):
+    """Streams a job: a `job` frame, one `result` frame per finished criterion, then `summary`.
+
+    Results are read from the job as they finish (they are already saved by
+    then), nothing is buffered per stream. `after` is the last seq a
+    reconnecting client received; earlier results are not sent again.
+    """
+    yield frame(fmt, "job", {
+        "job_id": job.id, "contractor_id": job.contractor_id, "total": len(job.results), "status": job.status,
+    })
+    sent = after + 1
+    while True:
+        changed = job.changed()
+        while sent < len(job.finished_order):
+            entry = job.results[job.finished_order[sent]]
+            yield frame(fmt, "result", {key: entry.get(key) for key in RESULT_FIELDS}, seq=sent)
+            sent += 1
+        if not job.is_active:
+            yield frame(fmt, "summary", summary(job))
+            return
+        try:
+            await asyncio.wait_for(changed.wait(), EVAL_STREAM_HEARTBEAT_SECONDS)
+        except asyncio.TimeoutError:
+            yield frame(fmt, "heartbeat", {"progress": job.progress()})
@@ -0,0 +1,260 @@
+import contextlib
+import fcntl
+import hashlib
+import json
+import os
+import shutil
+import time
+import uuid
+
+# Resumable chunked uploads.
+#
+# Each session is a directory under UPLOAD_SESSION_DIR holding:
+#   meta.json   what was announced at creation (never rewritten)
+#   data.part   the file, preallocated (sparse) to its final size
+#   chunks/     one marker per verified chunk, named after its offset, and
+#               the temporary files of chunks still being received
+#   lock        flock'ed while a verified chunk is copied in or the session
+#               is claimed for finalizing
+# A chunk is received into its own temporary file and only copied to its
+# offset in data.part once its length and checksum matched, under the session
+# lock and only if the session isn't being finalized. A rejected resend never
+# touches data.part, and finalizing never sees bytes change under it. Nothing
+# is held in memory beyond one read buffer, and the finished data.part is the
+# assembled file.
+
+UPLOAD_SESSION_DIR = os.getenv("UPLOAD_SESSION_DIR", os.path.join("uploads", "sessions"))
+UPLOAD_CHUNK_SIZE = int(os.getenv("UPLOAD_CHUNK_SIZE", str(8 * 1024 * 1024)))
+UPLOAD_MAX_CHUNK_SIZE = int(os.getenv("UPLOAD_MAX_CHUNK_SIZE", str(64 * 1024 * 1024)))
+UPLOAD_MAX_FILE_SIZE = int(os.getenv("UPLOAD_MAX_FILE_SIZE", str(2 * 1024 * 1024 * 1024)))
+# Abandoned sessions are removed after this long
+UPLOAD_SESSION_TTL_SECONDS = int(os.getenv("UPLOAD_SESSION_TTL_SECONDS", str(24 * 3600)))
+# Received bytes are written to disk in blocks of at most this size
+UPLOAD_WRITE_BUFFER = 1024 * 1024
+
+class UploadError(Exception):
+    """A request the session can't accept; `status_code` is the HTTP status to answer with."""
+
+    def __init__(self, status_code: int, message: str):
+        super().__init__(message)
+        self.status_code = status_code
+
+class UploadSession:
+    def __init__(self, meta: dict):
+        self.meta = meta
+        self.id = meta["upload_id"]
+        self.dir = _session_dir(self.id)
+        self.data_path = os.path.join(self.dir, "data.part")
+        self.chunks_dir = os.path.join(self.dir, "chunks")
+
+    @property
+    def size(self) -> int:
+        return self.meta["size"]
+
+    @property
+    def chunk_size(self) -> int:
+        return self.meta["chunk_size"]
+
+    def offsets(self) -> list[int]:
+        return list(range(0, self.size, self.chunk_size)) or [0]
+
+    @contextlib.contextmanager
+    def lock(self):
+        """Exclusive across threads and worker processes sharing UPLOAD_SESSION_DIR. Blocking."""
+        with open(os.path.join(self.dir, "lock"), "a") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def is_finalizing(self) -> bool:
+        return os.path.exists(os.path.join(self.dir, "finalizing"))
+
+    def chunk_length(self, offset: int) -> int:
+        return min(self.chunk_size, self.size - offset)
+
+    def received(self) -> set[int]:
+        return {int(name) for name in os.listdir(self.chunks_dir) if name.isdigit()}
+
+    def missing(self) -> list[int]:
+        received = self.received()
+        return [offset for offset in self.offsets() if offset not in received]
+
+    def status(self) -> dict:
+        received = self.received()
+        missing = [offset for offset in self.offsets() if offset not in received]
+        return {
+            "upload_id": self.id,
+            "contractor_id": self.meta["contractor_id"],
+            "filename": self.meta["filename"],
+            "size": self.size,
+            "chunk_size": self.chunk_size,
+            "received_bytes": sum(self.chunk_length(offset) for offset in received if offset < self.size),
+            "missing_offsets": missing,
+            "complete": not missing,
+            "expires_at": self.meta["created_at"] + UPLOAD_SESSION_TTL_SECONDS,
+        }
+
+def _session_dir(upload_id: str) -> str:
+    return os.path.join(UPLOAD_SESSION_DIR, upload_id)
+
+def prune_expired():
+    """Removes sessions older than UPLOAD_SESSION_TTL_SECONDS."""
+    if not os.path.isdir(UPLOAD_SESSION_DIR):
+        return
+    cutoff = time.time() - UPLOAD_SESSION_TTL_SECONDS
+    for name in os.listdir(UPLOAD_SESSION_DIR):
+        path = os.path.join(UPLOAD_SESSION_DIR, name)
+        try:
+            if os.path.getmtime(os.path.join(path, "meta.json")) < cutoff:
+                shutil.rmtree(path, ignore_errors=True)
+        except OSError:
+            continue
+
+def create_session(contractor_id: int, filename: str, size: int, content_type: str | None = None,
+                   chunk_size: int | None = None, sha256: str | None = None) -> UploadSession:
+    if size < 0 or size > UPLOAD_MAX_FILE_SIZE:
+        raise UploadError(413, f"File size must be between 0 and {UPLOAD_MAX_FILE_SIZE} bytes")
+    chunk_size = chunk_size or UPLOAD_CHUNK_SIZE
+    if not 0 < chunk_size <= UPLOAD_MAX_CHUNK_SIZE:
+        raise UploadError(400, f"Chunk size must be between 1 and {UPLOAD_MAX_CHUNK_SIZE} bytes")
+    prune_expired()
+
+    meta = {
+        "upload_id": uuid.uuid4().hex,
+        "contractor_id": contractor_id,
+        # Only the base name is kept, the client's path never reaches the filesystem
+        "filename": os.path.basename(filename) or "upload",
+        "content_type": content_type,
+        "size": size,
+        "chunk_size": chunk_size,
+        "sha256": sha256.lower() if sha256 else None,
+        "created_at": int(time.time()),
+    }
+    session = UploadSession(meta)
+    os.makedirs(session.chunks_dir)
+    with open(session.data_path, "wb") as f:
+        f.truncate(size)
+    with open(os.path.join(session.dir, "meta.json"), "w") as f:
+        json.dump(meta, f)
+    return session
+
+def get_session(upload_id: str) -> UploadSession:
+    if not upload_id.isalnum():
+        raise UploadError(404, "Upload session not found")
+    try:
+        with open(os.path.join(_session_dir(upload_id), "meta.json")) as f:
+            return UploadSession(json.load(f))
+    except FileNotFoundError:
+        raise UploadError(404, "Upload session not found")
+
+def delete_session(session: UploadSession):
+    shutil.rmtree(session.dir, ignore_errors=True)
+
+def check_chunk(session: UploadSession, offset: int, sha256: str | None):
+    """Validates a chunk's position before any of its bytes are read. Blocking.
+
+    Only spares receiving a chunk that would be refused anyway: commit checks
+    the finalizing claim again under the session lock.
+    """
+    if offset < 0 or offset >= max(session.size, 1) or offset % session.chunk_size:
+        raise UploadError(400, f"Offset must be a multiple of {session.chunk_size} below {session.size}")
+    if not sha256:
+        raise UploadError(400, "X-Chunk-SHA256 header is required")
+    if session.is_finalizing():
+        raise UploadError(409, "Upload is being finalized")
+
+class ChunkWriter:
+    """Receives one chunk into a temporary file while hashing it.
+
+    The caller feeds the request body through `write` (blocking, run it in a
+    thread) and calls `commit` at the end, which only copies the chunk into
+    data.part and records it if the length and checksum match.
+    """
+
+    def __init__(self, session: UploadSession, offset: int, sha256: str):
+        self.session = session
+        self.offset = offset
+        self.expected_length = session.chunk_length(offset)
+        self.expected_sha256 = sha256.lower()
+        self.written = 0
+        self._hash = hashlib.sha256()
+        self._marker = os.path.join(session.chunks_dir, str(offset))
+        self._tmp_path = f"{self._marker}.{uuid.uuid4().hex}.chunk"
+        self._tmp = open(self._tmp_path, "w+b")
+
+    def write(self, data: bytes):
+        if self.written + len(data) > self.expected_length:
+            raise UploadError(400, f"Chunk at offset {self.offset} must be {self.expected_length} bytes")
+        self._hash.update(data)
+        self._tmp.write(data)
+        self.written += len(data)
+
+    def commit(self) -> dict:
+        if self.written != self.expected_length:
+            raise UploadError(400, f"Chunk at offset {self.offset} must be {self.expected_length} bytes")
+        digest = self._hash.hexdigest()
+        if digest != self.expected_sha256:
+            raise UploadError(422, f"Checksum mismatch for chunk at offset {self.offset}")
+        with self.session.lock():
+            if self.session.is_finalizing():
+                raise UploadError(409, "Upload is being finalized")
+            # Counts as missing while its bytes are being replaced, in case we die halfway
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(self._marker)
+            self._copy_into_data()
+            tmp = f"{self._marker}.{uuid.uuid4().hex}.tmp"
+            with open(tmp, "w") as f:
+                f.write(digest)
+            os.replace(tmp, self._marker)
+        return {"offset": self.offset, "length": self.written, "sha256": digest}
+
+    def _copy_into_data(self):
+        self._tmp.seek(0)
+        fd = os.open(self.session.data_path, os.O_WRONLY)
+        try:
+            position = self.offset
+            for block in iter(lambda: self._tmp.read(UPLOAD_WRITE_BUFFER), b""):
+                os.pwrite(fd, block, position)
+                position += len(block)
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def close(self):
+        self._tmp.close()
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(self._tmp_path)
+
+def begin_finalize(session: UploadSession):
+    """Checks every chunk arrived and claims the session so it is finalized once. Blocking."""
+    # Under the session lock, so no chunk is being copied in: from here on every commit is refused
+    with session.lock():
+        try:
+            os.mkdir(os.path.join(session.dir, "finalizing"))
+        except FileExistsError:
+            raise UploadError(409, "Upload is already being finalized")
+        missing = session.missing()
+    if missing:
+        abort_finalize(session)
+        raise UploadError(409, f"{len(missing)} chunk(s) missing, first at offset {missing[0]}")
+
+def abort_finalize(session: UploadSession):
+    """Releases the claim after a failed finalize so it can be retried."""
+    try:
+        os.rmdir(os.path.join(session.dir, "finalizing"))
+    except OSError:
+        pass
+
+class AssembledFile:
+    """The finished data.part, shaped like the UploadFile objects ingestion expects."""
+
+    def __init__(self, session: UploadSession):
+        self.filename = session.meta["filename"]
+        self.content_type = session.meta["content_type"] or "application/octet-stream"
+        self.size = session.size
+        self.file = open(session.data_path, "rb")
+
+    def close(self):
+        self.file.close()
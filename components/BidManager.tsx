@@ -9,6 +9,7 @@ import {
   ContractorFile,
 } from "../services/api";
 import Spinner from "./Spinner";
+import LoadMoreButton from "./LoadMoreButton";
 
 const MarkdownRenderer: React.FC<{ content: string }> = ({ content }) => {
   // Simple markdown parser for bold (**text**) and headers (### text)
@@ -57,6 +58,11 @@ const BidManager: React.FC = () => {
 
   const [packages, setPackages] = useState<BidPackage[]>([]);
   const [contractors, setContractors] = useState<Contractor[]>([]);
+  // Next-page cursors, null once a list is fully loaded
+  const [packagesCursor, setPackagesCursor] = useState<string | null>(null);
+  const [contractorsCursor, setContractorsCursor] = useState<string | null>(null);
+  const [historyCursor, setHistoryCursor] = useState<string | null>(null);
+  const [filesCursor, setFilesCursor] = useState<string | null>(null);
   const [loading, setLoading] = useState(false);
 
   // Form states
@@ -90,8 +96,9 @@ const BidManager: React.FC = () => {
   const loadPackages = async () => {
     setLoading(true);
     try {
-      const data = await api.getBidPackages();
-      setPackages(data);
+      const page = await api.getBidPackages();
+      setPackages(page.items);
+      setPackagesCursor(page.nextCursor);
     } catch (e) {
       console.error(e);
     } finally {
@@ -126,14 +133,32 @@ const BidManager: React.FC = () => {
     setLoading(false);
   };
 
+  const loadMorePackages = async (cursor: string) => {
+    const page = await api.getBidPackages(cursor);
+    setPackages(prev => [...prev, ...page.items]);
+    setPackagesCursor(page.nextCursor);
+  };
+
+  const loadContractors = async (packageId: number) => {
+    const page = await api.getContractors(packageId);
+    setContractors(page.items);
+    setContractorsCursor(page.nextCursor);
+  };
+
+  const loadMoreContractors = async (cursor: string) => {
+    if (!selectedPackage) return;
+    const page = await api.getContractors(selectedPackage.id, cursor);
+    setContractors(prev => [...prev, ...page.items]);
+    setContractorsCursor(page.nextCursor);
+  };
+
   const handleUpdateContractor = async () => {
     if (!editingContractor || !editName || !selectedPackage) return;
     setLoading(true);
     await api.updateContractor(editingContractor.id, editName);
     setEditingContractor(null);
     setEditName("");
-    const data = await api.getContractors(selectedPackage.id);
-    setContractors(data);
+    await loadContractors(selectedPackage.id);
     setLoading(false);
   };
 
@@ -141,16 +166,14 @@ const BidManager: React.FC = () => {
     if (!confirm("Bạn có chắc chắn muốn xóa nhà thầu này? Dữ liệu RAG liên quan sẽ bị xóa vĩnh viễn.") || !selectedPackage) return;
     setLoading(true);
     await api.deleteContractor(id);
-    const data = await api.getContractors(selectedPackage.id);
-    setContractors(data);
+    await loadContractors(selectedPackage.id);
     setLoading(false);
   };
 
   const handleSelectPackage = async (pkg: BidPackage) => {
     setSelectedPackage(pkg);
     setLoading(true);
-    const data = await api.getContractors(pkg.id);
-    setContractors(data);
+    await loadContractors(pkg.id);
     setView("contractors");
     setLoading(false);
   };
@@ -160,8 +183,7 @@ const BidManager: React.FC = () => {
     setLoading(true);
     await api.createContractor(newContractorName, selectedPackage.id);
     setNewContractorName("");
-    const data = await api.getContractors(selectedPackage.id);
-    setContractors(data);
+    await loadContractors(selectedPackage.id);
     setLoading(false);
   };
 
@@ -174,20 +196,40 @@ const BidManager: React.FC = () => {
   };
 
   const loadHistory = async (id: number) => {
-    const res = await api.getEvaluations(id);
-    setHistoryResults(res);
+    const page = await api.getEvaluations(id);
+    setHistoryResults(page.items);
+    setHistoryCursor(page.nextCursor);
+  };
+
+  const loadMoreHistory = async (cursor: string) => {
+    if (!selectedContractor) return;
+    const page = await api.getEvaluations(selectedContractor.id, cursor);
+    setHistoryResults(prev => [...prev, ...page.items]);
+    setHistoryCursor(page.nextCursor);
   };
 
   const loadFiles = async (id: number) => {
-    const res = await api.getContractorFiles(id);
-    setProcessedFiles(res);
+    const page = await api.getContractorFiles(id);
+    setProcessedFiles(page.items);
+    setFilesCursor(page.nextCursor);
+  };
+
+  const loadMoreFiles = async (cursor: string) => {
+    if (!selectedContractor) return;
+    const page = await api.getContractorFiles(selectedContractor.id, cursor);
+    setProcessedFiles(prev => [...prev, ...page.items]);
+    setFilesCursor(page.nextCursor);
   };
 
   const handleProcessFiles = async () => {
     if (!selectedContractor || files.length === 0) return;
     setLoading(true);
     try {
-        await api.processContractorFiles(selectedContractor.id, files);
+        const res = await api.processContractorFiles(selectedContractor.id, files);
+        if (res.status === "partial") {
+            const failed = res.files.filter((f) => f.status === "failed");
+            alert("Một số tệp xử lý thất bại:\n" + failed.map((f) => `${f.filename}: ${f.error}`).join("\n"));
+        }
         setFiles([]); // Clear selected files
         await loadFiles(selectedContractor.id); // Reload processed files
         setEvalStep("prompts"); // Move to prompts step
@@ -204,11 +246,15 @@ const BidManager: React.FC = () => {
     setEvalResults([]);
     try {
       const promptList = prompts.split("\n").filter((p) => p.trim());
-      const res = await api.evaluateContractor(
+      // Show each criterion as soon as it is scored instead of waiting for the whole run
+      await api.evaluateContractorStream(
         selectedContractor.id,
-        promptList
+        promptList,
+        (result) => {
+          setLoading(false);
+          setEvalResults((prev) => [...prev, result].sort((a, b) => a.index - b.index));
+        }
       );
-      setEvalResults(res.results);
       loadHistory(selectedContractor.id);
     } catch (e) {
       alert("Đánh giá thất bại: " + e);
@@ -275,6 +321,7 @@ const BidManager: React.FC = () => {
               <p className="text-sm text-gray-400">Bắt đầu bằng cách tạo gói thầu mới ở trên</p>
             </div>
           ) : (
+            <>
             <div className="grid grid-cols-1 md:grid-cols-2 lg:grid-cols-3 gap-6">
               {packages.filter(p => p.name.toLowerCase().includes(packageSearch.toLowerCase())).map((pkg) => (
                 <div
@@ -332,6 +379,8 @@ const BidManager: React.FC = () => {
                 </div>
               ))}
             </div>
+            <LoadMoreButton cursor={packagesCursor} onLoadMore={loadMorePackages} />
+            </>
           )}
         </div>
       )}
@@ -397,6 +446,7 @@ const BidManager: React.FC = () => {
               <p className="text-sm text-gray-400">Thêm nhà thầu tham gia gói thầu này</p>
             </div>
           ) : (
+            <>
             <div className="grid grid-cols-1 md:grid-cols-2 lg:grid-cols-3 gap-6">
               {contractors.filter(c => c.name.toLowerCase().includes(contractorSearch.toLowerCase())).map((c) => (
                 <div
@@ -454,6 +504,8 @@ const BidManager: React.FC = () => {
                 </div>
               ))}
             </div>
+            <LoadMoreButton cursor={contractorsCursor} onLoadMore={loadMoreContractors} />
+            </>
           )}
         </div>
       )}
@@ -495,6 +547,8 @@ const BidManager: React.FC = () => {
                             <span className="text-green-400 flex items-center gap-1">
                               ✓ Đã lưu
                             </span>
+                          ) : file.import_error ? (
+                            <span className="text-red-400" title={file.import_error}>Lỗi lập chỉ mục</span>
                           ) : (
                             <span className="text-yellow-400">Đang chờ</span>
                           )}
@@ -507,6 +561,7 @@ const BidManager: React.FC = () => {
                   </tbody>
                 </table>
               </div>
+              <LoadMoreButton cursor={filesCursor} onLoadMore={loadMoreFiles} />
             </div>
           )}
 
@@ -797,6 +852,7 @@ const BidManager: React.FC = () => {
                     </button>
                 </div>
               )}
+              <LoadMoreButton cursor={historyCursor} onLoadMore={loadMoreHistory} />
             </div>
           )}
         </div>
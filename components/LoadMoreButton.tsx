@@ -0,0 +1,34 @@
+import React, { useState } from 'react';
+import Spinner from './Spinner';
+
+// Shown under a paginated list while the server has more rows; fetches the next page on click
+const LoadMoreButton: React.FC<{ cursor: string | null, onLoadMore: (cursor: string) => Promise<void> }> = ({ cursor, onLoadMore }) => {
+    const [loading, setLoading] = useState(false);
+    if (!cursor) return null;
+
+    const handleClick = async () => {
+        setLoading(true);
+        try {
+            await onLoadMore(cursor);
+        } catch (e) {
+            console.error(e);
+        } finally {
+            setLoading(false);
+        }
+    };
+
+    return (
+        <div className="flex justify-center mt-6">
+            <button
+                onClick={handleClick}
+                disabled={loading}
+                className="px-4 py-2 rounded border border-gray-300 disabled:opacity-50 hover:bg-gray-50 flex items-center gap-2"
+            >
+                {loading && <Spinner />}
+                Tải thêm
+            </button>
+        </div>
+    );
+};
+
+export default LoadMoreButton;
@@ -1,8 +1,10 @@
 import React, { useState, useEffect } from 'react';
 import { api, User } from '../services/api';
+import LoadMoreButton from './LoadMoreButton';
 
 const UserManagement: React.FC = () => {
     const [users, setUsers] = useState<User[]>([]);
+    const [usersCursor, setUsersCursor] = useState<string | null>(null);
     const [loading, setLoading] = useState(true);
     const [error, setError] = useState('');
     const [newUser, setNewUser] = useState({ username: '', full_name: '', password: '', role: 'user' });
@@ -14,8 +16,9 @@ const UserManagement: React.FC = () => {
 
     const fetchUsers = async () => {
         try {
-            const data = await api.getUsers();
-            setUsers(data);
+            const page = await api.getUsers();
+            setUsers(page.items);
+            setUsersCursor(page.nextCursor);
         } catch (err) {
             setError('Không thể tải danh sách người dùng.');
         } finally {
@@ -23,6 +26,12 @@ const UserManagement: React.FC = () => {
         }
     };
 
+    const loadMoreUsers = async (cursor: string) => {
+        const page = await api.getUsers(cursor);
+        setUsers(prev => [...prev, ...page.items]);
+        setUsersCursor(page.nextCursor);
+    };
+
     const handleCreateUser = async (e: React.FormEvent) => {
         e.preventDefault();
         try {
@@ -150,6 +159,7 @@ const UserManagement: React.FC = () => {
                         ))}
                     </tbody>
                 </table>
+                <LoadMoreButton cursor={usersCursor} onLoadMore={loadMoreUsers} />
             </div>
         </div>
     );
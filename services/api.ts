@@ -1,4 +1,7 @@
 const API_URL = 'http://localhost:8000';
+// Files above this size are sent in resumable chunks
+const RESUMABLE_UPLOAD_THRESHOLD = 32 * 1024 * 1024;
+const RESUMABLE_UPLOAD_ATTEMPTS = 3;
 
 export interface BidPackage {
     id: number;
@@ -31,6 +34,7 @@ export interface ContractorFile {
     gemini_file_name?: string;
     gemini_file_uri?: string;
     is_stored_in_gemini: boolean;
+    import_error?: string | null;
     created_at: string;
 }
 
@@ -70,12 +74,27 @@ const handleResponse = async (res: Response) => {
     return res.json();
 };
 
+// One page of a keyset-paginated list; nextCursor is null on the last page
+export interface Page<T> {
+    items: T[];
+    nextCursor: string | null;
+}
+
+// List endpoints are keyset-paginated: one page per call, the caller asks for the next one when it needs it
+const fetchPage = async <T,>(url: string, cursor?: string | null): Promise<Page<T>> => {
+    const pageUrl = cursor
+        ? `${url}${url.includes('?') ? '&' : '?'}cursor=${encodeURIComponent(cursor)}`
+        : url;
+    const res = await fetch(pageUrl, {
+        headers: { ...getAuthHeaders() }
+    });
+    const items: T[] = await handleResponse(res);
+    return { items, nextCursor: res.headers.get('X-Next-Cursor') };
+};
+
 export const api = {
-    async getBidPackages(): Promise<BidPackage[]> {
-        const res = await fetch(`${API_URL}/bid_packages/`, {
-            headers: { ...getAuthHeaders() }
-        });
-        return handleResponse(res);
+    async getBidPackages(cursor?: string | null): Promise<Page<BidPackage>> {
+        return fetchPage<BidPackage>(`${API_URL}/bid_packages/`, cursor);
     },
 
     async updateBidPackage(id: number, name: string, description?: string): Promise<BidPackage> {
@@ -108,11 +127,8 @@ export const api = {
         return handleResponse(res);
     },
 
-    async getContractors(bidPackageId: number): Promise<Contractor[]> {
-        const res = await fetch(`${API_URL}/bid_packages/${bidPackageId}/contractors`, {
-            headers: { ...getAuthHeaders() }
-        });
-        return handleResponse(res);
+    async getContractors(bidPackageId: number, cursor?: string | null): Promise<Page<Contractor>> {
+        return fetchPage<Contractor>(`${API_URL}/bid_packages/${bidPackageId}/contractors`, cursor);
     },
 
     async createContractor(name: string, bidPackageId: number): Promise<Contractor> {
@@ -142,18 +158,96 @@ export const api = {
         if (!res.ok) throw new Error('Failed to delete contractor');
     },
 
-    async processContractorFiles(contractorId: number, files: File[]): Promise<{ status: string, message: string }> {
-        const formData = new FormData();
-        for (let i = 0; i < files.length; i++) {
-            formData.append('files', files[i]);
+    async processContractorFiles(contractorId: number, files: File[]): Promise<{ status: string, message: string, files: { filename: string, status: string, error?: string }[] }> {
+        // Large files go through resumable chunked uploads, the rest in one multipart request
+        const large = files.filter(f => f.size > RESUMABLE_UPLOAD_THRESHOLD);
+        const small = files.filter(f => f.size <= RESUMABLE_UPLOAD_THRESHOLD);
+        const results: { filename: string, status: string, error?: string }[] = [];
+
+        for (const file of large) {
+            try {
+                const res = await api.uploadFileResumable(contractorId, file);
+                results.push(res.file);
+            } catch (e) {
+                results.push({ filename: file.name, status: 'failed', error: String(e) });
+            }
+        }
+
+        if (small.length > 0) {
+            const formData = new FormData();
+            for (let i = 0; i < small.length; i++) {
+                formData.append('files', small[i]);
+            }
+
+            // One key for this submission: a resend after a dropped connection gets the first answer
+            // back instead of importing the files a second time
+            const idempotencyKey = crypto.randomUUID();
+            let res: Response;
+            for (let attempt = 1; ; attempt++) {
+                try {
+                    res = await fetch(`${API_URL}/contractors/${contractorId}/process-files`, {
+                        method: 'POST',
+                        headers: { ...getAuthHeaders(), 'Idempotency-Key': idempotencyKey },
+                        body: formData
+                    });
+                    break;
+                } catch (e) {
+                    if (attempt >= RESUMABLE_UPLOAD_ATTEMPTS) throw e;
+                    await new Promise(resolve => setTimeout(resolve, 1000 * attempt));
+                }
+            }
+            if (large.length === 0) return handleResponse(res);
+            try {
+                results.push(...(await handleResponse(res)).files);
+            } catch (e) {
+                small.forEach(f => results.push({ filename: f.name, status: 'failed', error: String(e) }));
+            }
         }
 
-        const res = await fetch(`${API_URL}/contractors/${contractorId}/process-files`, {
+        const failed = results.filter(r => r.status === 'failed').length;
+        if (failed === results.length) throw new Error(results.map(r => `${r.filename}: ${r.error}`).join('; '));
+        return {
+            status: failed ? 'partial' : 'success',
+            message: `Đã xử lý ${results.length - failed}/${results.length} tệp`,
+            files: results
+        };
+    },
+
+    // Uploads a file in chunks; a chunk that fails is retried and the session resumes where it stopped
+    async uploadFileResumable(contractorId: number, file: File): Promise<{ status: string, file: any }> {
+        const res = await fetch(`${API_URL}/contractors/${contractorId}/uploads`, {
             method: 'POST',
-            headers: { ...getAuthHeaders() }, 
-            body: formData
+            headers: { ...getAuthHeaders(), 'Content-Type': 'application/json' },
+            body: JSON.stringify({ filename: file.name, size: file.size, content_type: file.type || null })
         });
-        return handleResponse(res);
+        const session = await handleResponse(res);
+
+        for (const offset of session.missing_offsets as number[]) {
+            const chunk = await file.slice(offset, offset + session.chunk_size).arrayBuffer();
+            const digest = await crypto.subtle.digest('SHA-256', chunk);
+            const checksum = Array.from(new Uint8Array(digest)).map(b => b.toString(16).padStart(2, '0')).join('');
+            for (let attempt = 1; ; attempt++) {
+                try {
+                    const chunkRes = await fetch(`${API_URL}/uploads/${session.upload_id}/chunks?offset=${offset}`, {
+                        method: 'PUT',
+                        headers: { ...getAuthHeaders(), 'X-Chunk-SHA256': checksum },
+                        body: chunk
+                    });
+                    await handleResponse(chunkRes);
+                    break;
+                } catch (e) {
+                    if (attempt >= RESUMABLE_UPLOAD_ATTEMPTS) throw e;
+                    await new Promise(resolve => setTimeout(resolve, 1000 * attempt));
+                }
+            }
+        }
+
+        // Keyed by session: finalizing the same upload again replays the first answer instead of re-importing
+        const finalRes = await fetch(`${API_URL}/uploads/${session.upload_id}/finalize`, {
+            method: 'POST',
+            headers: { ...getAuthHeaders(), 'Idempotency-Key': `finalize-${session.upload_id}` }
+        });
+        return handleResponse(finalRes);
     },
 
     async evaluateContractor(contractorId: number, prompts: string[]): Promise<{ status: string, results: any[] }> {
@@ -166,16 +260,109 @@ export const api = {
             headers: { ...getAuthHeaders() },
             body: formData
         });
+        const { job_id } = await handleResponse(res);
+
+        // Evaluation runs as a background job, poll until it finishes
+        let job = await api.getEvaluationJob(job_id);
+        while (job.status === 'pending' || job.status === 'running') {
+            await new Promise(resolve => setTimeout(resolve, 2000));
+            job = await api.getEvaluationJob(job_id);
+        }
+        return { status: job.status, results: job.results };
+    },
+
+    // Streams results as NDJSON frames: each finished criterion is passed to onResult right away
+    async evaluateContractorStream(
+        contractorId: number,
+        prompts: string[],
+        onResult: (result: any) => void
+    ): Promise<{ status: string, average_score: number | null }> {
+        const formData = new FormData();
+        formData.append('contractor_id', contractorId.toString());
+        formData.append('prompts', JSON.stringify(prompts));
+        formData.append('format', 'ndjson');
+
+        const res = await fetch(`${API_URL}/evaluate/stream`, {
+            method: 'POST',
+            headers: { ...getAuthHeaders() },
+            body: formData
+        });
+        if (!res.ok || !res.body) {
+            return handleResponse(res);
+        }
+
+        const reader = res.body.getReader();
+        const decoder = new TextDecoder();
+        let buffer = '';
+        let summary: any = null;
+        while (true) {
+            const { done, value } = await reader.read();
+            if (done) break;
+            buffer += decoder.decode(value, { stream: true });
+            const lines = buffer.split('\n');
+            buffer = lines.pop() || '';
+            for (const line of lines) {
+                if (!line.trim()) continue;
+                const frame = JSON.parse(line);
+                if (frame.type === 'result') onResult(frame);
+                else if (frame.type === 'summary') summary = frame;
+            }
+        }
+        if (!summary) throw new Error('Evaluation stream ended before the summary');
+        return summary;
+    },
+
+    async getEvaluationJob(jobId: string): Promise<{ job_id: string, status: string, results: any[] }> {
+        const res = await fetch(`${API_URL}/evaluate/jobs/${jobId}`, {
+            headers: { ...getAuthHeaders() }
+        });
         return handleResponse(res);
     },
     
-    async getEvaluations(contractorId: number): Promise<EvaluationResult[]> {
-        const res = await fetch(`${API_URL}/evaluations/${contractorId}`, {
+    async getEvaluations(contractorId: number, cursor?: string | null): Promise<Page<EvaluationResult>> {
+        return fetchPage<EvaluationResult>(`${API_URL}/evaluations/${contractorId}`, cursor);
+    },
+
+    // One request for the whole package instead of getEvaluations per contractor
+    async getPackageComparison(
+        bidPackageId: number,
+        criteriaSetId: number,
+        selection: 'latest_run' | 'latest' = 'latest_run',
+        normalization: 'scale' | 'minmax' = 'scale'
+    ): Promise<{
+        criteria: { index: number, prompt: string, weight: number, weight_share: number }[],
+        contractors: {
+            contractor_id: number, name: string, scores: (number | null)[], normalized: (number | null)[],
+            weighted_score: number, coverage: number, rank: number
+        }[]
+    }> {
+        const params = new URLSearchParams({
+            criteria_set_id: String(criteriaSetId), selection, normalization
+        });
+        const res = await fetch(`${API_URL}/bid_packages/${bidPackageId}/comparison?${params}`, {
             headers: { ...getAuthHeaders() }
         });
         return handleResponse(res);
     },
 
+    // Full evaluation record of a package as a file; the server streams it, the browser gets a Blob
+    async exportBidPackage(
+        bidPackageId: number,
+        format: 'csv' | 'xlsx' = 'csv',
+        filters: { contractorId?: number, criteriaSetId?: number, createdFrom?: string, createdTo?: string } = {}
+    ): Promise<Blob> {
+        const params = new URLSearchParams({ format });
+        if (filters.contractorId !== undefined) params.set('contractor_id', String(filters.contractorId));
+        if (filters.criteriaSetId !== undefined) params.set('criteria_set_id', String(filters.criteriaSetId));
+        if (filters.createdFrom) params.set('created_from', filters.createdFrom);
+        if (filters.createdTo) params.set('created_to', filters.createdTo);
+        const res = await fetch(`${API_URL}/bid_packages/${bidPackageId}/export?${params}`, {
+            headers: { ...getAuthHeaders() }
+        });
+        if (!res.ok) return handleResponse(res);
+        return res.blob();
+    },
+
     async deleteEvaluation(id: number): Promise<void> {
         const res = await fetch(`${API_URL}/evaluations/${id}`, {
             method: 'DELETE',
@@ -185,11 +372,8 @@ export const api = {
         if (!res.ok) throw new Error('Failed to delete evaluation');
     },
 
-    async getContractorFiles(contractorId: number): Promise<ContractorFile[]> {
-        const res = await fetch(`${API_URL}/contractors/${contractorId}/files`, {
-            headers: { ...getAuthHeaders() }
-        });
-        return handleResponse(res);
+    async getContractorFiles(contractorId: number, cursor?: string | null): Promise<Page<ContractorFile>> {
+        return fetchPage<ContractorFile>(`${API_URL}/contractors/${contractorId}/files`, cursor);
     },
 
     // Auth & User Management
@@ -211,11 +395,8 @@ export const api = {
         return res.json();
     },
 
-    async getUsers(): Promise<User[]> {
-        const res = await fetch(`${API_URL}/users/`, {
-            headers: { ...getAuthHeaders() }
-        });
-        return handleResponse(res);
+    async getUsers(cursor?: string | null): Promise<Page<User>> {
+        return fetchPage<User>(`${API_URL}/users/`, cursor);
     },
 
     async createUser(user: any): Promise<User> {
@@ -251,7 +432,11 @@ export const api = {
             headers: { 'Content-Type': 'application/json', ...getAuthHeaders() },
             body: JSON.stringify(data)
         });
-        await handleResponse(res);
+        const result = await handleResponse(res);
+        // Changing the password revokes older tokens, keep using the fresh one
+        if (result.access_token) {
+            localStorage.setItem('token', result.access_token);
+        }
     }
 };
 